@@ -1,10 +1,82 @@
+from django.conf import settings
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connection
+from django.utils.functional import cached_property
+from django.utils.text import smart_split, unescape_string_literal
 from .models import (
-    Category, Product, ProductSpecification, Review, 
+    Category, Product, ProductSpecification, Review,
     Order, OrderItem, OrderDocument, UserProfile
 )
 
 
+class EstimatedCountPaginator(Paginator):
+    """Paginator that estimates the size of large unfiltered tables instead of counting them.
+
+    An unfiltered change list asks the database for its own row estimate
+    (pg_class.reltuples on PostgreSQL, the highest primary key elsewhere) and
+    only runs COUNT(*) when the estimate is below ADMIN_EXACT_COUNT_THRESHOLD.
+    Filtered and searched lists are counted exactly.
+    """
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is not None and not query.where:
+            estimate = self.estimate(self.object_list.model)
+            if estimate is not None and estimate >= settings.ADMIN_EXACT_COUNT_THRESHOLD:
+                return estimate
+        return super().count
+
+    @staticmethod
+    def estimate(model):
+        table = model._meta.db_table
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s', [table])
+            else:
+                pk = model._meta.pk.column
+                cursor.execute(
+                    f'SELECT MAX({connection.ops.quote_name(pk)}) FROM {connection.ops.quote_name(table)}'
+                )
+            row = cursor.fetchone()
+        return int(row[0]) if row and row[0] is not None and row[0] >= 0 else None
+
+
+# Search field prefixes used by the admins below and the lookups they stand for
+SEARCH_LOOKUPS = {'^': 'istartswith', '=': 'iexact'}
+
+
+class ScalableAdmin(admin.ModelAdmin):
+    """Change list defaults for tables with millions of rows.
+
+    Search fields must use the '^' or '=' prefix and have a case-insensitive
+    index (migration 0017).
+    """
+    paginator = EstimatedCountPaginator
+    # Skip the second COUNT(*) over the whole table shown next to filtered results
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        # The default search ORs the fields' lookups in one WHERE clause, and
+        # when they are on different tables no index can serve the OR. Each
+        # field is searched on its own index here and the matching ids combined.
+        lookups = [
+            f'{field[1:]}__{SEARCH_LOOKUPS[field[0]]}' for field in self.get_search_fields(request)
+        ]
+        if not lookups:
+            return queryset, False
+        for bit in smart_split(search_term):
+            if bit.startswith(('"', "'")) and bit[0] == bit[-1]:
+                bit = unescape_string_literal(bit)
+            matches = [
+                self.model._default_manager.filter(**{lookup: bit}).values('pk').order_by()
+                for lookup in lookups
+            ]
+            queryset = queryset.filter(pk__in=matches[0].union(*matches[1:]))
+        return queryset, False
+
+
 # ProductImageInline removed - using only the image field in Product model
 
 
@@ -14,10 +86,13 @@ class ProductSpecificationInline(admin.TabularInline):
 
 
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin):
+class ProductAdmin(ScalableAdmin):
     list_display = ('name', 'seller', 'category', 'price', 'available_quantity', 'is_active', 'created_at')
-    list_filter = ('is_active', 'category', 'created_at')
-    search_fields = ('name', 'description', 'seller__username', 'category__name')
+    list_select_related = ('seller', 'category')
+    list_filter = ('is_active', 'created_at')
+    # Prefix and exact lookups on indexed columns instead of %term% scans
+    search_fields = ('^name', '=seller__username', '^category__name')
+    autocomplete_fields = ('seller', 'category')
     inlines = [ProductSpecificationInline]
 
 
@@ -26,6 +101,11 @@ class OrderItemInline(admin.TabularInline):
     extra = 0
     readonly_fields = ('product', 'quantity', 'price')
 
+    def get_queryset(self, request):
+        # The read-only product column renders each item's product; load them
+        # with the items rather than one query per row
+        return super().get_queryset(request).select_related('product')
+
 
 class OrderDocumentInline(admin.TabularInline):
     model = OrderDocument
@@ -33,29 +113,37 @@ class OrderDocumentInline(admin.TabularInline):
 
 
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(ScalableAdmin):
     list_display = ('id', 'user', 'total_amount', 'status', 'destination_country', 'created_at')
-    list_filter = ('status', 'created_at', 'destination_country')
-    search_fields = ('user__username', 'shipping_address', 'notes')
+    list_select_related = ('user',)
+    list_filter = ('status', 'created_at')
+    search_fields = ('=user__username', '=user__email')
+    autocomplete_fields = ('user',)
     inlines = [OrderItemInline, OrderDocumentInline]
     readonly_fields = ('total_amount',)
 
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
-    list_display = ('name', 'created_at')
-    search_fields = ('name', 'description')
+    list_display = ('name', 'parent', 'created_at')
+    list_select_related = ('parent',)
+    search_fields = ('^name',)
+    autocomplete_fields = ('parent',)
 
 
 @admin.register(Review)
-class ReviewAdmin(admin.ModelAdmin):
+class ReviewAdmin(ScalableAdmin):
     list_display = ('product', 'user', 'rating', 'created_at')
+    list_select_related = ('product', 'user')
     list_filter = ('rating', 'created_at')
-    search_fields = ('product__name', 'user__username', 'comment')
+    search_fields = ('^product__name', '=user__username')
+    autocomplete_fields = ('product', 'user')
 
 
 @admin.register(UserProfile)
-class UserProfileAdmin(admin.ModelAdmin):
+class UserProfileAdmin(ScalableAdmin):
     list_display = ('user', 'company_name', 'user_type', 'country', 'verified')
-    list_filter = ('user_type', 'verified', 'country')
-    search_fields = ('user__username', 'company_name', 'phone_number')
+    list_select_related = ('user',)
+    list_filter = ('user_type', 'verified')
+    search_fields = ('=user__username', '^company_name')
+    autocomplete_fields = ('user',)
@@ -0,0 +1,142 @@
+"""
+Archival of cold rows.
+
+Orders that were delivered or cancelled more than
+settings.ORDER_ARCHIVE_AFTER_DAYS ago, and products that have been inactive
+for settings.PRODUCT_ARCHIVE_AFTER_DAYS and appear in no live order, are
+moved in batches to ArchivedOrder / ArchivedProduct. An archived row keeps
+its primary key and the exact representation the API served for it, so
+order history, order detail and product detail read it back unchanged while
+the hot tables and their indexes only hold live data. The stored files of
+an archived order's documents stay where they are and are listed in
+ArchivedOrderDocument, so their owner can still download them.
+
+The deletions are logged for delta sync as archived rather than deleted
+(see sync.py).
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import BooleanField, Value
+from django.utils import timezone
+
+from . import fast_serializers, sync
+from .models import (
+    ArchivedOrder, ArchivedOrderDocument, ArchivedProduct, Order, OrderDocument, OrderItem, Product,
+    StockReservation,
+)
+
+ARCHIVED_ORDER_STATUSES = ('delivered', 'cancelled')
+# Snapshots store media URLs relative to the site; these keys are made absolute on read
+FILE_KEYS = ('image', 'document', 'profile_picture')
+
+
+def archivable_orders(now=None):
+    cutoff = (now or timezone.now()) - timedelta(days=settings.ORDER_ARCHIVE_AFTER_DAYS)
+    # Committed stock must be rolled up into the product before its reservation goes
+    pending_stock = StockReservation.objects.filter(status='committed', rolled_up=False)
+    return Order.objects.filter(
+        status__in=ARCHIVED_ORDER_STATUSES, updated_at__lt=cutoff
+    ).exclude(pk__in=pending_stock.values('order_id'))
+
+
+def archivable_products(now=None):
+    cutoff = (now or timezone.now()) - timedelta(days=settings.PRODUCT_ARCHIVE_AFTER_DAYS)
+    return Product.objects.filter(is_active=False, updated_at__lt=cutoff).exclude(
+        pk__in=OrderItem.objects.values('product_id')
+    )
+
+
+def _archive_batches(queryset, compiled, archive_model, columns, batch_size):
+    """Copy rows to `archive_model` and delete them, one transaction per batch."""
+    archived = 0
+    while True:
+        with transaction.atomic():
+            pks = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                return archived
+            data = compiled.serialize_by_pk(pks)
+            archived_rows = []
+            for row in queryset.model.objects.filter(pk__in=pks).values('pk', *columns):
+                pk = row.pop('pk')
+                archived_rows.append(archive_model(id=pk, data=data[pk], **row))
+            archive_model.objects.bulk_create(archived_rows)
+            if archive_model is ArchivedOrder:
+                ArchivedOrderDocument.objects.bulk_create(
+                    ArchivedOrderDocument(order_id=order_id, document=document)
+                    for order_id, document in OrderDocument.objects.filter(
+                        order_id__in=pks
+                    ).values_list('order_id', 'document')
+                )
+            with sync.archiving():
+                queryset.model.objects.filter(pk__in=pks).delete()
+        archived += len(pks)
+
+
+def archive_orders(batch_size=None, now=None):
+    """Move cold orders, with their items and documents, to the archive. Returns the number moved."""
+    return _archive_batches(
+        archivable_orders(now), fast_serializers.order_serializer(), ArchivedOrder,
+        ('user_id', 'status', 'created_at'), batch_size or settings.ARCHIVE_BATCH_SIZE,
+    )
+
+
+def archive_products(batch_size=None, now=None):
+    """Move long-inactive products that no live order refers to. Returns the number moved."""
+    return _archive_batches(
+        archivable_products(now), fast_serializers.product_serializer(), ArchivedProduct,
+        ('seller_id', 'name', 'created_at'), batch_size or settings.ARCHIVE_BATCH_SIZE,
+    )
+
+
+def absolute_urls(data, request):
+    """Make the media URLs in an archived representation absolute, as the live serializers do."""
+    if isinstance(data, list):
+        for item in data:
+            absolute_urls(item, request)
+    elif isinstance(data, dict):
+        for key, value in data.items():
+            if key in FILE_KEYS and isinstance(value, str) and value.startswith('/'):
+                data[key] = request.build_absolute_uri(value)
+            else:
+                absolute_urls(value, request)
+    return data
+
+
+def archived_order(pk, request):
+    queryset = ArchivedOrder.objects.filter(pk=pk)
+    if not request.user.is_staff:
+        queryset = queryset.filter(user=request.user)
+    data = queryset.values_list('data', flat=True).first()
+    return None if data is None else absolute_urls(data, request)
+
+
+def archived_product(pk, request):
+    data = ArchivedProduct.objects.filter(pk=pk).values_list('data', flat=True).first()
+    return None if data is None else absolute_urls(data, request)
+
+
+def order_history(user, start, end):
+    """Return ([(order id, is_archived)], total) for a page of the user's live and archived orders, newest first."""
+    live = Order.objects.filter(user=user).values_list(
+        'created_at', 'id', Value(False, output_field=BooleanField())
+    )
+    archived = ArchivedOrder.objects.filter(user=user).values_list(
+        'created_at', 'id', Value(True, output_field=BooleanField())
+    )
+    rows = live.order_by().union(archived.order_by(), all=True).order_by('-created_at', '-id')[start:end]
+    total = Order.objects.filter(user=user).count() + ArchivedOrder.objects.filter(user=user).count()
+    return [(pk, is_archived) for _, pk, is_archived in rows], total
+
+
+def history_page(entries, request):
+    """Serialize an order_history() page: live orders through the fast path, archived ones from the archive."""
+    live = fast_serializers.order_serializer().serialize_by_pk(
+        [pk for pk, is_archived in entries if not is_archived], request
+    )
+    archived = dict(ArchivedOrder.objects.filter(
+        pk__in=[pk for pk, is_archived in entries if is_archived]
+    ).values_list('pk', 'data'))
+    absolute_urls(list(archived.values()), request)
+    return [archived[pk] if is_archived else live[pk] for pk, is_archived in entries]
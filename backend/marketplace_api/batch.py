@@ -0,0 +1,74 @@
+from io import BytesIO
+from urllib.parse import urlsplit
+
+from asgiref.sync import iscoroutinefunction
+from django.core.handlers.wsgi import WSGIRequest
+from django.http import Http404
+from django.urls import Resolver404, resolve, reverse
+
+
+# Credentials are passed to sub-requests by BatchSubRequestAuthentication instead
+_DROPPED_HEADERS = ('HTTP_AUTHORIZATION', 'HTTP_COOKIE')
+
+
+def _sub_request(request, path, query_string):
+    environ = {
+        key: value for key, value in request.META.items()
+        if key.isupper() and not key.startswith('CONTENT_') and key not in _DROPPED_HEADERS
+    }
+    environ.update({
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': path,
+        'SCRIPT_NAME': '',
+        'QUERY_STRING': query_string,
+        'wsgi.input': BytesIO(b''),
+        'wsgi.url_scheme': request.scheme,
+    })
+    sub = WSGIRequest(environ)
+    # Reuse the already authenticated user instead of re-running the token lookup
+    if request.user.is_authenticated:
+        sub.batch_credentials = (request.user, request.auth)
+    return sub
+
+
+def _resolve(path):
+    """Return (resolver match or None, full path, query string) for a path relative to the API root."""
+    parts = urlsplit(path)
+    full_path = reverse('api-root') + parts.path.lstrip('/')
+    try:
+        return resolve(full_path), full_path, parts.query
+    except Resolver404:
+        return None, full_path, parts.query
+
+
+def is_async(path):
+    """Whether the path is served by an async view (e.g. a stream), which cannot be batched."""
+    match, _, _ = _resolve(path)
+    return match is not None and iscoroutinefunction(match.func)
+
+
+def dispatch(request, path):
+    """Run a GET against another API endpoint in-process and return (status, data)."""
+    match, full_path, query = _resolve(path)
+    if match is None:
+        return 404, {'detail': 'Not found.'}
+
+    sub = _sub_request(request, full_path, query)
+    try:
+        response = match.func(sub, *match.args, **match.kwargs)
+    except Http404:
+        return 404, {'detail': 'Not found.'}
+    return response.status_code, getattr(response, 'data', None)
+
+
+def run(request, sub_requests):
+    """Resolve a list of sub-requests, running each distinct path only once."""
+    results = {}
+    responses = []
+    for item in sub_requests:
+        path = item['path']
+        if path not in results:
+            results[path] = dispatch(request, path)
+        status_code, data = results[path]
+        responses.append({'id': item.get('id', path), 'status': status_code, 'body': data})
+    return responses
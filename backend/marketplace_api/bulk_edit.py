@@ -0,0 +1,71 @@
+"""
+Bulk edits of a seller's products.
+
+All products are loaded with one query. If every entry makes the same change
+(e.g. deactivating a set of listings) it is applied with a single UPDATE;
+otherwise the rows are written with bulk_update. Side effects that
+Product.save() and its signals would trigger per row (base-currency price,
+stock shard rebalancing, the suggestion index, outbox events) run once for
+the batch.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from . import currency, inventory, outbox, suggest
+from .models import Product
+
+BULK_FIELDS = ('id', 'seller_id', 'name', 'price', 'currency', 'available_quantity', 'is_active', 'lead_time')
+
+
+class NotFound(Exception):
+    def __init__(self, ids):
+        super().__init__(ids)
+        self.ids = ids
+
+
+class NotOwner(Exception):
+    pass
+
+
+def load_products(user, ids):
+    """Return the products with the given ids, checking that `user` may edit all of them."""
+    products = list(Product.objects.filter(pk__in=ids).only(*BULK_FIELDS).order_by('pk'))
+    missing = set(ids) - {product.pk for product in products}
+    if missing:
+        raise NotFound(sorted(missing))
+    if not user.is_staff and any(product.seller_id != user.id for product in products):
+        raise NotOwner()
+    return products
+
+
+def apply_changes(products, changes):
+    """Apply {product id: {field: value}} to the loaded products and save them in one go."""
+    now = timezone.now()
+    fields = set()
+    for product in products:
+        for field, value in changes[product.pk].items():
+            setattr(product, field, value)
+            fields.add(field)
+        if 'price' in changes[product.pk]:
+            product.price_base = currency.to_base(product.price, product.currency)
+        product.updated_at = now
+
+    distinct = {tuple(sorted(change.items())) for change in changes.values()}
+    with transaction.atomic():
+        if len(distinct) == 1 and 'price' not in fields:
+            Product.objects.filter(pk__in=changes).update(updated_at=now, **dict(distinct.pop()))
+        else:
+            if 'price' in fields:
+                fields.add('price_base')
+            Product.objects.bulk_update(products, sorted(fields) + ['updated_at'], batch_size=500)
+        outbox.record_many(
+            (product, outbox.pending_changes(product, changes[product.pk])) for product in products
+        )
+
+        if 'available_quantity' in fields:
+            inventory.rebalance_many([pk for pk, change in changes.items() if 'available_quantity' in change])
+
+    if 'is_active' in fields:
+        for product in products:
+            suggest.update_product(product)
+    return products
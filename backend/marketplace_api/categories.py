@@ -0,0 +1,53 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Category
+
+TREE_CACHE_KEY = 'category_tree'
+
+
+def _build_tree():
+    nodes = {}
+    roots = []
+    paths = {}
+    rows = Category.objects.order_by('path').values('id', 'name', 'parent_id', 'path', 'depth')
+    for row in rows:
+        node = {'id': row['id'], 'name': row['name'], 'depth': row['depth'], 'children': []}
+        nodes[row['id']] = node
+        paths[row['id']] = row['path']
+        # Ordering by path guarantees a parent is seen before its children
+        if row['parent_id'] is None:
+            roots.append(node)
+        else:
+            nodes[row['parent_id']]['children'].append(node)
+    return {'roots': roots, 'paths': paths}
+
+
+def category_tree():
+    """Return the full navigation tree, built with one query.
+
+    Category writes drop the cached tree, but with a per-process cache only
+    in the writing process; others rebuild it after CATEGORY_TREE_CACHE_TIMEOUT.
+    """
+    tree = cache.get(TREE_CACHE_KEY)
+    if tree is None:
+        tree = _build_tree()
+        cache.set(TREE_CACHE_KEY, tree, settings.CATEGORY_TREE_CACHE_TIMEOUT)
+    return tree
+
+
+def subtree_path(category_id):
+    """Return the materialized path of a category, or None if it does not exist."""
+    try:
+        category_id = int(category_id)
+    except (TypeError, ValueError):
+        return None
+    path = category_tree()['paths'].get(category_id)
+    if path is None:
+        # Created since this process cached the tree, or unknown
+        path = Category.objects.filter(pk=category_id).values_list('path', flat=True).first()
+    return path
+
+
+def invalidate_tree():
+    cache.delete(TREE_CACHE_KEY)
@@ -0,0 +1,92 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+
+RATES_CACHE_KEY = 'fx_rates'
+BASE_QUANTUM = Decimal('0.0001')
+DISPLAY_QUANTUM = Decimal('0.01')
+
+
+class UnknownCurrency(Exception):
+    pass
+
+
+def get_rates():
+    """Return {currency: rate} against the base currency, loaded with one query.
+
+    Rate changes drop the cached rates, but with a per-process cache only in
+    the writing process; others reload them after EXCHANGE_RATES_CACHE_TIMEOUT.
+    """
+    rates = cache.get(RATES_CACHE_KEY)
+    if rates is None:
+        from .models import ExchangeRate
+        rates = dict(ExchangeRate.objects.values_list('currency', 'rate'))
+        rates[settings.BASE_CURRENCY] = Decimal(1)
+        cache.set(RATES_CACHE_KEY, rates, settings.EXCHANGE_RATES_CACHE_TIMEOUT)
+    return rates
+
+
+def get_rate(currency):
+    currency = currency.upper()
+    rates = get_rates()
+    if currency in rates:
+        return rates[currency]
+    # Possibly added by another process since the rates were cached
+    from .models import ExchangeRate
+    rate = ExchangeRate.objects.filter(currency=currency).values_list('rate', flat=True).first()
+    if rate is None:
+        raise UnknownCurrency(currency)
+    invalidate_rates()
+    return rate
+
+
+def to_base(amount, currency):
+    if amount is None:
+        return None
+    if currency.upper() == settings.BASE_CURRENCY:
+        return Decimal(amount).quantize(BASE_QUANTUM)
+    return (Decimal(amount) / get_rate(currency)).quantize(BASE_QUANTUM, ROUND_HALF_UP)
+
+
+def from_base(amount, currency):
+    return (Decimal(amount) * get_rate(currency)).quantize(BASE_QUANTUM, ROUND_HALF_UP)
+
+
+def convert_page(items, currency, price_key='price', currency_key='currency'):
+    """Add display_price/display_currency to serialized rows.
+
+    One conversion factor is computed per source currency on the page, then
+    applied to every row. Rows priced in a currency whose rate has since been
+    deleted get a null display_price.
+    """
+    target = currency.upper()
+    target_rate = get_rate(target)
+    factors = {}
+    for item in items:
+        source = item[currency_key]
+        if source not in factors:
+            try:
+                factors[source] = target_rate / get_rate(source)
+            except UnknownCurrency:
+                factors[source] = None
+        price = item[price_key]
+        item['display_price'] = None if price is None or factors[source] is None else '{:f}'.format(
+            (Decimal(price) * factors[source]).quantize(DISPLAY_QUANTUM, ROUND_HALF_UP)
+        )
+        item['display_currency'] = target
+    return items
+
+
+def reprice_products(currency):
+    """Recompute the normalized price of every product priced in `currency` with one UPDATE."""
+    from .models import Product
+    currency = currency.upper()
+    if currency == settings.BASE_CURRENCY:
+        return Product.objects.filter(currency=currency).update(price_base=F('price'))
+    return Product.objects.filter(currency=currency).update(price_base=F('price') / get_rate(currency))
+
+
+def invalidate_rates():
+    cache.delete(RATES_CACHE_KEY)
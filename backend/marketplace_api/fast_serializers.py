@@ -0,0 +1,175 @@
+"""
+Read-only fast path for hot list endpoints.
+
+A CompiledSerializer is built once from a ModelSerializer class. It reads rows
+with `.values()`, converts each column with a converter chosen up front from
+the corresponding serializer field, and loads nested relations with one query
+per relation, producing the same data as the ModelSerializer it mirrors.
+"""
+from rest_framework import serializers
+
+from .models import Product
+from .serializers import CategorySerializer, ProductSerializer, OrderSerializer
+
+# Fields whose to_representation() is a no-op for values already read from the database
+IDENTITY_FIELDS = (
+    serializers.CharField, serializers.IntegerField, serializers.BooleanField,
+    serializers.ChoiceField, serializers.ReadOnlyField, serializers.PrimaryKeyRelatedField,
+)
+
+
+def file_url(storage):
+    def convert(name, request):
+        if not name:
+            return None
+        url = storage.url(name)
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+    return convert
+
+
+class CompiledSerializer:
+    def __init__(self, serializer_class, method_fields=None):
+        self.model = serializer_class.Meta.model
+        self.method_fields = method_fields or {}
+        self.keys = []
+        self.columns = ['pk']
+        self.plain = []          # (key, column, converter or None)
+        self.files = []          # (key, column, converter)
+        self.nested = []         # (key, fk column, CompiledSerializer)
+        self.many = []           # (key, fk column on the child, CompiledSerializer)
+
+        for key, field in serializer_class().fields.items():
+            if field.write_only:
+                continue
+            self.keys.append(key)
+            if isinstance(field, serializers.SerializerMethodField):
+                if key not in self.method_fields:
+                    raise ValueError(f'No fast-path handler for {serializer_class.__name__}.{key}')
+                column = self.method_fields[key][0]
+                if column:
+                    self.columns.append(column)
+            elif isinstance(field, serializers.ListSerializer):
+                relation = self.model._meta.get_field(field.source)
+                self.many.append((key, relation.field.attname, compile_serializer(type(field.child))))
+            elif isinstance(field, serializers.BaseSerializer):
+                fk = self.model._meta.get_field(field.source)
+                self.columns.append(fk.attname)
+                self.nested.append((key, fk.attname, compile_serializer(type(field))))
+            elif isinstance(field, serializers.FileField):
+                storage = self.model._meta.get_field(field.source).storage
+                self.columns.append(field.source)
+                self.files.append((key, field.source, file_url(storage)))
+            else:
+                self.columns.append(field.source)
+                converter = None if isinstance(field, IDENTITY_FIELDS) else field.to_representation
+                self.plain.append((key, field.source, converter))
+
+    def serialize_queryset(self, queryset, request=None, group_by=None):
+        columns = self.columns
+        if group_by and group_by not in columns:
+            columns = columns + [group_by]
+        rows = list(queryset.values(*columns))
+        return rows, self.serialize_rows(rows, request)
+
+    def serialize_rows(self, rows, request=None):
+        results = []
+        for row in rows:
+            item = dict.fromkeys(self.keys)
+            for key, column, converter in self.plain:
+                value = row[column]
+                item[key] = value if converter is None or value is None else converter(value)
+            for key, column, converter in self.files:
+                item[key] = converter(row[column], request)
+            results.append(item)
+
+        for key, column, child in self.nested:
+            ids = {row[column] for row in rows if row[column] is not None}
+            by_id = child.serialize_by_pk(ids, request)
+            for row, item in zip(rows, results):
+                item[key] = by_id.get(row[column])
+
+        if self.many:
+            pks = [row['pk'] for row in rows]
+            for key, fk_column, child in self.many:
+                groups = child.serialize_grouped(pks, fk_column, request)
+                for row, item in zip(rows, results):
+                    item[key] = groups.get(row['pk'], [])
+
+        for key, (column, handler) in self.method_fields.items():
+            for row, item in zip(rows, results):
+                item[key] = handler(row.get(column), item, request)
+        return results
+
+    def serialize_by_pk(self, pks, request=None):
+        if not pks:
+            return {}
+        rows, results = self.serialize_queryset(
+            self.model._default_manager.filter(pk__in=pks), request
+        )
+        return {row['pk']: item for row, item in zip(rows, results)}
+
+    def serialize_grouped(self, parent_pks, fk_column, request=None):
+        groups = {}
+        if not parent_pks:
+            return groups
+        queryset = self.model._default_manager.filter(**{f'{fk_column}__in': parent_pks})
+        rows, results = self.serialize_queryset(queryset, request, group_by=fk_column)
+        for row, item in zip(rows, results):
+            groups.setdefault(row[fk_column], []).append(item)
+        return groups
+
+    def serialize(self, queryset, request=None):
+        return self.serialize_queryset(queryset, request)[1]
+
+    def serialize_page(self, pks, request=None):
+        """Serialize the objects with the given primary keys, preserving their order."""
+        by_pk = self.serialize_by_pk(pks, request)
+        return [by_pk[pk] for pk in pks if pk in by_pk]
+
+
+_compiled = {}
+
+
+def compile_serializer(serializer_class):
+    if serializer_class not in _compiled:
+        _compiled[serializer_class] = CompiledSerializer(
+            serializer_class, METHOD_FIELDS.get(serializer_class)
+        )
+    return _compiled[serializer_class]
+
+
+_product_image_url = file_url(Product._meta.get_field('image').storage)
+
+
+def _product_image(name, item, request):
+    return _product_image_url(name, request)
+
+
+def _average_rating(value, item, request):
+    reviews = item['reviews']
+    if reviews:
+        return sum(review['rating'] for review in reviews) / len(reviews)
+    return 0
+
+
+# SerializerMethodField handlers: key -> (column to read or None, handler(value, item, request))
+METHOD_FIELDS = {
+    ProductSerializer: {
+        'image': ('image', _product_image),
+        'average_rating': (None, _average_rating),
+    },
+}
+
+
+def product_serializer():
+    return compile_serializer(ProductSerializer)
+
+
+def order_serializer():
+    return compile_serializer(OrderSerializer)
+
+
+def category_serializer():
+    return compile_serializer(CategorySerializer)
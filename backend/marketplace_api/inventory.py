@@ -0,0 +1,236 @@
+"""
+Stock reservations for products under concurrent checkout.
+
+A product's unreserved stock is split across settings.INVENTORY_SHARDS
+StockShard rows. A reservation decrements one randomly chosen shard with a
+conditional UPDATE (`remaining >= quantity`), so concurrent checkouts mostly
+touch different rows and none can take stock that is not there. Only a
+reservation larger than any single shard locks all of the product's shards.
+
+Every reservation is recorded as a StockReservation row. Held reservations
+expire, and committed ones are periodically rolled up into
+Product.available_quantity by `manage.py process_reservations`.
+
+rebalance() recomputes the shards from available_quantity and the
+outstanding reservations, so it locks the product row (against roll-ups and
+other rebalances) and then every shard. A reservation writes its shard and
+its StockReservation row in one transaction, so a rebalance either waits for
+it on the shard lock and then counts the committed row, or runs first and
+the reservation takes stock from the rebalanced shards. Reservations that
+lock every shard, and the first one that creates the shards, take the
+product lock as well.
+"""
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q, Sum
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from . import outbox
+from .models import Product, StockShard, StockReservation
+
+COMMITTED_STATUSES = ('confirmed', 'production', 'quality_check', 'shipping', 'delivered')
+
+
+class InsufficientStock(Exception):
+    pass
+
+
+def _split(total, parts):
+    base, extra = divmod(total, parts)
+    return [base + (1 if i < extra else 0) for i in range(parts)]
+
+
+def outstanding_quantity(product_id):
+    """Stock taken by reservations that are not yet reflected in available_quantity."""
+    return StockReservation.objects.filter(product_id=product_id).filter(
+        Q(status='held') | Q(status='committed', rolled_up=False)
+    ).aggregate(total=Sum('quantity'))['total'] or 0
+
+
+def _lock_product(product_id):
+    """Lock the product row and return its current available_quantity."""
+    return Product.objects.select_for_update().filter(pk=product_id).values_list(
+        'available_quantity', flat=True
+    ).get()
+
+
+def ensure_shards(product):
+    if StockShard.objects.filter(product=product).exists():
+        return
+    with transaction.atomic():
+        free = max(_lock_product(product.pk) - outstanding_quantity(product.pk), 0)
+        StockShard.objects.bulk_create(
+            [
+                StockShard(product=product, index=i, remaining=remaining)
+                for i, remaining in enumerate(_split(free, settings.INVENTORY_SHARDS))
+            ],
+            ignore_conflicts=True,
+        )
+
+
+def rebalance(product):
+    """Redistribute a product's free stock evenly over its shards, e.g. after a stock change."""
+    rebalance_many([product.pk])
+
+
+def rebalance_many(product_ids):
+    """rebalance() a batch of products with a constant number of queries.
+
+    The products are locked in id order, then all of their shards, so
+    concurrent batches cannot deadlock each other. Products without shards
+    are skipped.
+    """
+    # Always part of the caller's transaction when there is one; no savepoint needed
+    with transaction.atomic(savepoint=False):
+        available = dict(
+            Product.objects.select_for_update().filter(pk__in=product_ids).order_by('pk')
+            .values_list('pk', 'available_quantity')
+        )
+        shards = list(
+            StockShard.objects.select_for_update().filter(product_id__in=available).order_by('product_id', 'index')
+        )
+        if not shards:
+            return
+        outstanding = dict(
+            StockReservation.objects.filter(product_id__in={shard.product_id for shard in shards})
+            .filter(Q(status='held') | Q(status='committed', rolled_up=False))
+            .order_by().values('product_id').annotate(total=Sum('quantity')).values_list('product_id', 'total')
+        )
+        by_product = {}
+        for shard in shards:
+            by_product.setdefault(shard.product_id, []).append(shard)
+        for product_id, product_shards in by_product.items():
+            free = max(available[product_id] - outstanding.get(product_id, 0), 0)
+            for shard, remaining in zip(product_shards, _split(free, len(product_shards))):
+                shard.remaining = remaining
+        StockShard.objects.bulk_update(shards, ['remaining'])
+
+
+def _take_across_shards(product, quantity):
+    _lock_product(product.pk)
+    shards = list(StockShard.objects.select_for_update().filter(product=product).order_by('index'))
+    if sum(shard.remaining for shard in shards) < quantity:
+        raise InsufficientStock(product.pk)
+    allocations = {}
+    needed = quantity
+    for shard in shards:
+        take = min(shard.remaining, needed)
+        if take:
+            shard.remaining -= take
+            allocations[str(shard.index)] = take
+            needed -= take
+        if not needed:
+            break
+    StockShard.objects.bulk_update(shards, ['remaining'])
+    return allocations
+
+
+def reserve(product, quantity, order=None, hold=True):
+    """Reserve stock for an order, raising InsufficientStock rather than overselling."""
+    ensure_shards(product)
+    indexes = list(range(settings.INVENTORY_SHARDS))
+    random.shuffle(indexes)
+    expires_at = timezone.now() + timedelta(hours=settings.INVENTORY_HOLD_HOURS) if hold else None
+
+    with transaction.atomic():
+        allocations = None
+        for index in indexes:
+            updated = StockShard.objects.filter(
+                product=product, index=index, remaining__gte=quantity
+            ).update(remaining=F('remaining') - quantity)
+            if updated:
+                allocations = {str(index): quantity}
+                break
+        if allocations is None:
+            allocations = _take_across_shards(product, quantity)
+
+        return StockReservation.objects.create(
+            product=product, order=order, quantity=quantity, allocations=allocations,
+            status='held' if hold else 'committed', expires_at=expires_at,
+        )
+
+
+def _return_to_shards(reservation):
+    for index, quantity in reservation.allocations.items():
+        StockShard.objects.filter(product_id=reservation.product_id, index=int(index)).update(
+            remaining=F('remaining') + quantity
+        )
+
+
+def release(reservations):
+    released = 0
+    with transaction.atomic():
+        for reservation in reservations.select_for_update().filter(status='held'):
+            _return_to_shards(reservation)
+            reservation.status = 'released'
+            reservation.save(update_fields=['status'])
+            released += 1
+    return released
+
+
+def release_order(order):
+    return release(StockReservation.objects.filter(order=order))
+
+
+def commit_order(order):
+    return StockReservation.objects.filter(order=order, status='held').update(
+        status='committed', expires_at=None
+    )
+
+
+def release_expired(now=None):
+    now = now or timezone.now()
+    return release(StockReservation.objects.filter(status='held', expires_at__lte=now))
+
+
+def roll_up():
+    """Deduct committed reservations from Product.available_quantity, one UPDATE per product.
+
+    A seller may have lowered the stock below what is committed but not yet
+    rolled up; the quantity then stops at 0 instead of failing the roll-up.
+    """
+    rolled = 0
+    with transaction.atomic():
+        pending = StockReservation.objects.select_for_update().filter(status='committed', rolled_up=False)
+        totals = {}
+        ids = []
+        for reservation in pending:
+            totals[reservation.product_id] = totals.get(reservation.product_id, 0) + reservation.quantity
+            ids.append(reservation.pk)
+        before = dict(
+            Product.objects.select_for_update().filter(pk__in=totals).values_list('pk', 'available_quantity')
+        )
+        for product_id, quantity in totals.items():
+            Product.objects.filter(pk=product_id).update(
+                available_quantity=Greatest(F('available_quantity') - quantity, 0), updated_at=timezone.now()
+            )
+            rolled += 1
+        StockReservation.objects.filter(pk__in=ids).update(rolled_up=True)
+        _record_roll_up(before, totals)
+    return rolled
+
+
+def _record_roll_up(before, totals):
+    products = Product.objects.filter(pk__in=totals).only('available_quantity')
+    outbox.record_many(
+        (product, {'available_quantity': [before[product.pk], product.available_quantity]})
+        for product in products
+    )
+
+
+def available_quantities(product_ids):
+    """Return {product_id: reservable quantity} with one query for sharded products."""
+    product_ids = list(product_ids)
+    available = dict(
+        StockShard.objects.filter(product_id__in=product_ids)
+        .values_list('product_id').annotate(total=Sum('remaining'))
+    )
+    missing = [pk for pk in product_ids if pk not in available]
+    if missing:
+        for product_id, quantity in Product.objects.filter(pk__in=missing).values_list('pk', 'available_quantity'):
+            available[product_id] = max(quantity - outstanding_quantity(product_id), 0)
+    return available
@@ -0,0 +1,166 @@
+"""
+The client side of `manage.py loadtest` (see loadtest.py).
+
+Each client runs in its own process so that it does not compete with the
+server it measures for the GIL. This module imports nothing from Django:
+the client processes are started fresh and never set Django up.
+"""
+import http.client
+import json
+import math
+import random
+import time
+from collections import Counter, namedtuple
+from urllib.parse import urlencode, urlsplit
+
+QUERY_HEADER = 'X-Loadtest-Queries'
+
+# Upper bounds (ms) of the latency histogram buckets; fixed so reports stay comparable
+HISTOGRAM_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+MATERIALS = ('Stainless Steel', 'Aluminium', 'Copper', 'Cotton', 'Jute', 'Basmati', 'Teak', 'Granite', 'Leather', 'Ceramic')
+GOODS = ('Pipes', 'Sheets', 'Wire', 'Yarn', 'Bags', 'Rice', 'Furniture', 'Tiles', 'Gloves', 'Valves')
+DESTINATIONS = ('Germany', 'United States', 'United Kingdom', 'Netherlands', 'United Arab Emirates')
+SEARCH_TERMS = tuple(sorted({word.lower() for label in MATERIALS + GOODS for word in label.split()}))
+
+# What a client needs to know about the dataset; `pages` is the product list's page count
+Workload = namedtuple('Workload', 'product_ids category_ids tokens pages')
+
+
+# Traffic
+
+def _browse(rng, dataset):
+    if dataset.category_ids and rng.random() < 0.5:
+        return 'GET', f'/api/products/?{urlencode({"category": rng.choice(dataset.category_ids)})}', None
+    return 'GET', f'/api/products/?page={rng.randint(1, min(dataset.pages, 20))}', None
+
+
+def _search(rng, dataset):
+    return 'GET', f'/api/products/?{urlencode({"search": rng.choice(SEARCH_TERMS)})}', None
+
+
+def _detail(rng, dataset):
+    return 'GET', f'/api/products/{rng.choice(dataset.product_ids)}/', None
+
+
+def _express_interest(rng, dataset):
+    return 'POST', f'/api/products/{rng.choice(dataset.product_ids)}/express_interest/', {
+        'quantity': rng.choice((1, 2, 5)), 'destination_country': rng.choice(DESTINATIONS),
+        'shipping_details': 'Harbour Road 1', 'notes': 'Load test',
+    }
+
+
+def _my_orders(rng, dataset):
+    return 'GET', '/api/orders/my-orders/', None
+
+
+SCENARIOS = {
+    'browse': _browse,
+    'search': _search,
+    'detail': _detail,
+    'express_interest': _express_interest,
+    'my_orders': _my_orders,
+}
+
+
+# Results
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(len(ordered) * fraction) - 1))]
+
+
+def _bucket(ms):
+    for bound in HISTOGRAM_BOUNDS_MS:
+        if ms <= bound:
+            return f'<={bound}'
+    return f'>{HISTOGRAM_BOUNDS_MS[-1]}'
+
+
+class EndpointStats:
+    def __init__(self):
+        self.latencies = []
+        self.statuses = Counter()
+        self.queries = []
+        self.bytes = 0
+
+    def add(self, seconds, status, queries=None, size=0):
+        self.latencies.append(seconds * 1000)
+        self.statuses[str(status)] += 1
+        if queries is not None:
+            self.queries.append(queries)
+        self.bytes += size
+
+    def merge(self, other):
+        self.latencies.extend(other.latencies)
+        self.statuses.update(other.statuses)
+        self.queries.extend(other.queries)
+        self.bytes += other.bytes
+
+    @property
+    def errors(self):
+        return sum(count for status, count in self.statuses.items() if not status.startswith(('2', '3')))
+
+    def summary(self, elapsed):
+        ordered = sorted(self.latencies)
+        histogram = Counter(_bucket(ms) for ms in ordered)
+        return {
+            'requests': len(ordered),
+            'throughput': round(len(ordered) / elapsed, 2),
+            'errors': self.errors,
+            'statuses': dict(sorted(self.statuses.items())),
+            'bytes_per_request': round(self.bytes / len(ordered)) if ordered else 0,
+            'latency_ms': {
+                'mean': round(sum(ordered) / len(ordered), 2),
+                'p50': round(_percentile(ordered, 0.5), 2),
+                'p90': round(_percentile(ordered, 0.9), 2),
+                'p95': round(_percentile(ordered, 0.95), 2),
+                'p99': round(_percentile(ordered, 0.99), 2),
+                'max': round(ordered[-1], 2),
+            } if ordered else None,
+            'histogram': {
+                key: histogram[key]
+                for key in [f'<={bound}' for bound in HISTOGRAM_BOUNDS_MS] + [f'>{HISTOGRAM_BOUNDS_MS[-1]}']
+            },
+            'queries': {
+                'mean': round(sum(self.queries) / len(self.queries), 2),
+                'max': max(self.queries),
+            } if self.queries else None,
+        }
+
+
+def client(index, base_url, workload, mix, seed, measure_from, stop):
+    """Send one request at a time as a random buyer until `stop`; returns {scenario: EndpointStats}.
+
+    `measure_from` and `stop` are time.time() values, so that they mean the
+    same in every client process. Requests that finish before `measure_from`
+    are not counted.
+    """
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    url = urlsplit(base_url)
+    prefix = url.path.rstrip('/')
+    rng = random.Random(seed * 1000 + index)
+    stats = {name: EndpointStats() for name in names}
+    conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=60)
+    while time.time() < stop:
+        name = rng.choices(names, weights)[0]
+        method, path, body = SCENARIOS[name](rng, workload)
+        headers = {'Authorization': f'Token {rng.choice(workload.tokens)}', 'Accept': 'application/json'}
+        if body is not None:
+            headers['Content-Type'] = 'application/json'
+            body = json.dumps(body)
+        request_started = time.perf_counter()
+        try:
+            conn.request(method, prefix + path, body, headers)
+            response = conn.getresponse()
+            size = len(response.read())
+            status = response.status
+            queries = response.getheader(QUERY_HEADER)
+        except (OSError, http.client.HTTPException) as exc:
+            conn.close()
+            size, status, queries = 0, type(exc).__name__, None
+        elapsed = time.perf_counter() - request_started
+        if time.time() - elapsed >= measure_from:
+            stats[name].add(elapsed, status, int(queries) if queries is not None else None, size)
+    conn.close()
+    return stats
@@ -0,0 +1,446 @@
+"""
+Load testing against a locally started server.
+
+`manage.py loadtest` builds a synthetic dataset (sellers, buyers with API
+tokens, a category tree, products with specifications and reviews, and a few
+orders per buyer), serves the project's WSGI or ASGI application on a free
+local port, and replays a weighted mix of the requests real clients make:
+catalog browsing, search, product detail, express_interest and my-orders.
+
+The locally started server counts the queries of every request and returns
+the count in the X-Loadtest-Queries response header, so the report has
+throughput, a latency histogram and queries per endpoint. The histogram
+buckets are fixed and the report records the commit it was run on, so the
+JSON reports of two commits can be compared directly (`--compare`).
+
+The clients run in their own processes (loadclient.py), so they do not take
+the GIL from the server they measure. The dataset and the runs write to the
+configured database; the change feed events, tombstones and notifications
+they cause are deleted with the orders after each run and with the dataset.
+"""
+import contextvars
+import math
+import multiprocessing
+import random
+import socket
+import subprocess
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from decimal import Decimal
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.servers.basehttp import get_internal_wsgi_application
+from django.db import connection, transaction
+from django.db.backends.signals import connection_created
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils.module_loading import import_string
+from rest_framework.authtoken.models import Token
+
+from . import inventory, loadclient, specifications
+from .loadclient import DESTINATIONS, GOODS, MATERIALS, QUERY_HEADER, SCENARIOS, EndpointStats, Workload
+from .models import (
+    Category, Notification, NotificationCounter, Order, OrderItem, OutboxEvent, Product, ProductSpecification, Review,
+    StockReservation, Tombstone, UserProfile,
+)
+
+try:
+    import uvicorn
+except ImportError:
+    uvicorn = None
+
+USER_PREFIX = 'loadtest-'
+CATEGORY_PREFIX = 'Load test: '
+
+DEFAULT_MIX = {'browse': 50, 'search': 20, 'detail': 20, 'express_interest': 5, 'my_orders': 5}
+
+SECTORS = ('Metals', 'Textiles', 'Agriculture', 'Construction', 'Home', 'Industrial')
+ORIGINS = ('India', 'China', 'Vietnam', 'Turkey', 'United States')
+
+# Ids per DELETE when clearing the change log of the dataset's rows
+DELETE_BATCH_SIZE = 500
+
+Dataset = namedtuple('Dataset', 'product_ids category_ids tokens')
+
+
+class LoadTestError(Exception):
+    pass
+
+
+# Dataset
+
+def _dataset_users():
+    return User.objects.filter(username__startswith=USER_PREFIX)
+
+
+def _dataset_categories():
+    return Category.objects.filter(name__startswith=CATEGORY_PREFIX)
+
+
+def _load_dataset():
+    return Dataset(
+        product_ids=list(
+            _dataset_products().filter(is_active=True)
+            .order_by('pk').values_list('pk', flat=True)
+        ),
+        category_ids=list(_dataset_categories().order_by('pk').values_list('pk', flat=True)),
+        tokens=list(
+            Token.objects.filter(user__username__startswith=f'{USER_PREFIX}buyer')
+            .order_by('user_id').values_list('key', flat=True)
+        ),
+    )
+
+
+def _forget(object_type, ids):
+    """Delete the change feed events and tombstones the load test's rows left behind.
+
+    The dataset and the runs' orders are synthetic, so nothing else should
+    ever read about them: neither sync clients nor the notification fan-out.
+    """
+    ids = list(ids)
+    for start in range(0, len(ids), DELETE_BATCH_SIZE):
+        batch = ids[start:start + DELETE_BATCH_SIZE]
+        OutboxEvent.objects.filter(object_type=object_type, object_id__in=batch).delete()
+        Tombstone.objects.filter(object_type=object_type, object_id__in=batch).delete()
+        if object_type == 'order':
+            Notification.objects.filter(order_id__in=batch).delete()
+    if object_type == 'order':
+        NotificationCounter.objects.filter(user__username__startswith=USER_PREFIX).update(unread=Coalesce(
+            Subquery(
+                Notification.objects.filter(user_id=OuterRef('user_id'), read_at__isnull=True).order_by()
+                .values('user_id').annotate(count=Count('pk')).values('count')
+            ), 0,
+        ))
+
+
+def _dataset_products():
+    return Product.objects.filter(seller__username__startswith=USER_PREFIX)
+
+
+def delete_dataset():
+    products = list(_dataset_products().values_list('pk', flat=True))
+    orders = list(Order.objects.filter(user__username__startswith=USER_PREFIX).values_list('pk', flat=True))
+    categories = list(_dataset_categories().values_list('pk', flat=True))
+    with transaction.atomic():
+        # Products and orders go with their users
+        _dataset_users().delete()
+        # Categories protect their subcategories, so the deepest go first
+        for depth in sorted(set(_dataset_categories().values_list('depth', flat=True)), reverse=True):
+            _dataset_categories().filter(depth=depth).delete()
+        _forget('product', products)
+        _forget('order', orders)
+        _forget('category', categories)
+
+
+def ensure_dataset(products=2000, sellers=20, buyers=100, orders_per_buyer=5, seed=0, rebuild=False):
+    """Return the synthetic dataset, creating it unless one of the same size exists."""
+    dataset = _load_dataset()
+    if (
+        not rebuild and len(dataset.product_ids) == products and len(dataset.tokens) == buyers
+        and _dataset_users().filter(username__startswith=f'{USER_PREFIX}seller').count() == sellers
+    ):
+        return dataset
+    delete_dataset()
+    rng = random.Random(seed)
+    with transaction.atomic():
+        User.objects.bulk_create(
+            [User(username=f'{USER_PREFIX}seller{i}', password=make_password(None)) for i in range(sellers)]
+            + [User(username=f'{USER_PREFIX}buyer{i}', password=make_password(None)) for i in range(buyers)]
+        )
+        users = list(_dataset_users().order_by('pk'))
+        seller_users = [user for user in users if user.username.startswith(f'{USER_PREFIX}seller')]
+        buyer_users = [user for user in users if user.username.startswith(f'{USER_PREFIX}buyer')]
+        UserProfile.objects.bulk_create(
+            [
+                UserProfile(user=user, user_type='exporter', company_name=f'{rng.choice(MATERIALS)} Exports {i}',
+                            country=rng.choice(ORIGINS))
+                for i, user in enumerate(seller_users)
+            ] + [
+                UserProfile(user=user, user_type='buyer', company_name=f'Importer {i}', country=rng.choice(DESTINATIONS))
+                for i, user in enumerate(buyer_users)
+            ]
+        )
+        Token.objects.bulk_create([Token(user=user, key=Token.generate_key()) for user in buyer_users])
+
+        leaves = []
+        for sector in SECTORS:
+            parent = Category.objects.create(name=f'{CATEGORY_PREFIX}{sector}')
+            leaves.extend(
+                Category.objects.create(name=f'{CATEGORY_PREFIX}{sector} / {good}', parent=parent)
+                for good in rng.sample(GOODS, 4)
+            )
+
+        new_products = []
+        for i in range(products):
+            material, good = rng.choice(MATERIALS), rng.choice(GOODS)
+            product = Product(
+                seller=rng.choice(seller_users), category=rng.choice(leaves),
+                name=f'{material} {good} {i}', description=f'{material} {good.lower()} for export',
+                price=Decimal(f'{rng.uniform(1, 500):.2f}'), minimum_order_quantity=1,
+                # Large enough that a run never exhausts it
+                available_quantity=1_000_000, unit=rng.choice(('Pieces', 'Tons', 'Containers')),
+                country_of_origin=rng.choice(ORIGINS), lead_time=rng.choice(('', '10 days', '2 weeks')),
+                image=f'products/loadtest-{i}.jpg',
+            )
+            product.save()
+            new_products.append(product)
+        ProductSpecification.objects.bulk_create(
+            ProductSpecification(product=product, name=name, value=value)
+            for product in new_products
+            for name, value in (('Material', product.name.rsplit(' ', 2)[0]), ('Weight', str(rng.randint(1, 50))))
+        )
+        specifications.reindex(ProductSpecification.objects.filter(product__in=new_products))
+        Review.objects.bulk_create(
+            Review(product=product, user=reviewer, rating=rng.randint(1, 5), comment='Synthetic review')
+            for product in new_products
+            for reviewer in rng.sample(buyer_users, min(2, len(buyer_users)))
+        )
+
+        for buyer in buyer_users:
+            for _ in range(orders_per_buyer):
+                items = rng.sample(new_products, min(2, len(new_products)))
+                order = Order.objects.create(
+                    user=buyer, total_amount=sum(product.price for product in items),
+                    shipping_address='Harbour Road 1', destination_country=rng.choice(DESTINATIONS),
+                    status=rng.choice(('inquiry', 'negotiation', 'confirmed', 'shipping')),
+                )
+                OrderItem.objects.bulk_create(
+                    OrderItem(order=order, product=product, quantity=1, price=product.price) for product in items
+                )
+        _forget('product', [product.pk for product in new_products])
+        _forget('order', Order.objects.filter(user__in=buyer_users).values_list('pk', flat=True))
+    return _load_dataset()
+
+
+def last_order_id():
+    return Order.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+
+
+def remove_orders_since(order_id):
+    """Delete the orders buyers placed during a run, returning their stock; returns the number deleted.
+
+    The run's change feed events, tombstones and notifications go as well.
+    """
+    orders = Order.objects.filter(pk__gt=order_id, user__username__startswith=USER_PREFIX)
+    with transaction.atomic():
+        order_ids = list(orders.values_list('pk', flat=True))
+        inventory.release(StockReservation.objects.filter(order__in=orders))
+        _, deleted = orders.delete()
+        _forget('order', order_ids)
+        _forget('product', _dataset_products().values_list('pk', flat=True))
+    return deleted.get(Order._meta.label, 0)
+
+
+# Traffic
+
+def parse_mix(text):
+    """Parse 'browse=50,search=20' into {scenario: weight}."""
+    mix = {}
+    for part in filter(None, (part.strip() for part in text.split(','))):
+        name, _, weight = part.partition('=')
+        if name not in SCENARIOS:
+            raise LoadTestError(f'Unknown scenario {name!r}; choose from {", ".join(SCENARIOS)}')
+        try:
+            mix[name] = float(weight or 1)
+        except ValueError:
+            raise LoadTestError(f'Invalid weight for {name!r}: {weight!r}')
+    if not mix or sum(mix.values()) <= 0:
+        raise LoadTestError('The traffic mix needs at least one scenario with a positive weight')
+    return mix
+
+
+def run(base_url, dataset, mix=None, concurrency=8, duration=30.0, warmup=5.0, seed=0):
+    """Replay the traffic mix against `base_url` and return the report.
+
+    Each of `concurrency` clients runs in its own process and sends one
+    request at a time as a random buyer. Requests that finish during the
+    first `warmup` seconds are not counted; the warm-up also covers the
+    clients' start-up.
+    """
+    mix = mix or DEFAULT_MIX
+    if not dataset.product_ids or not dataset.tokens:
+        raise LoadTestError('The dataset has no products or buyers')
+    workload = Workload(
+        *dataset, pages=max(1, math.ceil(len(dataset.product_ids) / settings.REST_FRAMEWORK['PAGE_SIZE'])),
+    )
+    measure_from = time.time() + warmup
+    stop = measure_from + duration
+    # Started fresh rather than forked: the server's threads may hold locks
+    with multiprocessing.get_context('spawn').Pool(concurrency) as pool:
+        results = pool.starmap(
+            loadclient.client,
+            [(index, base_url, workload, mix, seed, measure_from, stop) for index in range(concurrency)],
+        )
+    elapsed = time.time() - measure_from
+
+    endpoints = {name: EndpointStats() for name in mix}
+    total = EndpointStats()
+    for stats in results:
+        for name, endpoint in stats.items():
+            endpoints[name].merge(endpoint)
+            total.merge(endpoint)
+    return {
+        'meta': {
+            'commit': _commit(),
+            'base_url': base_url,
+            'concurrency': concurrency,
+            'duration': duration,
+            'warmup': warmup,
+            'seed': seed,
+            'mix': mix,
+            'dataset': {'products': len(dataset.product_ids), 'buyers': len(dataset.tokens)},
+            'database': connection.vendor,
+            'django': django.get_version(),
+        },
+        'total': total.summary(elapsed),
+        'endpoints': {name: endpoint.summary(elapsed) for name, endpoint in endpoints.items()},
+    }
+
+
+def _commit():
+    try:
+        result = subprocess.run(
+            ['git', 'describe', '--always', '--dirty'], cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=10,
+        )
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+def compare(report, baseline):
+    """Return per-endpoint rows of (endpoint, metric, baseline value, value, change %)."""
+    rows = []
+    for name, current in {'total': report['total'], **report['endpoints']}.items():
+        before = baseline['total'] if name == 'total' else baseline['endpoints'].get(name)
+        if before is None or not before['requests'] or not current['requests']:
+            continue
+        metrics = [('req/s', before['throughput'], current['throughput'])]
+        for key in ('p50', 'p95', 'p99'):
+            metrics.append((f'{key} ms', before['latency_ms'][key], current['latency_ms'][key]))
+        if before['queries'] and current['queries']:
+            metrics.append(('queries', before['queries']['mean'], current['queries']['mean']))
+        for metric, old, new in metrics:
+            rows.append((name, metric, old, new, round((new - old) / old * 100, 1) if old else None))
+    return rows
+
+
+# Local servers
+
+_request_queries = contextvars.ContextVar('loadtest_request_queries', default=None)
+
+
+def _count_query(execute, sql, params, many, context):
+    counter = _request_queries.get()
+    if counter is not None:
+        counter[0] += 1
+    return execute(sql, params, many, context)
+
+
+def _install_query_counter(sender, connection, **kwargs):
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+def count_queries_wsgi(app):
+    """Wrap a WSGI application to report each request's query count in the QUERY_HEADER header."""
+    def application(environ, start_response):
+        counter = [0]
+        token = _request_queries.set(counter)
+
+        def counting_start_response(status, headers, exc_info=None):
+            return start_response(status, [*headers, (QUERY_HEADER, str(counter[0]))], exc_info)
+
+        try:
+            return app(environ, counting_start_response)
+        finally:
+            _request_queries.reset(token)
+    return application
+
+
+def count_queries_asgi(app):
+    """Wrap an ASGI application to report each HTTP request's query count in the QUERY_HEADER header."""
+    async def application(scope, receive, send):
+        if scope['type'] != 'http':
+            return await app(scope, receive, send)
+        counter = [0]
+        token = _request_queries.set(counter)
+
+        async def counting_send(message):
+            if message['type'] == 'http.response.start':
+                header = (QUERY_HEADER.lower().encode(), str(counter[0]).encode())
+                message = {**message, 'headers': [*message.get('headers', []), header]}
+            await send(message)
+
+        try:
+            await app(scope, receive, counting_send)
+        finally:
+            _request_queries.reset(token)
+    return application
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def _free_port(host):
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def serve(kind='wsgi', host='127.0.0.1'):
+    """Serve the project on a free local port in background threads; yields the base URL.
+
+    'wsgi' uses the standard library's threaded WSGI server, 'asgi' uses
+    uvicorn when it is installed. Both count each request's queries.
+    """
+    connection_created.connect(_install_query_counter)
+    try:
+        if kind == 'wsgi':
+            server = make_server(
+                host, 0, count_queries_wsgi(get_internal_wsgi_application()),
+                server_class=ThreadingWSGIServer, handler_class=QuietWSGIRequestHandler,
+            )
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            try:
+                yield f'http://{host}:{server.server_port}'
+            finally:
+                server.shutdown()
+                server.server_close()
+        elif kind == 'asgi':
+            if uvicorn is None:
+                raise LoadTestError('Serving the ASGI application needs uvicorn installed')
+            port = _free_port(host)
+            server = uvicorn.Server(uvicorn.Config(
+                count_queries_asgi(import_string(settings.ASGI_APPLICATION)),
+                host=host, port=port, log_level='warning', lifespan='off',
+            ))
+            thread = threading.Thread(target=server.run, daemon=True)
+            thread.start()
+            while not server.started:
+                if not thread.is_alive():
+                    raise LoadTestError('uvicorn failed to start')
+                time.sleep(0.01)
+            try:
+                yield f'http://{host}:{port}'
+            finally:
+                server.should_exit = True
+                thread.join()
+        else:
+            raise LoadTestError(f'Unknown server {kind!r}; choose wsgi or asgi')
+    finally:
+        connection_created.disconnect(_install_query_counter)
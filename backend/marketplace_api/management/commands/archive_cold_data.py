@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from marketplace_api import archive, inventory, sync
+
+
+class Command(BaseCommand):
+    help = 'Move old finished orders and long-inactive products to the archive tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help='Rows moved per transaction')
+
+    def handle(self, *args, **options):
+        # Committed reservations are rolled up first so their orders can be archived
+        inventory.roll_up()
+        orders = archive.archive_orders(options['batch_size'])
+        # Products are archived after orders, which may have been their last references
+        products = archive.archive_products(options['batch_size'])
+        # Archived rows leave tombstones; drop those no sync token can still need
+        tombstones = sync.prune()
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {orders} orders and {products} products, pruned {tombstones} tombstones'
+        ))
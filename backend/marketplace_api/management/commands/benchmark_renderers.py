@@ -0,0 +1,68 @@
+import gzip
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from marketplace_api.models import Product, Order
+from marketplace_api.renderers import FastJSONRenderer, MessagePackRenderer, orjson, msgpack
+from marketplace_api.serializers import ProductSerializer, OrderSerializer
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class Command(BaseCommand):
+    help = 'Compare bytes on the wire and render time of the product and order list formats'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=50, help='Number of rows to serialize per list')
+        parser.add_argument('--iterations', type=int, default=200, help='Render iterations per format')
+
+    def handle(self, *args, **options):
+        limit = options['limit']
+        iterations = options['iterations']
+        request = APIRequestFactory().get('/api/')
+        context = {'request': request}
+
+        datasets = {
+            'products': ProductSerializer(Product.objects.all()[:limit], many=True, context=context).data,
+            'orders': OrderSerializer(Order.objects.all()[:limit], many=True, context=context).data,
+        }
+
+        renderers = [('json', JSONRenderer())]
+        if orjson is not None:
+            renderers.append(('orjson', FastJSONRenderer()))
+        else:
+            self.stdout.write(self.style.WARNING('orjson is not installed, skipping the fast JSON renderer'))
+        if msgpack is not None:
+            renderers.append(('msgpack', MessagePackRenderer()))
+        else:
+            self.stdout.write(self.style.WARNING('msgpack is not installed, skipping MessagePack'))
+
+        compressors = [('identity', lambda body: body), ('gzip', lambda body: gzip.compress(body, 6))]
+        if brotli is not None:
+            compressors.append(('br', lambda body: brotli.compress(body, quality=5)))
+
+        for name, data in datasets.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(f'{name} ({len(data)} rows)'))
+            if not data:
+                self.stdout.write(self.style.WARNING('  No rows to benchmark'))
+                continue
+            for renderer_name, renderer in renderers:
+                start = time.perf_counter()
+                for _ in range(iterations):
+                    body = renderer.render(data)
+                render_us = (time.perf_counter() - start) / iterations * 1e6
+
+                sizes = []
+                for compressor_name, compress in compressors:
+                    start = time.perf_counter()
+                    compressed = compress(body)
+                    compress_us = (time.perf_counter() - start) * 1e6
+                    sizes.append(f'{compressor_name}={len(compressed)}B/{compress_us:.0f}us')
+
+                self.stdout.write(f'  {renderer_name:<8} render={render_us:8.1f}us  ' + '  '.join(sizes))
@@ -0,0 +1,54 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from marketplace_api import shipping
+
+
+class Command(BaseCommand):
+    help = 'Time batched cart shipping estimates against the lane table, cold and memoized'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--carts', type=int, default=2000, help='Carts estimated per pass')
+        parser.add_argument('--items', type=int, default=10, help='Items per cart')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        shipping.reload()
+        lanes = shipping.get_lanes()
+        load_ms = (time.perf_counter() - start) * 1e3
+        self.stdout.write(f'Loaded {sum(len(ports) for ports in lanes.values())} routes in {load_ms:.1f}ms')
+
+        rng = random.Random(options['seed'])
+        routes = sorted(lanes)
+        lead_times = ['', '10 days', '2 weeks', '1 month']
+        carts = []
+        for _ in range(options['carts']):
+            country = rng.choice(routes)[1]
+            origins = [origin for origin, destination in routes if destination == country]
+            products = [
+                {'id': pk, 'country_of_origin': rng.choice(origins), 'lead_time': rng.choice(lead_times)}
+                for pk in range(options['items'])
+            ]
+            quantities = {product['id']: rng.choice((10, 50, 100, 500, 1000)) for product in products}
+            carts.append((products, quantities, country))
+
+        for label in ('cold', 'memoized'):
+            if label == 'cold':
+                shipping.reload()
+                shipping.get_lanes()
+            start = time.perf_counter()
+            for products, quantities, country in carts:
+                shipping.estimate_cart(products, quantities, country)
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f'  {label:<9} {elapsed * 1e3:8.1f}ms total  {elapsed / len(carts) * 1e6:8.1f}us/cart'
+            )
+
+        info = shipping._estimate.cache_info()
+        self.stdout.write(self.style.SUCCESS(
+            f'Estimated {len(carts)} carts of {options["items"]} items; '
+            f'memo hits={info.hits} misses={info.misses}'
+        ))
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from marketplace_api import recommendations
+
+
+class Command(BaseCommand):
+    help = 'Recompute "buyers also ordered" recommendations from orders and reviews'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recompute every product, not only recently active ones')
+        parser.add_argument('--top', type=int, default=None, help='Recommendations kept per product')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        updated = recommendations.build(full=options['full'], k=options['top'])
+        backend = 'sparse matrix' if recommendations.sparse is not None else 'pure Python'
+        self.stdout.write(self.style.SUCCESS(
+            f'Updated recommendations for {updated} products in {time.perf_counter() - started:.2f}s ({backend})'
+        ))
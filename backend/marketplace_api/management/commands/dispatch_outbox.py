@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from marketplace_api import outbox
+
+
+class Command(BaseCommand):
+    help = 'Deliver outbox events to the configured sink in batches, at least once'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Deliver the current backlog and exit')
+        parser.add_argument('--batch-size', type=int, default=None, help='Events per sink call')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds to sleep when idle')
+        parser.add_argument('--max-backoff', type=float, default=60.0, help='Longest wait after sink failures')
+
+    def handle(self, *args, **options):
+        sink = outbox.get_sink()
+        delivered = 0
+        failures = 0
+        while True:
+            try:
+                sent = outbox.dispatch(sink, options['batch_size'])
+            except Exception as exc:
+                # The batch stays pending and is retried with exponential backoff
+                failures += 1
+                delay = min(options['interval'] * 2 ** failures, options['max_backoff'])
+                self.stderr.write(f'Sink failed ({exc!r}), retrying in {delay:.0f}s')
+                if options['once']:
+                    break
+                time.sleep(delay)
+                continue
+            failures = 0
+            delivered += sent
+            if sent:
+                continue
+            pruned = outbox.prune()
+            if pruned:
+                self.stdout.write(f'Pruned {pruned} dispatched events')
+            if options['once']:
+                break
+            close_old_connections()
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f'Delivered {delivered} events'))
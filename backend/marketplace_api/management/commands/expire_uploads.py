@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from marketplace_api import uploads
+
+
+class Command(BaseCommand):
+    help = 'Delete abandoned chunked upload sessions and their partial files'
+
+    def handle(self, *args, **options):
+        expired = uploads.expire_stale()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {expired} stale upload sessions'))
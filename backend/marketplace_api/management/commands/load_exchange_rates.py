@@ -0,0 +1,30 @@
+import json
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from marketplace_api.models import ExchangeRate
+
+
+class Command(BaseCommand):
+    help = 'Load exchange rates from a JSON file of {"EUR": "0.92", ...} against the base currency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Path to the JSON rates file')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['path']) as fh:
+                rates = json.load(fh)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Could not read rates: {e}')
+
+        # Saving a rate reprices the products in that currency (see signals)
+        with transaction.atomic():
+            for code, rate in rates.items():
+                ExchangeRate.objects.update_or_create(
+                    currency=code.upper(), defaults={'rate': Decimal(str(rate))}
+                )
+
+        self.stdout.write(self.style.SUCCESS(f'Loaded {len(rates)} exchange rates'))
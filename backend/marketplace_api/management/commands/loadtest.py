@@ -0,0 +1,119 @@
+import json
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand, CommandError
+
+from marketplace_api import loadtest
+
+
+class Command(BaseCommand):
+    help = 'Replay a traffic mix against a locally started server and report throughput, latency and queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--server', choices=['wsgi', 'asgi'], default='wsgi', help='Application to serve')
+        parser.add_argument('--url', help='Load an already running server instead (no query counts)')
+        parser.add_argument(
+            '--mix', default=','.join(f'{name}={weight}' for name, weight in loadtest.DEFAULT_MIX.items()),
+            help=f'Weighted scenarios, from: {", ".join(loadtest.SCENARIOS)}',
+        )
+        parser.add_argument('--concurrency', type=int, default=8, help='Concurrent clients')
+        parser.add_argument('--duration', type=float, default=30.0, help='Measured seconds')
+        parser.add_argument('--warmup', type=float, default=5.0, help='Seconds of traffic before measuring')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--products', type=int, default=2000, help='Products in the synthetic dataset')
+        parser.add_argument('--buyers', type=int, default=100, help='Buyers (one API token each)')
+        parser.add_argument('--rebuild-data', action='store_true', help='Recreate the synthetic dataset')
+        parser.add_argument('--keep-orders', action='store_true', help='Keep the orders placed during the run')
+        parser.add_argument('--output', help='Write the JSON report to this file')
+        parser.add_argument('--compare', help='JSON report of an earlier run to compare against')
+
+    def handle(self, *args, **options):
+        try:
+            mix = loadtest.parse_mix(options['mix'])
+        except loadtest.LoadTestError as e:
+            raise CommandError(str(e))
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+
+        dataset = loadtest.ensure_dataset(
+            products=options['products'], buyers=options['buyers'], seed=options['seed'],
+            rebuild=options['rebuild_data'],
+        )
+        self.stdout.write(f'Dataset: {len(dataset.product_ids)} products, {len(dataset.tokens)} buyers')
+
+        server = nullcontext(options['url']) if options['url'] else loadtest.serve(options['server'])
+        mark = loadtest.last_order_id()
+        try:
+            with server as base_url:
+                self.stdout.write(
+                    f'Loading {base_url} with {options["concurrency"]} clients for '
+                    f'{options["warmup"]:g}s warm-up + {options["duration"]:g}s'
+                )
+                report = loadtest.run(
+                    base_url, dataset, mix, options['concurrency'], options['duration'], options['warmup'],
+                    options['seed'],
+                )
+        except loadtest.LoadTestError as e:
+            raise CommandError(str(e))
+        finally:
+            if not options['keep_orders']:
+                loadtest.remove_orders_since(mark)
+        report['meta']['server'] = 'external' if options['url'] else options['server']
+
+        self.write_report(report)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f'Report written to {options["output"]}')
+        if baseline is not None:
+            changed = [
+                key for key in ('server', 'concurrency', 'mix', 'dataset', 'database')
+                if baseline['meta'].get(key) != report['meta'][key]
+            ]
+            if changed:
+                self.stdout.write(self.style.WARNING(f'The baseline differs in {", ".join(changed)}'))
+            self.write_comparison(loadtest.compare(report, baseline), baseline['meta'].get('commit'))
+
+        total = report['total']
+        message = f'{total["throughput"]:.1f} req/s, {total["errors"]} errors in {total["requests"]} requests'
+        self.stdout.write(self.style.WARNING(message) if total['errors'] else self.style.SUCCESS(message))
+
+    def write_report(self, report):
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'{report["meta"]["server"]} @ {report["meta"]["commit"] or "unknown commit"} '
+            f'({report["meta"]["database"]}, {report["meta"]["concurrency"]} clients)'
+        ))
+        self.stdout.write(
+            f'  {"endpoint":<18}{"requests":>9}{"req/s":>9}{"errors":>8}'
+            f'{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"max ms":>9}{"queries":>9}'
+        )
+        for name, stats in {**report['endpoints'], 'total': report['total']}.items():
+            if not stats['requests']:
+                self.stdout.write(f'  {name:<18}{0:>9}')
+                continue
+            latency = stats['latency_ms']
+            queries = f'{stats["queries"]["mean"]:.1f}' if stats['queries'] else '-'
+            self.stdout.write(
+                f'  {name:<18}{stats["requests"]:>9}{stats["throughput"]:>9.1f}{stats["errors"]:>8}'
+                f'{latency["p50"]:>9.1f}{latency["p95"]:>9.1f}{latency["p99"]:>9.1f}{latency["max"]:>9.1f}{queries:>9}'
+            )
+
+        for name, stats in report['endpoints'].items():
+            if not stats['requests']:
+                continue
+            self.stdout.write(self.style.MIGRATE_HEADING(f'{name} latency'))
+            peak = max(stats['histogram'].values())
+            for bucket, count in stats['histogram'].items():
+                if count:
+                    bar = '#' * max(1, round(count / peak * 40))
+                    self.stdout.write(f'  {bucket + " ms":>10} {count:>7} {bar}')
+            if any(not status.startswith(('2', '3')) for status in stats['statuses']):
+                self.stdout.write(self.style.WARNING(f'  statuses: {stats["statuses"]}'))
+
+    def write_comparison(self, rows, commit):
+        self.stdout.write(self.style.MIGRATE_HEADING(f'Compared with {commit or "baseline"}'))
+        for name, metric, old, new, change in rows:
+            change = f'{change:+.1f}%' if change is not None else '-'
+            self.stdout.write(f'  {name:<18}{metric:<10}{old:>10.1f} -> {new:<10.1f}{change:>8}')
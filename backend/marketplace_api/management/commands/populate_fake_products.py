@@ -1,6 +1,5 @@
 import random
-import requests
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.contrib.auth.models import User
 from marketplace_api.models import Product, Category
 from django.core.files.base import ContentFile
@@ -12,6 +11,11 @@ class Command(BaseCommand):
         parser.add_argument('--count', type=int, default=20, help='Number of fake products to create')
 
     def handle(self, *args, **options):
+        # Only this command needs requests, so it is not a server dependency
+        try:
+            import requests
+        except ImportError:
+            raise CommandError('populate_fake_products needs the requests package to download images')
         count = options['count']
         
         # Check if we have any users
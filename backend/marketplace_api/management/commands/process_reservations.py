@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from marketplace_api import inventory
+
+
+class Command(BaseCommand):
+    help = 'Release expired stock holds and roll committed reservations into product stock'
+
+    def handle(self, *args, **options):
+        released = inventory.release_expired()
+        rolled = inventory.roll_up()
+        self.stdout.write(self.style.SUCCESS(
+            f'Released {released} expired holds, rolled up reservations for {rolled} products'
+        ))
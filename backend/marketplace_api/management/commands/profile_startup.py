@@ -0,0 +1,63 @@
+import json
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from marketplace_api import startup
+
+
+class Command(BaseCommand):
+    help = 'Boot the project in fresh interpreters and report import, URLconf and serializer costs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Boots to time; the fastest is reported')
+        parser.add_argument('--top', type=int, default=25, help='Modules to list by self and cumulative time')
+        parser.add_argument('--json', action='store_true', help='Print the raw reports as JSON')
+
+    def handle(self, *args, **options):
+        runs = [startup.profile() for _ in range(max(options['runs'], 1))]
+        best = min(runs, key=lambda report: report['boot_ms'])
+        # Import times come from a separate traced run, which is slower than an untraced boot
+        imports = startup.profile(import_times=True)['imports']
+        if options['json']:
+            self.stdout.write(json.dumps({'runs': runs, 'imports': imports}, indent=2))
+            return
+
+        budget = settings.STARTUP_TIME_BUDGET_MS
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'Boot: {best["boot_ms"]:.1f}ms (fastest of {len(runs)}, budget {budget}ms)'
+        ))
+        for phase, ms in best['phases'].items():
+            self.stdout.write(f'  {phase:<20} {ms:8.1f}ms')
+
+        top = options['top']
+        self.stdout.write(self.style.MIGRATE_HEADING(f'Slowest imports ({len(imports)} modules)'))
+        self.stdout.write(f'  {"self":>8}  {"cumulative":>10}  module')
+        for module, self_ms, cumulative_ms in sorted(imports, key=lambda row: -row[1])[:top]:
+            self.stdout.write(f'  {self_ms:7.1f}ms  {cumulative_ms:9.1f}ms  {module}')
+        self.stdout.write(self.style.MIGRATE_HEADING('Largest import trees'))
+        for module, self_ms, cumulative_ms in sorted(imports, key=lambda row: -row[2])[:top]:
+            self.stdout.write(f'  {cumulative_ms:9.1f}ms  {module}')
+
+        packages = defaultdict(float)
+        for module, self_ms, _ in imports:
+            packages[startup.package_of(module)] += self_ms
+        self.stdout.write(self.style.MIGRATE_HEADING('Import time by package'))
+        for package, ms in sorted(packages.items(), key=lambda item: -item[1])[:top]:
+            self.stdout.write(f'  {ms:8.1f}ms  {package}')
+
+        self.stdout.write(self.style.MIGRATE_HEADING('First use after boot'))
+        for name, ms in sorted(best['serializer_fields'].items(), key=lambda item: -item[1]):
+            self.stdout.write(f'  {ms:8.2f}ms  {name}.fields')
+        for name, ms in best['fast_serializers'].items():
+            self.stdout.write(f'  {ms:8.2f}ms  fast_serializers.{name}()')
+
+        if best['eager_modules']:
+            self.stdout.write(self.style.WARNING(
+                f'Imported during boot but meant to load lazily: {", ".join(best["eager_modules"])}'
+            ))
+        if best['boot_ms'] > budget:
+            self.stdout.write(self.style.ERROR(f'Boot took {best["boot_ms"]:.1f}ms, over the {budget}ms budget'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Boot within budget ({best["boot_ms"]:.1f}ms of {budget}ms)'))
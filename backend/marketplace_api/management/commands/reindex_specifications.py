@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from marketplace_api import specifications
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the typed specification index, e.g. after specifications were bulk imported'
+
+    def handle(self, *args, **options):
+        updated = specifications.reindex()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {updated} specifications'))
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from marketplace_api import notifications
+
+
+class Command(BaseCommand):
+    help = 'Fan order events from the outbox out to user notification inboxes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Process the current backlog and exit')
+        parser.add_argument('--batch-size', type=int, default=None, help='Outbox events per transaction')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds to sleep when idle')
+
+    def handle(self, *args, **options):
+        written = 0
+        while True:
+            created = notifications.fan_out(options['batch_size'])
+            if created is not None:
+                written += created
+                continue
+            if options['once']:
+                break
+            close_old_connections()
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} notifications'))
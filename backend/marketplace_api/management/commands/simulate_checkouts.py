@@ -0,0 +1,90 @@
+import statistics
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, close_old_connections, connection
+from django.db.models import Sum
+
+from marketplace_api import inventory
+from marketplace_api.models import Category, Product, StockShard, StockReservation
+
+
+class Command(BaseCommand):
+    help = 'Run concurrent checkouts against one product and check that stock is never oversold'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stock', type=int, default=500, help='Stock of the simulated product')
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent buyers')
+        parser.add_argument('--checkouts', type=int, default=100, help='Checkouts per buyer')
+        parser.add_argument('--quantity', type=int, default=1, help='Quantity per checkout')
+
+    def handle(self, *args, **options):
+        seller = User.objects.order_by('pk').first()
+        if seller is None:
+            raise CommandError('Create a user first; the simulated product needs a seller')
+
+        category = Category.objects.create(name='Checkout simulation')
+        product = Product.objects.create(
+            seller=seller, category=category, name='Checkout simulation', description='Temporary product',
+            price='1.00', minimum_order_quantity=1, available_quantity=options['stock'],
+            unit='Pieces', country_of_origin='-',
+        )
+        inventory.ensure_shards(product)
+
+        latencies = []
+        retries = [0]
+        rejected = [0]
+        lock = threading.Lock()
+
+        def buyer():
+            for _ in range(options['checkouts']):
+                started = time.perf_counter()
+                while True:
+                    try:
+                        inventory.reserve(product, options['quantity'])
+                    except inventory.InsufficientStock:
+                        with lock:
+                            rejected[0] += 1
+                    except OperationalError:
+                        # SQLite serializes writers; other backends only wait on row locks
+                        with lock:
+                            retries[0] += 1
+                        time.sleep(0.001)
+                        continue
+                    break
+                with lock:
+                    latencies.append(time.perf_counter() - started)
+            close_old_connections()
+            connection.close()
+
+        try:
+            started = time.perf_counter()
+            threads = [threading.Thread(target=buyer) for _ in range(options['threads'])]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+
+            reserved = StockReservation.objects.filter(product=product).aggregate(total=Sum('quantity'))['total'] or 0
+            remaining = StockShard.objects.filter(product=product).aggregate(total=Sum('remaining'))['total'] or 0
+        finally:
+            product.delete()
+            category.delete()
+
+        latencies.sort()
+        percentile = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+        self.stdout.write(
+            f'{len(latencies)} checkouts in {elapsed:.2f}s on {connection.vendor}: '
+            f'{reserved} reserved, {remaining} left, {rejected[0]} rejected, {retries[0]} lock retries'
+        )
+        self.stdout.write(
+            f'latency ms: mean {statistics.mean(latencies) * 1000:.2f}, '
+            f'p50 {percentile(0.5):.2f}, p95 {percentile(0.95):.2f}, p99 {percentile(0.99):.2f}, '
+            f'max {latencies[-1] * 1000:.2f}'
+        )
+        if reserved + remaining != options['stock'] or reserved > options['stock']:
+            raise CommandError(f'Stock mismatch: {reserved} reserved + {remaining} left != {options["stock"]}')
+        self.stdout.write(self.style.SUCCESS('No overselling'))
@@ -0,0 +1,136 @@
+import mimetypes
+import os
+import posixpath
+import re
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+PROTECTED_PREFIXES = ('order_documents/',)
+
+# Content-addressed files (named by their SHA-256) never change once written
+HASHED_NAME_RE = re.compile(r'(^|/)[0-9a-f]{64}(\.[\w]+)?$')
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+STREAM_BLOCK_SIZE = 64 * 1024
+
+
+def normalize(path):
+    """Return the canonical form of a media path, or None if it leaves MEDIA_ROOT.
+
+    `.`, `..` and empty segments are collapsed first, so `x/../order_documents/a.pdf`
+    is checked and served as `order_documents/a.pdf`.
+    """
+    normalized = posixpath.normpath(path)
+    if normalized.startswith(('/', '../')) or normalized in ('.', '..'):
+        return None
+    return normalized
+
+
+def is_protected(path):
+    return path.startswith(PROTECTED_PREFIXES)
+
+
+def resolve(path):
+    """Return the absolute filesystem path for a media path, or None if it escapes MEDIA_ROOT."""
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except ValueError:
+        return None
+    return full_path if os.path.isfile(full_path) else None
+
+
+def cache_control(path):
+    visibility = 'private' if is_protected(path) else 'public'
+    if HASHED_NAME_RE.search(path):
+        return f'{visibility}, max-age=31536000, immutable'
+    return f'{visibility}, max-age={settings.MEDIA_CACHE_MAX_AGE}'
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """Parse a single `bytes=` range into inclusive (start, end).
+
+    Returns None for a header the response should ignore (malformed,
+    reversed or asking for several ranges), and raises RangeNotSatisfiable
+    for a valid range that starts beyond the file (RFC 7233, section 4.4).
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        length = int(end)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable
+        return max(size - length, 0), size - 1
+    start = int(start)
+    if end and int(end) < start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable
+    return start, min(int(end), size - 1) if end else size - 1
+
+
+def _iter_range(full_path, start, end):
+    with open(full_path, 'rb') as fh:
+        fh.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = fh.read(min(STREAM_BLOCK_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+
+def serve(request, path, full_path):
+    """Build the response for a media file that the caller is allowed to read."""
+    stat = os.stat(full_path)
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+
+    if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), stat.st_mtime):
+        response = HttpResponseNotModified()
+        response['Cache-Control'] = cache_control(path)
+        return response
+
+    backend = settings.MEDIA_SENDFILE_BACKEND
+    if backend == 'nginx':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT_PREFIX + path
+    elif backend == 'xsendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = full_path
+    else:
+        range_header = request.META.get('HTTP_RANGE')
+        try:
+            byte_range = parse_range(range_header, stat.st_size) if range_header else None
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stat.st_size}'
+            return response
+        if byte_range is not None:
+            start, end = byte_range
+            response = StreamingHttpResponse(
+                _iter_range(full_path, start, end), status=206, content_type=content_type
+            )
+            response['Content-Length'] = str(end - start + 1)
+            response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+        else:
+            # FileResponse hands the open file to wsgi.file_wrapper, which uses sendfile()
+            response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+        response['Accept-Ranges'] = 'bytes'
+
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Cache-Control'] = cache_control(path)
+    return response
@@ -1,7 +1,20 @@
+import re
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
 from django.utils.deprecation import MiddlewareMixin
+from django.utils.text import compress_string
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.exceptions import AuthenticationFailed
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BROTLI_RE = re.compile(r'\bbr\b')
+GZIP_RE = re.compile(r'\bgzip\b')
+
 class JWTAuthenticationMiddleware(MiddlewareMixin):
     def process_request(self, request):
         auth = TokenAuthentication()
@@ -11,4 +24,39 @@ class JWTAuthenticationMiddleware(MiddlewareMixin):
                 request.user, request.auth = user_auth_tuple
         except AuthenticationFailed:
             pass
-        return None
\ No newline at end of file
+        return None
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """Compress non-streaming responses with brotli when available, otherwise gzip.
+
+    Responses smaller than RESPONSE_COMPRESSION_MIN_SIZE bytes are sent as-is,
+    since the framing overhead outweighs the savings.
+    """
+    def process_response(self, request, response):
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        if len(response.content) < settings.RESPONSE_COMPRESSION_MIN_SIZE:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        if brotli is not None and BROTLI_RE.search(accept_encoding):
+            compressed = brotli.compress(response.content, quality=settings.RESPONSE_BROTLI_QUALITY)
+            encoding = 'br'
+        elif GZIP_RE.search(accept_encoding):
+            compressed = compress_string(response.content)
+            encoding = 'gzip'
+        else:
+            return response
+
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
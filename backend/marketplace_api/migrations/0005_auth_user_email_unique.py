@@ -0,0 +1,48 @@
+from django.db import migrations, models
+from django.db.models.functions import Lower
+
+# auth.User belongs to django.contrib.auth, so this constraint cannot be
+# declared in its Meta; it is added to the table with the schema editor.
+# Blank emails (e.g. from createsuperuser) are exempt.
+EMAIL_UNIQUE = models.UniqueConstraint(
+    Lower('email'), condition=~models.Q(email=''), name='marketplace_auth_user_email_uniq',
+)
+
+
+def check_duplicate_emails(apps, schema_editor):
+    User = apps.get_model('auth', 'User')
+    duplicates = list(
+        User.objects.using(schema_editor.connection.alias)
+        .exclude(email='')
+        .values(normalized=Lower('email'))
+        .annotate(users=models.Count('id'))
+        .filter(users__gt=1)
+        .values_list('normalized', flat=True)
+        .order_by('normalized')
+    )
+    if duplicates:
+        raise RuntimeError(
+            'Cannot make user emails unique; these are shared by several users '
+            f'(ignoring case): {", ".join(duplicates)}. Change or blank them and migrate again.'
+        )
+
+
+def add_constraint(apps, schema_editor):
+    schema_editor.add_constraint(apps.get_model('auth', 'User'), EMAIL_UNIQUE)
+
+
+def remove_constraint(apps, schema_editor):
+    schema_editor.remove_constraint(apps.get_model('auth', 'User'), EMAIL_UNIQUE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('marketplace_api', '0004_orderdocument_sha256_documentupload'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_emails, migrations.RunPython.noop),
+        migrations.RunPython(add_constraint, remove_constraint),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:44
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_base_prices(apps, schema_editor):
+    # All existing prices are in the base currency
+    Product = apps.get_model('marketplace_api', 'Product')
+    Product.objects.update(price_base=F('price'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace_api', '0006_category_tree'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExchangeRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(max_length=3, unique=True)),
+                ('rate', models.DecimalField(decimal_places=8, max_digits=18)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['currency'],
+            },
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='currency',
+            field=models.CharField(default='USD', max_length=3),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='currency',
+            field=models.CharField(default='USD', help_text='ISO 4217 code of the price', max_length=3),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='price_base',
+            field=models.DecimalField(db_index=True, decimal_places=4, default=0, editable=False, help_text='Price converted to the base currency, used for price filtering', max_digits=14),
+        ),
+        migrations.RunPython(backfill_base_prices, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace_api', '0010_archive'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='category',
+            name='name',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='name',
+            field=models.CharField(db_index=True, max_length=200),
+        ),
+        migrations.AlterField(
+            model_name='userprofile',
+            name='company_name',
+            field=models.CharField(blank=True, db_index=True, max_length=200, null=True),
+        ),
+    ]
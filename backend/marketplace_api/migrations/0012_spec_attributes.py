@@ -0,0 +1,70 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from marketplace_api.specifications import normalize, parse_number
+
+
+def index_specifications(apps, schema_editor):
+    SpecAttribute = apps.get_model('marketplace_api', 'SpecAttribute')
+    ProductSpecification = apps.get_model('marketplace_api', 'ProductSpecification')
+    attributes = {}
+    batch = []
+    for spec in ProductSpecification.objects.iterator(chunk_size=2000):
+        key = normalize(spec.name)
+        if key not in attributes:
+            attributes[key] = SpecAttribute.objects.get_or_create(key=key, defaults={'name': spec.name.strip()})[0].pk
+        spec.attribute_id = attributes[key]
+        spec.value_key = normalize(spec.value)[:255]
+        spec.value_number = parse_number(spec.value)
+        batch.append(spec)
+        if len(batch) == 2000:
+            ProductSpecification.objects.bulk_update(batch, ['attribute', 'value_key', 'value_number'])
+            batch = []
+    ProductSpecification.objects.bulk_update(batch, ['attribute', 'value_key', 'value_number'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace_api', '0011_admin_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpecAttribute',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(help_text='Case-folded name used for lookups', max_length=100, unique=True)),
+                ('name', models.CharField(max_length=100)),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='productspecification',
+            name='value_key',
+            field=models.CharField(default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='productspecification',
+            name='value_number',
+            field=models.DecimalField(blank=True, decimal_places=6, editable=False, max_digits=20, null=True),
+        ),
+        migrations.AddField(
+            model_name='productspecification',
+            name='attribute',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='specifications', to='marketplace_api.specattribute'),
+        ),
+        migrations.AddIndex(
+            model_name='productspecification',
+            index=models.Index(fields=['attribute', 'value_key', 'product'], name='spec_attribute_value_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productspecification',
+            index=models.Index(fields=['attribute', 'value_number', 'product'], name='spec_attribute_number_idx'),
+        ),
+        migrations.RunPython(index_specifications, migrations.RunPython.noop),
+    ]
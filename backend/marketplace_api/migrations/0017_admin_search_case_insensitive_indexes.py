@@ -0,0 +1,60 @@
+from django.db import migrations, models
+from django.db.models.functions import Collate, Upper
+
+# Admin search uses istartswith (^field) and iexact (=field). PostgreSQL
+# compiles these to UPPER("col"::text) LIKE / = UPPER(%s) and SQLite to a
+# case-insensitive LIKE, so neither can use a plain index on the column.
+# These indexes match those expressions; which ones apply depends on the
+# database, so they are added with the schema editor instead of Meta.indexes.
+# Other databases (MySQL, MariaDB) compare case-insensitively with the
+# column's own collation and use the plain indexes.
+PREFIX_SEARCH = [
+    ('marketplace_api', 'Product', 'name', 'mkt_product_name_ci'),
+    ('marketplace_api', 'Category', 'name', 'mkt_category_name_ci'),
+    ('marketplace_api', 'UserProfile', 'company_name', 'mkt_profile_company_ci'),
+]
+EXACT_SEARCH = [
+    ('auth', 'User', 'username', 'mkt_auth_user_username_ci'),
+    ('auth', 'User', 'email', 'mkt_auth_user_email_ci'),
+]
+
+
+def search_indexes(apps, vendor):
+    if vendor == 'postgresql':
+        from django.contrib.postgres.indexes import OpClass
+
+        # text_pattern_ops serves LIKE 'prefix%' whatever the database collation
+        prefix = lambda field: OpClass(Upper(field), name='text_pattern_ops')
+        exact = Upper
+    elif vendor == 'sqlite':
+        # SQLite's LIKE optimization needs an index with the NOCASE collation
+        prefix = exact = lambda field: Collate(field, 'NOCASE')
+    else:
+        return []
+    return [
+        (apps.get_model(app_label, model_name), models.Index(expression(field), name=name))
+        for expression, fields in ((prefix, PREFIX_SEARCH), (exact, EXACT_SEARCH))
+        for app_label, model_name, field, name in fields
+    ]
+
+
+def add_indexes(apps, schema_editor):
+    for model, index in search_indexes(apps, schema_editor.connection.vendor):
+        schema_editor.add_index(model, index)
+
+
+def remove_indexes(apps, schema_editor):
+    for model, index in search_indexes(apps, schema_editor.connection.vendor):
+        schema_editor.remove_index(model, index)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('marketplace_api', '0016_archived_documents'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_indexes, remove_indexes),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+# express_interest used to create orders as 'pending', which is not one of
+# Order.STATUS_CHOICES; those orders are inquiries
+LEGACY_STATUSES = {'pending': 'inquiry', 'processing': 'negotiation'}
+
+
+def rename_statuses(apps, schema_editor):
+    for model_name in ('Order', 'ArchivedOrder'):
+        model = apps.get_model('marketplace_api', model_name)
+        for old, new in LEGACY_STATUSES.items():
+            model.objects.filter(status=old).update(status=new)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace_api', '0017_admin_search_case_insensitive_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_statuses, migrations.RunPython.noop),
+    ]
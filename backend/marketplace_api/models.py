@@ -1,29 +1,139 @@
-from django.db import models
+import uuid
+
+from django.db import models, transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Concat, Lower, Now, Substr
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.db.models.fields.files import FieldFile
+
+
+class DirtyFieldsMixin:
+    """Track loaded column values so save() only writes the columns that changed."""
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot_fields()
+        return instance
+
+    def _field_state(self, field):
+        value = self.__dict__.get(field.attname)
+        if isinstance(value, FieldFile):
+            return value.name
+        return value
+
+    def _snapshot_fields(self):
+        deferred = self.get_deferred_fields()
+        self._loaded_values = {
+            field.attname: self._field_state(field)
+            for field in self._meta.concrete_fields
+            if field.attname not in deferred and not field.primary_key
+        }
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        loaded = getattr(self, '_loaded_values', None)
+        if fields is None or loaded is None:
+            self._snapshot_fields()
+            return
+        # Loading a deferred field refreshes only that field; pending changes to others must survive
+        refreshed = {self._meta.get_field(name).attname for name in fields}
+        for field in self._meta.concrete_fields:
+            if field.attname in refreshed and not field.primary_key:
+                loaded[field.attname] = self._field_state(field)
+
+    def get_dirty_fields(self):
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return None
+        return [
+            field.name for field in self._meta.concrete_fields
+            if field.attname in loaded and self._field_state(field) != loaded[field.attname]
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            dirty = self.get_dirty_fields()
+            if dirty is not None:
+                if not dirty:
+                    return
+                auto_now = [
+                    field.name for field in self._meta.concrete_fields
+                    if getattr(field, 'auto_now', False)
+                ]
+                kwargs['update_fields'] = dirty + [name for name in auto_now if name not in dirty]
+        super().save(*args, **kwargs)
+        self._snapshot_fields()
 
 
 class Category(models.Model):
-    name = models.CharField(max_length=100)
+    # Each path segment is the zero-padded id followed by '/', so a subtree is
+    # every category whose path starts with the root's path (one index range scan)
+    PATH_SEGMENT_WIDTH = 8
+    
+    name = models.CharField(max_length=100, db_index=True)
     description = models.TextField(blank=True, null=True)
     image = models.ImageField(upload_to='categories/', blank=True, null=True)
+    # Deleting a category must not take its subtree or its products with it
+    parent = models.ForeignKey('self', on_delete=models.PROTECT, related_name='children', blank=True, null=True)
+    path = models.CharField(max_length=255, db_index=True, editable=False, default='')
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
         return self.name
     
+    def build_path(self):
+        segment = f'{self.pk:0{self.PATH_SEGMENT_WIDTH}d}/'
+        if self.parent_id is None:
+            return segment, 0
+        parent = self.parent
+        if self.path and parent.path.startswith(self.path):
+            raise ValueError('A category cannot be moved below itself.')
+        return parent.path + segment, parent.depth + 1
+    
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            if self.pk is None:
+                # The path contains the id, so new rows are inserted first
+                super().save(*args, **kwargs)
+                args, kwargs = (), {}
+            
+            old_path, old_depth = self.path, self.depth
+            self.path, self.depth = self.build_path()
+            if old_path and old_path != self.path:
+                # Re-root the whole subtree in one statement
+                Category.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                    path=Concat(Value(self.path), Substr('path', len(old_path) + 1)),
+                    depth=F('depth') + (self.depth - old_depth),
+                    updated_at=Now(),
+                )
+            super().save(*args, **kwargs)
+    
     class Meta:
         ordering = ['-created_at']
         verbose_name_plural = 'Categories'
+        indexes = [
+            # Delta sync reads rows changed after a (updated_at, id) position
+            models.Index(fields=['updated_at', 'id']),
+        ]
 
 
-class Product(models.Model):
+class Product(DirtyFieldsMixin, models.Model):
     seller = models.ForeignKey(User, on_delete=models.CASCADE, related_name='products')
-    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products')
-    name = models.CharField(max_length=200)
+    category = models.ForeignKey(Category, on_delete=models.PROTECT, related_name='products')
+    name = models.CharField(max_length=200, db_index=True)
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
+    currency = models.CharField(max_length=3, default='USD', help_text='ISO 4217 code of the price')
+    price_base = models.DecimalField(
+        max_digits=14, decimal_places=4, db_index=True, editable=False, default=0,
+        help_text='Price converted to the base currency, used for price filtering'
+    )
     minimum_order_quantity = models.PositiveIntegerField(default=1, help_text='Minimum quantity that can be ordered')
     available_quantity = models.PositiveIntegerField(default=0, help_text='Total available quantity for export')
     unit = models.CharField(max_length=50, help_text='Unit of measurement (e.g., Tons, Containers, Pieces)')
@@ -39,20 +149,75 @@ class Product(models.Model):
     def __str__(self):
         return self.name
     
+    def clean(self):
+        from .currency import UnknownCurrency, get_rate
+        # save() converts the price with this rate, so forms must not get that far without one
+        try:
+            get_rate(self.currency)
+        except UnknownCurrency:
+            raise ValidationError({'currency': 'No exchange rate is known for this currency.'})
+    
+    def save(self, *args, **kwargs):
+        from . import outbox
+        from .currency import to_base
+        self.price_base = to_base(self.price, self.currency)
+        changes = outbox.pending_changes(self, kwargs.get('update_fields'))
+        # The change events commit or roll back with the row itself
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+            outbox.record(self, changes)
+    
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['updated_at', 'id']),
+        ]
 
 
 # ProductImage model removed - using only the image field in Product model
 
 
+class SpecAttribute(models.Model):
+    """A specification name shared across products, e.g. Material or Weight."""
+    key = models.CharField(max_length=100, unique=True, help_text='Case-folded name used for lookups')
+    name = models.CharField(max_length=100)
+    
+    def __str__(self):
+        return self.name
+    
+    class Meta:
+        ordering = ['name']
+
+
 class ProductSpecification(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='specifications')
     name = models.CharField(max_length=100, help_text='Specification name (e.g., Material, Size, Weight)')
     value = models.CharField(max_length=255, help_text='Specification value')
+    # Normalized copies of name/value for filtering, maintained in save()
+    attribute = models.ForeignKey(
+        SpecAttribute, on_delete=models.PROTECT, related_name='specifications',
+        blank=True, null=True, editable=False
+    )
+    value_key = models.CharField(max_length=255, default='', editable=False)
+    value_number = models.DecimalField(max_digits=20, decimal_places=6, blank=True, null=True, editable=False)
     
     def __str__(self):
         return f"{self.name}: {self.value} for {self.product.name}"
+    
+    def save(self, *args, **kwargs):
+        from .specifications import index_specification
+        index_specification(self)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'name', 'value'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'attribute', 'value_key', 'value_number'}
+        super().save(*args, **kwargs)
+    
+    class Meta:
+        indexes = [
+            # Product last, so a filter is answered from the index alone
+            models.Index(fields=['attribute', 'value_key', 'product'], name='spec_attribute_value_idx'),
+            models.Index(fields=['attribute', 'value_number', 'product'], name='spec_attribute_number_idx'),
+        ]
 
 
 class Review(models.Model):
@@ -70,7 +235,7 @@ class Review(models.Model):
         unique_together = ('product', 'user')
 
 
-class Order(models.Model):
+class Order(DirtyFieldsMixin, models.Model):
     STATUS_CHOICES = (
         ('inquiry', 'Inquiry'),
         ('negotiation', 'Negotiation'),
@@ -92,6 +257,7 @@ class Order(models.Model):
     
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='orders')
     total_amount = models.DecimalField(max_digits=15, decimal_places=2)
+    currency = models.CharField(max_length=3, default='USD')
     shipping_address = models.TextField()
     destination_country = models.CharField(max_length=100)
     destination_port = models.CharField(max_length=100, blank=True, null=True)
@@ -106,8 +272,18 @@ class Order(models.Model):
     def __str__(self):
         return f"Order #{self.id} by {self.user.username}"
     
+    def save(self, *args, **kwargs):
+        from . import outbox
+        changes = outbox.pending_changes(self, kwargs.get('update_fields'))
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+            outbox.record(self, changes)
+    
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'updated_at', 'id']),
+        ]
 
 
 class OrderItem(models.Model):
@@ -138,6 +314,7 @@ class OrderDocument(models.Model):
     document_type = models.CharField(max_length=50, choices=DOCUMENT_TYPES)
     document = models.FileField(upload_to='order_documents/')
     description = models.CharField(max_length=255, blank=True, null=True)
+    sha256 = models.CharField(max_length=64, blank=True, db_index=True, help_text='Content hash used for deduplication')
     uploaded_at = models.DateTimeField(auto_now_add=True)
     
     def __str__(self):
@@ -147,7 +324,246 @@ class OrderDocument(models.Model):
         ordering = ['-uploaded_at']
 
 
-class UserProfile(models.Model):
+class DocumentUpload(models.Model):
+    """A resumable, chunked upload session that becomes an OrderDocument on commit."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='uploads')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='document_uploads')
+    document_type = models.CharField(max_length=50, choices=OrderDocument.DOCUMENT_TYPES)
+    description = models.CharField(max_length=255, blank=True, null=True)
+    filename = models.CharField(max_length=255)
+    total_size = models.PositiveBigIntegerField()
+    received_size = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Upload of {self.filename} for Order #{self.order_id}"
+    
+    class Meta:
+        ordering = ['-created_at']
+
+
+class StockShard(models.Model):
+    """One slice of a product's unreserved stock.
+
+    Spreading stock over several rows lets concurrent reservations decrement
+    different rows instead of all waiting on the product row.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_shards')
+    index = models.PositiveSmallIntegerField()
+    remaining = models.PositiveIntegerField(default=0)
+    
+    def __str__(self):
+        return f"Shard {self.index} of {self.product_id}: {self.remaining}"
+    
+    class Meta:
+        unique_together = ('product', 'index')
+
+
+class StockReservation(models.Model):
+    STATUS_CHOICES = (
+        ('held', 'Held'),
+        ('committed', 'Committed'),
+        ('released', 'Released'),
+    )
+    
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='reservations', blank=True, null=True)
+    quantity = models.PositiveIntegerField()
+    # {shard index: quantity} taken from each shard, so a release can return it
+    allocations = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='held')
+    expires_at = models.DateTimeField(blank=True, null=True, help_text='When an unconfirmed hold lapses')
+    rolled_up = models.BooleanField(default=False, help_text='Committed quantity has been deducted from the product')
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"{self.quantity} of {self.product_id} ({self.status})"
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'expires_at']),
+            models.Index(fields=['status', 'rolled_up']),
+        ]
+
+
+class ProductRecommendation(models.Model):
+    """Precomputed "buyers also ordered" list for a product, rebuilt by `manage.py build_recommendations`."""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='recommendation')
+    # Recommended product ids, best first, and their similarity scores
+    product_ids = models.JSONField(default=list)
+    scores = models.JSONField(default=list)
+    computed_at = models.DateTimeField(auto_now=True, db_index=True)
+    
+    def __str__(self):
+        return f"Recommendations for {self.product_id}"
+
+
+class ArchivedProduct(models.Model):
+    """A product moved out of the Product table, kept as its serialized representation.
+    
+    Keeps the primary key the product had, so links from archived orders and
+    old clients still resolve.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    seller = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_products')
+    name = models.CharField(max_length=200)
+    created_at = models.DateTimeField()
+    data = models.JSONField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return self.name
+    
+    class Meta:
+        ordering = ['-created_at']
+
+
+class ArchivedOrder(models.Model):
+    """A finished order moved out of the Order table, with its items and documents in `data`."""
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_orders')
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    created_at = models.DateTimeField()
+    data = models.JSONField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"Archived order #{self.id}"
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at']),
+        ]
+
+
+class ArchivedOrderDocument(models.Model):
+    """The stored file of an archived order's document, so its owner can still download it."""
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name='documents')
+    document = models.CharField(max_length=100, db_index=True)
+    
+    def __str__(self):
+        return self.document
+
+
+class OutboxEvent(models.Model):
+    """A change to an order or product, written in the transaction that made it.
+    
+    The id is the change feed cursor; dispatched_at is set once the dispatcher
+    has handed the event to the configured sink.
+    """
+    id = models.BigAutoField(primary_key=True)
+    topic = models.CharField(max_length=50)
+    object_type = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    dispatched_at = models.DateTimeField(blank=True, null=True)
+    
+    def __str__(self):
+        return f"{self.topic} #{self.object_id}"
+    
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['topic', 'id']),
+            # Only the dispatcher's backlog is indexed
+            models.Index(fields=['id'], condition=models.Q(dispatched_at__isnull=True), name='outbox_pending_idx'),
+        ]
+
+
+class ConsumerCursor(models.Model):
+    """Position of an in-process outbox consumer in the change feed."""
+    name = models.CharField(max_length=50, primary_key=True)
+    position = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.name} at {self.position}"
+
+
+class Notification(models.Model):
+    """An in-app notice in a user's inbox, written by the notification fan-out."""
+    KIND_CHOICES = (
+        ('inquiry', 'New inquiry'),
+        ('order_status', 'Order status changed'),
+    )
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    # Plain ids rather than foreign keys, so notifications outlive archived orders
+    order_id = models.BigIntegerField(blank=True, null=True)
+    event_id = models.BigIntegerField(help_text='Outbox event the notification was created from')
+    title = models.CharField(max_length=200)
+    data = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    read_at = models.DateTimeField(blank=True, null=True)
+    
+    def __str__(self):
+        return self.title
+    
+    class Meta:
+        ordering = ['-id']
+        indexes = [
+            models.Index(fields=['user', '-id']),
+        ]
+
+
+class NotificationCounter(models.Model):
+    """Unread notifications per user, adjusted as notifications are written and read."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='notification_counter')
+    unread = models.IntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.unread} unread for {self.user_id}"
+
+
+class Tombstone(models.Model):
+    """Deletion log read by delta sync, so clients can drop rows that no longer exist.
+    
+    `user_id` scopes order tombstones to the order's buyer. It is not a foreign
+    key because tombstones are written while the user's rows are being deleted.
+    """
+    object_type = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+    user_id = models.BigIntegerField(blank=True, null=True)
+    # Moved to the archive rather than deleted; the row can still be read there
+    archived = models.BooleanField(default=False)
+    deleted_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"Deleted {self.object_type} #{self.object_id}"
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['object_type', 'deleted_at', 'id']),
+        ]
+
+
+class ExchangeRate(models.Model):
+    """Units of `currency` per one unit of the base currency (settings.BASE_CURRENCY)."""
+    currency = models.CharField(max_length=3, unique=True)
+    rate = models.DecimalField(max_digits=18, decimal_places=8)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.currency}: {self.rate}"
+    
+    class Meta:
+        ordering = ['currency']
+
+
+# Emails are unique per user, ignoring case. Migration 0005 adds this
+# constraint to auth.User's table; blank emails are exempt
+USER_EMAIL_UNIQUE = models.UniqueConstraint(
+    Lower('email'), condition=~Q(email=''), name='marketplace_auth_user_email_uniq',
+)
+
+
+class UserProfile(DirtyFieldsMixin, models.Model):
     USER_TYPES = (
         ('exporter', 'Exporter'),
         ('buyer', 'International Buyer'),
@@ -155,7 +571,7 @@ class UserProfile(models.Model):
     )
     
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
-    company_name = models.CharField(max_length=200, blank=True, null=True)
+    company_name = models.CharField(max_length=200, blank=True, null=True, db_index=True)
     company_website = models.URLField(blank=True, null=True)
     user_type = models.CharField(max_length=20, choices=USER_TYPES, default='buyer')
     country = models.CharField(max_length=100, blank=True, null=True)
@@ -0,0 +1,203 @@
+"""
+In-app notifications for order activity.
+
+Notifications are not written on the request path. `manage.py
+send_notifications` follows the outbox change feed (see outbox.py) from its
+ConsumerCursor and turns `order.status_changed` events into inbox rows:
+a new order notifies the sellers of its products, later status changes
+notify the buyer and the sellers. Each batch is written with one INSERT, the
+per-user NotificationCounter rows are adjusted with one UPDATE per distinct
+increment, and the cursor moves in the same transaction, so a batch is
+fanned out exactly once.
+
+Clients wait for new notifications instead of polling the list: the latest
+notification id per user is kept in the cache, and the long-poll and
+Server-Sent Events endpoints check it every NOTIFICATIONS_POLL_INTERVAL
+seconds and only query the inbox when it changes. The fan-out runs in its own
+process and updates the entry there, so web workers see new notifications
+promptly only when CACHES points at a cache they share (Redis, Memcached).
+With the default per-process cache the entry is re-read from the database
+every NOTIFICATIONS_LATEST_CACHE_TIMEOUT seconds, which delays them by up to
+that long.
+"""
+import asyncio
+import time
+from collections import Counter
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import outbox
+from .models import ConsumerCursor, Notification, NotificationCounter, Order, OrderItem
+
+CURSOR_NAME = 'notifications'
+TOPICS = ('order.status_changed',)
+FIELDS = ('id', 'kind', 'order_id', 'title', 'data', 'created_at', 'read_at')
+STATUS_LABELS = dict(Order.STATUS_CHOICES)
+
+
+def _latest_key(user_id):
+    return f'notifications:latest:{user_id}'
+
+
+def _recipients(order_ids):
+    """Return {order id: (buyer id, [seller ids])} for the orders that still exist."""
+    buyers = dict(Order.objects.filter(pk__in=order_ids).order_by().values_list('pk', 'user_id'))
+    sellers = {}
+    for order_id, seller_id in (
+        OrderItem.objects.filter(order_id__in=buyers).order_by()
+        .values_list('order_id', 'product__seller_id').distinct()
+    ):
+        sellers.setdefault(order_id, []).append(seller_id)
+    return {order_id: (buyer_id, sellers.get(order_id, [])) for order_id, buyer_id in buyers.items()}
+
+
+def build(events):
+    """Return the unsaved Notification rows for a batch of outbox events."""
+    recipients = _recipients({event['object_id'] for event in events})
+    rows = []
+    for event in events:
+        if event['object_id'] not in recipients:
+            continue
+        buyer_id, seller_ids = recipients[event['object_id']]
+        previous, status = event['payload']['changes']['status']
+        common = {'order_id': event['object_id'], 'event_id': event['id']}
+        if previous is None:
+            title = f'New inquiry for order #{event["object_id"]}'
+            rows.extend(
+                Notification(user_id=seller_id, kind='inquiry', title=title, data={'status': status}, **common)
+                for seller_id in seller_ids
+            )
+            continue
+        title = f'Order #{event["object_id"]} is now {STATUS_LABELS.get(status, status)}'
+        data = {'status': status, 'previous_status': previous}
+        rows.extend(
+            Notification(user_id=user_id, kind='order_status', title=title, data=data, **common)
+            for user_id in dict.fromkeys([buyer_id, *seller_ids])
+        )
+    return rows
+
+
+def _adjust_counters(deltas):
+    """Add {user id: delta} to the unread counters, creating missing ones."""
+    NotificationCounter.objects.bulk_create(
+        [NotificationCounter(user_id=user_id) for user_id in deltas], ignore_conflicts=True
+    )
+    by_delta = {}
+    for user_id, delta in deltas.items():
+        by_delta.setdefault(delta, []).append(user_id)
+    for delta, user_ids in by_delta.items():
+        NotificationCounter.objects.filter(user_id__in=user_ids).update(unread=F('unread') + delta)
+
+
+def _publish(latest):
+    cache.set_many(
+        {_latest_key(user_id): pk for user_id, pk in latest.items()}, settings.NOTIFICATIONS_LATEST_CACHE_TIMEOUT
+    )
+
+
+def fan_out(limit=None):
+    """Turn the next batch of outbox events into notifications.
+
+    Returns the number of notifications written, or None when the cursor is
+    already at the end of the feed.
+    """
+    with transaction.atomic():
+        cursor, _ = ConsumerCursor.objects.select_for_update().get_or_create(name=CURSOR_NAME)
+        events, position = outbox.read(
+            cursor.position, limit or settings.NOTIFICATIONS_FAN_OUT_BATCH_SIZE, TOPICS
+        )
+        if position == cursor.position:
+            return None
+        rows = build(events)
+        if rows:
+            rows = Notification.objects.bulk_create(rows)
+            _adjust_counters(Counter(row.user_id for row in rows))
+            latest = {}
+            for row in rows:
+                latest[row.user_id] = max(latest.get(row.user_id, 0), row.pk)
+            transaction.on_commit(lambda: _publish(latest))
+        cursor.position = position
+        cursor.save(update_fields=['position', 'updated_at'])
+    return len(rows)
+
+
+def unread_count(user_id):
+    return NotificationCounter.objects.filter(user_id=user_id).values_list('unread', flat=True).first() or 0
+
+
+def latest_id(user_id):
+    latest = cache.get(_latest_key(user_id))
+    if latest is None:
+        latest = Notification.objects.filter(user_id=user_id).values_list('id', flat=True).first() or 0
+        cache.set(_latest_key(user_id), latest, settings.NOTIFICATIONS_LATEST_CACHE_TIMEOUT)
+    return latest
+
+
+def newer_than(user_id, after):
+    """Return the user's notifications with an id above `after`, oldest first, and the unread count."""
+    items = list(
+        Notification.objects.filter(user_id=user_id, id__gt=after).order_by('id')
+        .values(*FIELDS)[:settings.NOTIFICATIONS_FAN_OUT_BATCH_SIZE]
+    )
+    return items, unread_count(user_id)
+
+
+def wait(user_id, after, timeout):
+    """Block up to `timeout` seconds for notifications above `after`; returns newer_than()."""
+    deadline = time.monotonic() + timeout
+    while latest_id(user_id) <= after:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        time.sleep(min(remaining, settings.NOTIFICATIONS_POLL_INTERVAL))
+    return newer_than(user_id, after)
+
+
+async def stream(user_id, after, encode):
+    """Yield Server-Sent Events for the user's new notifications until the stream's time is up.
+
+    Each notification is sent as a `notification` event with its id as the
+    event id, so a reconnecting client resumes with Last-Event-ID; the unread
+    count follows as an `unread` event.
+    """
+    if after is None:
+        after = await sync_to_async(latest_id)(user_id)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.NOTIFICATIONS_STREAM_MAX_SECONDS
+    heartbeat = loop.time()
+    yield f'retry: {settings.NOTIFICATIONS_STREAM_RETRY_MS}\n\n'
+    while loop.time() < deadline:
+        latest = await cache.aget(_latest_key(user_id))
+        if latest is None:
+            latest = await sync_to_async(latest_id)(user_id)
+        if latest > after:
+            items, unread = await sync_to_async(newer_than)(user_id, after)
+            for item in items:
+                yield f'id: {item["id"]}\nevent: notification\ndata: {encode(item)}\n\n'
+                after = item['id']
+            if not items:
+                after = latest
+            yield f'event: unread\ndata: {unread}\n\n'
+            heartbeat = loop.time()
+        elif loop.time() - heartbeat >= settings.NOTIFICATIONS_STREAM_HEARTBEAT:
+            # Keeps proxies from closing an idle connection
+            yield ': keep-alive\n\n'
+            heartbeat = loop.time()
+        await asyncio.sleep(settings.NOTIFICATIONS_POLL_INTERVAL)
+
+
+def mark_read(user_id, ids=None):
+    """Mark the user's unread notifications (all, or those in `ids`) as read. Returns the number marked."""
+    with transaction.atomic():
+        unread = Notification.objects.filter(user_id=user_id, read_at__isnull=True)
+        if ids is not None:
+            unread = unread.filter(pk__in=ids)
+        marked = unread.update(read_at=timezone.now())
+        if marked:
+            NotificationCounter.objects.filter(user_id=user_id).update(unread=F('unread') - marked)
+    return marked
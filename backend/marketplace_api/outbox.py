@@ -0,0 +1,186 @@
+"""
+Transactional outbox and change feed for downstream systems (ERP, analytics).
+
+Order.save() and Product.save(), and the bulk paths that bypass them, write an
+OutboxEvent in the same transaction as the change: `order.status_changed` and `product.changed` (price, currency or
+stock), each with the `{field: [old, new]}` changes as payload. Consumers either
+
+* read the feed (GET /api/changes/?since=<cursor>), which long-polls until
+  an event newer than the cursor exists, or
+* receive events from `manage.py dispatch_outbox`, which hands batches to the
+  sink in settings.OUTBOX_SINK and marks them dispatched only once the sink
+  returned. Delivery is at least once, so consumers dedupe on the event id.
+
+Ids are allocated when a transaction inserts, not when it commits, so a
+reader can see event n+1 before n. The feed stops at a gap in the ids until
+the gap itself has been missing for settings.OUTBOX_FEED_SETTLE_SECONDS
+(the first sighting is kept in the cache), after which it is taken to be a
+rolled back insert. An event whose transaction commits later than that is
+skipped by feed cursors, including the notifications fan-out, so the
+setting must exceed the longest transaction that writes events. The
+dispatcher selects undispatched rows rather than following a cursor and
+sends every committed event.
+"""
+import json
+import os
+import threading
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Order, OutboxEvent, Product
+
+FEED_FIELDS = ('id', 'topic', 'object_type', 'object_id', 'payload', 'created_at')
+# Topic and published fields per model; one event per saved row
+TOPICS = {
+    Order: ('order.status_changed', ('status',)),
+    Product: ('product.changed', ('price', 'currency', 'available_quantity')),
+}
+
+# First sighting of a gap in the ids; kept well past the settle period
+GAP_CACHE_KEY = 'outbox:gap:{}-{}'
+GAP_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Wakes long-polling feed readers in this process when an event commits
+_new_events = threading.Condition()
+
+
+def pending_changes(instance, update_fields=None):
+    """Return {field: [old, new]} for the published fields a save() is about to write.
+
+    Call before saving; new rows report every published field with None as old value.
+    """
+    fields = set(TOPICS[type(instance)][1])
+    if update_fields is not None:
+        fields &= set(update_fields)
+    if instance._state.adding:
+        return {field: [None, getattr(instance, field)] for field in fields}
+    loaded = getattr(instance, '_loaded_values', None)
+    if loaded is None:
+        # Not loaded from the database, so the old values are unknown
+        return {field: [None, getattr(instance, field)] for field in fields}
+    return {
+        field: [loaded[field], getattr(instance, field)]
+        for field in fields
+        if field in loaded and loaded[field] != getattr(instance, field)
+    }
+
+
+def _notify():
+    with _new_events:
+        _new_events.notify_all()
+
+
+def record_many(changes_by_instance):
+    """Write the events for [(instance, changes)] with one INSERT. Call inside the changing transaction."""
+    events = [
+        OutboxEvent(
+            topic=TOPICS[type(instance)][0], object_type=instance._meta.model_name,
+            object_id=instance.pk, payload={'changes': changes},
+        )
+        for instance, changes in changes_by_instance if changes
+    ]
+    if events:
+        OutboxEvent.objects.bulk_create(events)
+        transaction.on_commit(_notify)
+    return events
+
+
+def record(instance, changes):
+    return record_many([(instance, changes)])
+
+
+def _gap_settled(first, last, now):
+    """Whether ids first..last have been seen missing for settings.OUTBOX_FEED_SETTLE_SECONDS."""
+    key = GAP_CACHE_KEY.format(first, last)
+    cache.add(key, now, GAP_CACHE_TIMEOUT)
+    seen = cache.get(key, now)
+    return now - seen >= timedelta(seconds=settings.OUTBOX_FEED_SETTLE_SECONDS)
+
+
+def read(since=0, limit=None, topics=None, now=None):
+    """Return (events, cursor) for up to `limit` events after `since`.
+
+    `cursor` is the id to pass as `since` next time. It can move past events
+    filtered out by `topics`, but never past an id that may still commit.
+    """
+    limit = limit or settings.OUTBOX_FEED_PAGE_SIZE
+    now = now or timezone.now()
+    rows = OutboxEvent.objects.filter(id__gt=since).order_by('id').values(*FEED_FIELDS)[:limit]
+    events = []
+    cursor = since
+    for row in rows:
+        if row['id'] != cursor + 1 and not _gap_settled(cursor + 1, row['id'] - 1, now):
+            break
+        cursor = row['id']
+        if not topics or row['topic'] in topics:
+            events.append(row)
+    return events, cursor
+
+
+def wait(since=0, timeout=0, limit=None, topics=None):
+    """Like read(), but wait up to `timeout` seconds for an event to arrive.
+
+    Commits in this process wake the waiters immediately; events written by
+    other processes are picked up every settings.OUTBOX_FEED_POLL_INTERVAL.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        events, since = read(since, limit, topics)
+        remaining = deadline - time.monotonic()
+        if events or remaining <= 0:
+            return events, since
+        with _new_events:
+            _new_events.wait(min(remaining, settings.OUTBOX_FEED_POLL_INTERVAL))
+
+
+class JSONLinesSink:
+    """Append events to a local JSON Lines file, synced to disk before a batch is acknowledged."""
+
+    def __init__(self, path=None):
+        self.path = Path(path or settings.OUTBOX_SINK_PATH)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def send(self, events):
+        lines = ''.join(json.dumps(event, cls=DjangoJSONEncoder) + '\n' for event in events)
+        with open(self.path, 'a') as fh:
+            fh.write(lines)
+            fh.flush()
+            os.fsync(fh.fileno())
+
+
+def get_sink():
+    return import_string(settings.OUTBOX_SINK)()
+
+
+def dispatch(sink, batch_size=None):
+    """Send the oldest undispatched events to `sink` and mark them. Returns the number sent.
+
+    If the sink raises, the batch stays pending and is sent again next time.
+    """
+    with transaction.atomic():
+        # Concurrent dispatchers skip each other's batches where the database supports it
+        batch = list(
+            OutboxEvent.objects.select_for_update(skip_locked=True)
+            .filter(dispatched_at__isnull=True).order_by('id')
+            .values(*FEED_FIELDS)[:batch_size or settings.OUTBOX_DISPATCH_BATCH_SIZE]
+        )
+        if not batch:
+            return 0
+        sink.send(batch)
+        OutboxEvent.objects.filter(id__in=[event['id'] for event in batch]).update(dispatched_at=timezone.now())
+    return len(batch)
+
+
+def prune(now=None):
+    """Delete dispatched events older than settings.OUTBOX_RETENTION_DAYS. Returns the number deleted."""
+    cutoff = (now or timezone.now()) - timedelta(days=settings.OUTBOX_RETENTION_DAYS)
+    deleted, _ = OutboxEvent.objects.filter(dispatched_at__isnull=False, created_at__lt=cutoff).delete()
+    return deleted
@@ -0,0 +1,197 @@
+"""
+"Buyers also ordered" recommendations.
+
+Every buyer is a vector of product weights: 1 for each product they ordered
+(cancelled orders excluded), shifted by their review rating, (rating - 3) / 2,
+so a 5-star review counts as a strong signal and a 1-star review cancels an
+order out. Two products are similar when the same buyers weighted both,
+scored by the cosine of their buyer columns. The top
+settings.RECOMMENDATIONS_TOP_K products for each product are stored in
+ProductRecommendation and served from the cache.
+
+The build uses a SciPy sparse matrix product when NumPy and SciPy are
+installed and plain dictionaries otherwise; both give the same ranking.
+
+An incremental build reads every order item and review, as a full build
+does, but only ranks the products whose scores can have changed: those the
+buyers active since the previous build weighted, and every product sharing a
+buyer with them (their cosine changes with those products' norms). Deleted
+orders and reviews leave no trace to detect, so `--full` should still run
+from time to time.
+"""
+import heapq
+import math
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from .models import OrderItem, Product, ProductRecommendation, Review
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = sparse = None
+
+CACHE_KEY = 'recommendations:{}'
+BATCH_SIZE = 512
+# Ids per DELETE, below SQLite's limit on bind parameters
+DELETE_BATCH_SIZE = 500
+
+
+def _interactions():
+    """Return {(user_id, product_id): weight} for active products with a positive weight."""
+    active = set(Product.objects.filter(is_active=True).values_list('pk', flat=True))
+    weights = defaultdict(float)
+    ordered = (
+        OrderItem.objects.exclude(order__status='cancelled')
+        .values_list('order__user_id', 'product_id').distinct()
+    )
+    for user_id, product_id in ordered:
+        weights[(user_id, product_id)] = 1.0
+    for user_id, product_id, rating in Review.objects.values_list('user_id', 'product_id', 'rating'):
+        weights[(user_id, product_id)] += (rating - 3) / 2
+    return {key: weight for key, weight in weights.items() if weight > 0 and key[1] in active}
+
+
+def _changed_products(since):
+    """Products bought or reviewed by anyone who ordered or reviewed something after `since`."""
+    ordered = OrderItem.objects.filter(
+        Q(order__created_at__gt=since) | Q(order__updated_at__gt=since)
+    ).values('order__user_id')
+    reviewed = Review.objects.filter(updated_at__gt=since).values('user_id')
+    products = set(OrderItem.objects.filter(
+        Q(order__user_id__in=ordered) | Q(order__user_id__in=reviewed)
+    ).values_list('product_id', flat=True))
+    products.update(Review.objects.filter(
+        Q(user_id__in=ordered) | Q(user_id__in=reviewed)
+    ).values_list('product_id', flat=True))
+    return products
+
+
+def _with_neighbours(interactions, products):
+    """Add every product that shares a buyer with one of `products`."""
+    users = {user_id for user_id, product_id in interactions if product_id in products}
+    return products | {product_id for user_id, product_id in interactions if user_id in users}
+
+
+def _top_k_sparse(interactions, targets, k):
+    user_index = {}
+    product_ids = sorted({product_id for _, product_id in interactions})
+    product_index = {product_id: i for i, product_id in enumerate(product_ids)}
+    rows, cols, data = [], [], []
+    for (user_id, product_id), weight in interactions.items():
+        rows.append(user_index.setdefault(user_id, len(user_index)))
+        cols.append(product_index[product_id])
+        data.append(weight)
+    matrix = sparse.csc_matrix((data, (rows, cols)), shape=(len(user_index), len(product_ids)))
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel())
+    ids = np.asarray(product_ids)
+
+    targets = [product_id for product_id in targets if product_id in product_index]
+    results = {}
+    for start in range(0, len(targets), BATCH_SIZE):
+        batch = targets[start:start + BATCH_SIZE]
+        columns = [product_index[product_id] for product_id in batch]
+        # (batch x products) co-occurrence counts, one sparse product per batch;
+        # only products sharing a buyer with the row's product are stored
+        scores = (matrix[:, columns].T @ matrix).tocsr()
+        scores.data /= np.repeat(norms[columns], np.diff(scores.indptr)) * norms[scores.indices]
+        for i, product_id in enumerate(batch):
+            row = slice(scores.indptr[i], scores.indptr[i + 1])
+            others, row_scores = scores.indices[row], scores.data[row]
+            keep = (row_scores > 0) & (others != columns[i])
+            others, row_scores = others[keep], row_scores[keep]
+            top = np.lexsort((ids[others], -row_scores))[:k]
+            results[product_id] = (
+                ids[others[top]].tolist(), [round(float(score), 4) for score in row_scores[top]]
+            )
+    return results
+
+
+def _top_k_python(interactions, targets, k):
+    by_user = defaultdict(dict)
+    by_product = defaultdict(dict)
+    for (user_id, product_id), weight in interactions.items():
+        by_user[user_id][product_id] = weight
+        by_product[product_id][user_id] = weight
+    norms = {
+        product_id: math.sqrt(sum(weight * weight for weight in users.values()))
+        for product_id, users in by_product.items()
+    }
+
+    results = {}
+    for product_id in targets:
+        if product_id not in by_product:
+            continue
+        scores = defaultdict(float)
+        for user_id, weight in by_product[product_id].items():
+            for other_id, other_weight in by_user[user_id].items():
+                if other_id != product_id:
+                    scores[other_id] += weight * other_weight
+        top = heapq.nsmallest(
+            k, ((-score / (norms[product_id] * norms[other_id]), other_id) for other_id, score in scores.items())
+        )
+        results[product_id] = ([other_id for _, other_id in top], [round(-score, 4) for score, _ in top])
+    return results
+
+
+def build(full=False, k=None):
+    """Recompute recommendations and return the number of products updated.
+
+    Without `full`, only products whose scores can have changed since the
+    previous build are recomputed (see the module docstring).
+    """
+    k = k or settings.RECOMMENDATIONS_TOP_K
+    started = timezone.now()
+    last_build = ProductRecommendation.objects.aggregate(last=Max('computed_at'))['last']
+    interactions = _interactions()
+    products = {product_id for _, product_id in interactions}
+    full = full or last_build is None
+    stale = []
+    if full:
+        targets = products
+    else:
+        changed = _changed_products(last_build)
+        targets = _with_neighbours(interactions, changed) & products
+        # Changed products left without interactions no longer get a list
+        stale = sorted(changed - products)
+
+    top_k = _top_k_sparse if sparse is not None else _top_k_python
+    results = top_k(interactions, sorted(targets), k)
+
+    with transaction.atomic():
+        ProductRecommendation.objects.bulk_create(
+            [
+                ProductRecommendation(product_id=product_id, product_ids=ids, scores=scores)
+                for product_id, (ids, scores) in results.items()
+            ],
+            update_conflicts=True, unique_fields=['product'],
+            update_fields=['product_ids', 'scores', 'computed_at'],
+        )
+        if full:
+            # Every list still current was rewritten above
+            ProductRecommendation.objects.filter(computed_at__lt=started).delete()
+        else:
+            for start in range(0, len(stale), DELETE_BATCH_SIZE):
+                ProductRecommendation.objects.filter(
+                    product_id__in=stale[start:start + DELETE_BATCH_SIZE]
+                ).delete()
+    cache.delete_many([CACHE_KEY.format(product_id) for product_id in [*results, *stale]])
+    return len(results)
+
+
+def recommended_ids(product_id):
+    """Return the ids of the products recommended for a product, best first."""
+    key = CACHE_KEY.format(product_id)
+    ids = cache.get(key)
+    if ids is None:
+        ids = ProductRecommendation.objects.filter(product_id=product_id).values_list(
+            'product_ids', flat=True
+        ).first() or []
+        cache.set(key, ids, settings.RECOMMENDATIONS_CACHE_TIMEOUT)
+    return ids
@@ -1,11 +1,43 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db.models import Prefetch, prefetch_related_objects
+from . import currency
 from .models import (
     Category, Product, ProductSpecification, Review, 
-    Order, OrderItem, OrderDocument, UserProfile
+    Order, OrderItem, OrderDocument, DocumentUpload, Notification, UserProfile
 )
 
 
+class EagerLoadingMixin:
+    """Declares the related objects a serializer reads, so views can load them up front."""
+    select_related_fields = ()
+    prefetch_related_fields = ()
+    
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        if cls.select_related_fields:
+            queryset = queryset.select_related(*cls.select_related_fields)
+        if cls.prefetch_related_fields:
+            queryset = queryset.prefetch_related(*cls.prefetch_related_fields)
+        return queryset
+    
+    def to_representation(self, instance):
+        # Objects that were not loaded through setup_eager_loading (e.g. just
+        # created or updated) get their relations in one query per relation;
+        # relations that are already prefetched are left as they are
+        if self.prefetch_related_fields:
+            prefetch_related_objects([instance], *self.prefetch_related_fields)
+        return super().to_representation(instance)
+
+
+def product_related_prefetches(prefix=''):
+    return [
+        f'{prefix}specifications',
+        Prefetch(f'{prefix}reviews', queryset=Review.objects.select_related('user')),
+    ]
+
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -13,8 +45,9 @@ class UserSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class UserProfileSerializer(serializers.ModelSerializer):
+class UserProfileSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
+    select_related_fields = ('user',)
     
     class Meta:
         model = UserProfile
@@ -29,8 +62,13 @@ class UserProfileSerializer(serializers.ModelSerializer):
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
-        fields = ['id', 'name', 'description', 'image', 'created_at']
-        read_only_fields = ['id', 'created_at']
+        fields = ['id', 'name', 'description', 'image', 'parent', 'depth', 'created_at']
+        read_only_fields = ['id', 'depth', 'created_at']
+    
+    def validate_parent(self, parent):
+        if parent is not None and self.instance is not None and parent.path.startswith(self.instance.path):
+            raise serializers.ValidationError('A category cannot be moved below itself.')
+        return parent
 
 
 # ProductImageSerializer removed - using only the image field in Product model
@@ -43,8 +81,9 @@ class ProductSpecificationSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class ReviewSerializer(serializers.ModelSerializer):
+class ReviewSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
+    select_related_fields = ('user',)
     
     class Meta:
         model = Review
@@ -52,7 +91,10 @@ class ReviewSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at']
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    select_related_fields = ('seller', 'category')
+    prefetch_related_fields = product_related_prefetches()
+    
     seller = UserSerializer(read_only=True)
     category = CategorySerializer(read_only=True)
     category_id = serializers.PrimaryKeyRelatedField(
@@ -77,13 +119,21 @@ class ProductSerializer(serializers.ModelSerializer):
         model = Product
         fields = [
             'id', 'seller', 'category', 'category_id', 'name', 'description',
-            'price', 'minimum_order_quantity', 'available_quantity', 'unit',
+            'price', 'currency', 'minimum_order_quantity', 'available_quantity', 'unit',
             'country_of_origin', 'shipping_terms', 'lead_time', 'certifications',
             'image', 'is_active', 'created_at', 'updated_at',
             'specifications', 'reviews', 'average_rating'
         ]
         read_only_fields = ['id', 'seller', 'created_at', 'updated_at']
     
+    def validate_currency(self, value):
+        value = value.upper()
+        try:
+            currency.get_rate(value)
+        except currency.UnknownCurrency:
+            raise serializers.ValidationError('Unsupported currency.')
+        return value
+    
     def get_average_rating(self, obj):
         reviews = obj.reviews.all()
         if reviews.exists():
@@ -95,9 +145,38 @@ class ProductSerializer(serializers.ModelSerializer):
         validated_data['category'] = category_id
         validated_data['seller'] = self.context['request'].user
         return super().create(validated_data)
+    
+    def update(self, instance, validated_data):
+        if 'category_id' in validated_data:
+            validated_data['category'] = validated_data.pop('category_id')
+        return super().update(instance, validated_data)
+
+
+class ProductBulkUpdateSerializer(serializers.ModelSerializer):
+    """One entry of a seller's bulk product edit: an id plus the fields to change."""
+    id = serializers.IntegerField()
+    
+    class Meta:
+        model = Product
+        fields = ['id', 'price', 'currency', 'available_quantity', 'is_active', 'lead_time']
+        read_only_fields = ['currency']
+        extra_kwargs = {
+            'price': {'required': False},
+            'available_quantity': {'required': False},
+            'is_active': {'required': False},
+            'lead_time': {'required': False},
+        }
+    
+    def validate(self, attrs):
+        if len(attrs) < 2:
+            raise serializers.ValidationError('No changes given.')
+        return attrs
 
 
-class OrderItemSerializer(serializers.ModelSerializer):
+class OrderItemSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    select_related_fields = ('product__seller', 'product__category')
+    prefetch_related_fields = product_related_prefetches('product__')
+    
     product = ProductSerializer(read_only=True)
     product_id = serializers.PrimaryKeyRelatedField(
         queryset=Product.objects.all(),
@@ -113,11 +192,47 @@ class OrderItemSerializer(serializers.ModelSerializer):
 class OrderDocumentSerializer(serializers.ModelSerializer):
     class Meta:
         model = OrderDocument
-        fields = ['id', 'document_type', 'document', 'description', 'uploaded_at']
-        read_only_fields = ['id', 'uploaded_at']
+        fields = ['id', 'document_type', 'document', 'description', 'sha256', 'uploaded_at']
+        read_only_fields = ['id', 'sha256', 'uploaded_at']
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class DocumentUploadSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DocumentUpload
+        fields = [
+            'id', 'order', 'document_type', 'description', 'filename',
+            'total_size', 'received_size', 'created_at'
+        ]
+        read_only_fields = ['id', 'received_size', 'created_at']
+    
+    def validate_order(self, order):
+        user = self.context['request'].user
+        if order.user_id != user.id and not user.is_staff:
+            raise serializers.ValidationError('You cannot upload documents to this order.')
+        return order
+    
+    def validate_total_size(self, value):
+        if value <= 0:
+            raise serializers.ValidationError('Size must be greater than 0.')
+        if value > settings.DOCUMENT_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError('File is too large.')
+        return value
+
+
+class NotificationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Notification
+        fields = ['id', 'kind', 'order_id', 'title', 'data', 'created_at', 'read_at']
+        read_only_fields = fields
+
+
+class OrderSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    select_related_fields = ('user',)
+    prefetch_related_fields = (
+        'documents',
+        Prefetch('items', queryset=OrderItemSerializer.setup_eager_loading(OrderItem.objects.all())),
+    )
+    
     items = OrderItemSerializer(many=True, read_only=True)
     documents = OrderDocumentSerializer(many=True, read_only=True)
     user = UserSerializer(read_only=True)
@@ -125,11 +240,11 @@ class OrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = [
-            'id', 'user', 'items', 'documents', 'total_amount', 'shipping_address',
+            'id', 'user', 'items', 'documents', 'total_amount', 'currency', 'shipping_address',
             'destination_country', 'destination_port', 'shipping_terms', 'payment_terms',
             'status', 'notes', 'estimated_delivery_date', 'created_at', 'updated_at'
         ]
-        read_only_fields = ['id', 'user', 'total_amount', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'user', 'total_amount', 'currency', 'created_at', 'updated_at']
     
     def create(self, validated_data):
         # This will be called from the express_interest endpoint in ProductViewSet
@@ -0,0 +1,75 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Order, Product, UserProfile
+from .serializers import UserSerializer, UserProfileSerializer
+
+# Profile fields holding media URLs; cached as paths, since the cache is shared
+# by requests to every host and scheme
+URL_FIELDS = ('profile_picture',)
+
+
+def cache_key(user_id):
+    return f'session_context:{user_id}'
+
+
+def _count(model, field):
+    counts = (
+        model.objects.filter(**{field: OuterRef('pk')})
+        .order_by().values(field).annotate(count=Count('pk')).values('count')
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def _load(user_id):
+    user = (
+        User.objects.select_related('profile')
+        .annotate(order_count=_count(Order, 'user'), product_count=_count(Product, 'seller'))
+        .get(pk=user_id)
+    )
+    try:
+        profile = user.profile
+    except UserProfile.DoesNotExist:
+        profile = UserProfile.objects.create(user=user)
+
+    # Without a request, file fields serialize as paths
+    return {
+        'user': UserSerializer(user).data,
+        'profile': UserProfileSerializer(profile).data,
+        'order_count': user.order_count,
+        'product_count': user.product_count,
+    }
+
+
+def _with_absolute_urls(context, request):
+    profile = dict(context['profile'])
+    for field in URL_FIELDS:
+        if profile[field]:
+            profile[field] = request.build_absolute_uri(profile[field])
+    return {**context, 'profile': profile}
+
+
+def get_session_context(request):
+    """Return the authenticated user's user, profile and counts.
+
+    Loaded with a single query on a cache miss, cached per user and memoized
+    on the request so every consumer within a request shares one copy. URLs
+    are made absolute for the request that reads them.
+    """
+    if hasattr(request, '_session_context'):
+        return request._session_context
+
+    key = cache_key(request.user.pk)
+    context = cache.get(key)
+    if context is None:
+        context = _load(request.user.pk)
+        cache.set(key, context, settings.SESSION_CONTEXT_CACHE_TIMEOUT)
+    request._session_context = _with_absolute_urls(context, request)
+    return request._session_context
+
+
+def invalidate(user_id):
+    cache.delete(cache_key(user_id))
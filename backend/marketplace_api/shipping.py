@@ -0,0 +1,194 @@
+"""
+Freight and lead-time estimates from a local trade-lane table.
+
+settings.SHIPPING_LANES_FILE is a CSV of lanes (origin country, destination
+country, optional destination port, mode, transit days, cost bands). It is
+loaded once per process into a dict keyed by (origin, destination country)
+holding {port: tuple of Lane records}; a blank port serves every port in that
+country, and a port-specific lane replaces it for the same mode. Cost bands ("100:14.00|1000:9.50|*:6.80") give the
+freight per unit in the base currency for shipments up to that many units
+and are searched with bisect.
+
+Lane lookups and per-quantity estimates are memoized, so estimating a cart
+costs a few dictionary lookups per distinct (origin, quantity) pair.
+"""
+import bisect
+import csv
+import re
+from collections import namedtuple
+from datetime import timedelta
+from decimal import Decimal
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import currency
+
+Lane = namedtuple('Lane', 'mode transit_days_min transit_days_max band_limits band_rates')
+
+# Incoterms under which the buyer pays the main freight leg
+BUYER_PAYS_FREIGHT = ('EXW', 'FCA', 'FAS', 'FOB')
+LEAD_TIME = re.compile(r'(\d+)\s*(day|week|month)', re.IGNORECASE)
+DAYS_PER_UNIT = {'day': 1, 'week': 7, 'month': 30}
+UNLIMITED = float('inf')
+
+_lanes = None
+
+
+def _key(text):
+    return ' '.join((text or '').casefold().split())
+
+
+def _parse_bands(text):
+    limits, rates = [], []
+    for band in text.split('|'):
+        limit, rate = band.split(':')
+        limits.append(UNLIMITED if limit.strip() == '*' else int(limit))
+        rates.append(Decimal(rate))
+    return tuple(limits), tuple(rates)
+
+
+def load_lanes(path=None):
+    lanes = {}
+    with open(path or settings.SHIPPING_LANES_FILE, newline='') as fh:
+        for row in csv.DictReader(fh):
+            ports = lanes.setdefault((_key(row['origin_country']), _key(row['destination_country'])), {})
+            ports.setdefault(_key(row['destination_port']), []).append(Lane(
+                row['mode'], int(row['transit_days_min']), int(row['transit_days_max']),
+                *_parse_bands(row['cost_bands']),
+            ))
+    return {
+        route: {port: tuple(options) for port, options in ports.items()}
+        for route, ports in lanes.items()
+    }
+
+
+def get_lanes():
+    global _lanes
+    if _lanes is None:
+        _lanes = load_lanes()
+    return _lanes
+
+
+def reload():
+    """Drop the loaded lane table and every memoized estimate."""
+    global _lanes
+    _lanes = None
+    find_lanes.cache_clear()
+    _estimate.cache_clear()
+    lead_time_days.cache_clear()
+
+
+@lru_cache(maxsize=4096)
+def find_lanes(origin, country, port=''):
+    """Return the lanes serving a route, one per mode, fastest first.
+
+    Without a port every lane into the country is considered and the fastest
+    one per mode is kept.
+    """
+    ports = get_lanes().get((_key(origin), _key(country)), {})
+    port = _key(port)
+    if port:
+        by_mode = {lane.mode: lane for lane in ports.get('', ())}
+        by_mode.update((lane.mode, lane) for lane in ports.get(port, ()))
+    else:
+        by_mode = {}
+        for options in ports.values():
+            for lane in options:
+                if lane.mode not in by_mode or lane.transit_days_min < by_mode[lane.mode].transit_days_min:
+                    by_mode[lane.mode] = lane
+    return tuple(sorted(by_mode.values(), key=lambda lane: lane.transit_days_min))
+
+
+@lru_cache(maxsize=1024)
+def lead_time_days(lead_time):
+    """Production lead time in days from a free-text value like "2-3 weeks", or 0."""
+    match = LEAD_TIME.search(lead_time or '')
+    if match is None:
+        return 0
+    return int(match.group(1)) * DAYS_PER_UNIT[match.group(2).lower()]
+
+
+@lru_cache(maxsize=16384)
+def _estimate(origin, country, port, quantity, lead_days, today):
+    options = []
+    for lane in find_lanes(origin, country, port):
+        rate = lane.band_rates[bisect.bisect_left(lane.band_limits, quantity)]
+        options.append({
+            'mode': lane.mode,
+            'transit_days': (lane.transit_days_min, lane.transit_days_max),
+            'delivery_days': (lead_days + lane.transit_days_min, lead_days + lane.transit_days_max),
+            'earliest_delivery': today + timedelta(days=lead_days + lane.transit_days_min),
+            'latest_delivery': today + timedelta(days=lead_days + lane.transit_days_max),
+            'freight': rate * quantity,
+        })
+    return tuple(options)
+
+
+def estimate(origin, country, port='', quantity=1, lead_time=None, display_currency=None):
+    """Return one option per lane mode, fastest first; empty if no lane serves the route."""
+    options = _estimate(
+        origin, country, port or '', max(int(quantity), 1),
+        lead_time_days(lead_time), timezone.now().date(),
+    )
+    # Exchange rates change independently of the lanes, so conversion is not memoized
+    freight_currency = display_currency or settings.BASE_CURRENCY
+    results = []
+    for option in options:
+        freight = option['freight']
+        if display_currency:
+            freight = currency.from_base(freight, display_currency)
+        results.append({
+            **option, 'freight': freight.quantize(currency.DISPLAY_QUANTUM), 'freight_currency': freight_currency,
+        })
+    return results
+
+
+def freight_payer(shipping_terms):
+    term = (shipping_terms or '').strip().upper()[:3]
+    if not term:
+        return None
+    return 'buyer' if term in BUYER_PAYS_FREIGHT else 'seller'
+
+
+def estimate_cart(products, quantities, country, port='', display_currency=None):
+    """Estimate a cart of {product id: quantity}.
+
+    Items from the same origin ship together, so their quantities are summed
+    before the cost band is chosen. Returns one entry per origin plus the
+    slowest delivery window and total freight of the fastest option of each.
+    """
+    by_origin = {}
+    for product in products:
+        shipment = by_origin.setdefault(_key(product['country_of_origin']), {
+            'origin_country': product['country_of_origin'], 'product_ids': [], 'quantity': 0, 'lead_days': 0,
+        })
+        shipment['product_ids'].append(product['id'])
+        shipment['quantity'] += quantities[product['id']]
+        shipment['lead_days'] = max(shipment['lead_days'], lead_time_days(product['lead_time']))
+
+    shipments = []
+    unserved = []
+    total = Decimal(0)
+    latest = 0
+    for shipment in by_origin.values():
+        lead_days = shipment.pop('lead_days')
+        options = estimate(
+            shipment['origin_country'], country, port, shipment['quantity'],
+            f'{lead_days} days' if lead_days else None, display_currency,
+        )
+        shipment['options'] = options
+        shipments.append(shipment)
+        if not options:
+            unserved.extend(shipment['product_ids'])
+            continue
+        total += options[0]['freight']
+        latest = max(latest, options[0]['delivery_days'][1])
+    return {
+        'shipments': shipments,
+        'unserved_product_ids': unserved,
+        'total_freight': total,
+        'freight_currency': display_currency or settings.BASE_CURRENCY,
+        'delivery_days': latest,
+    }
@@ -0,0 +1,125 @@
+from django.contrib.auth.models import User
+from django.db.models import QuerySet
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import categories, currency, inventory, session, suggest, sync
+from .models import Category, ExchangeRate, Order, OrderDocument, Product, Review, UserProfile
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_user_session(sender, instance, **kwargs):
+    session.invalidate(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=UserProfile)
+def invalidate_profile_session(sender, instance, **kwargs):
+    session.invalidate(instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=Order)
+def invalidate_order_session(sender, instance, created=True, **kwargs):
+    # Only creation and deletion change the user's order count
+    if created:
+        session.invalidate(instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_product_session(sender, instance, created=True, **kwargs):
+    if created:
+        session.invalidate(instance.seller_id)
+
+
+@receiver(post_save, sender=Product)
+def rebalance_stock(sender, instance, created, update_fields=None, **kwargs):
+    # Shards are created lazily on the first reservation
+    if not created and (update_fields is None or 'available_quantity' in update_fields):
+        inventory.rebalance(instance)
+
+
+@receiver(post_save, sender=Order)
+def sync_reservations(sender, instance, created, update_fields=None, **kwargs):
+    if created or (update_fields is not None and 'status' not in update_fields):
+        return
+    if instance.status == 'cancelled':
+        inventory.release_order(instance)
+    elif instance.status in inventory.COMMITTED_STATUSES:
+        inventory.commit_order(instance)
+
+
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_category_tree(sender, instance, **kwargs):
+    categories.invalidate_tree()
+
+
+@receiver(post_save, sender=ExchangeRate)
+def reprice_on_rate_change(sender, instance, **kwargs):
+    currency.invalidate_rates()
+    currency.reprice_products(instance.currency)
+
+
+@receiver(post_delete, sender=ExchangeRate)
+def invalidate_rates_on_delete(sender, instance, **kwargs):
+    currency.invalidate_rates()
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or {'name', 'is_active'} & set(update_fields):
+        suggest.update_product(instance)
+
+
+@receiver(post_save, sender=Category)
+def index_category(sender, instance, **kwargs):
+    suggest.update_category(instance)
+
+
+@receiver(post_save, sender=UserProfile)
+def index_seller(sender, instance, **kwargs):
+    suggest.update_seller(instance)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    suggest.remove('product', instance.pk)
+
+
+@receiver(post_delete, sender=Category)
+def unindex_category(sender, instance, **kwargs):
+    suggest.remove('category', instance.pk)
+
+
+@receiver(post_delete, sender=UserProfile)
+def unindex_seller(sender, instance, **kwargs):
+    suggest.remove('seller', instance.user_id)
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Category)
+def log_deletion(sender, instance, **kwargs):
+    sync.record_deletion(instance)
+
+
+@receiver(post_delete, sender=Order)
+def log_order_deletion(sender, instance, **kwargs):
+    sync.record_deletion(instance, user_id=instance.user_id)
+
+
+def _cascaded_from(origin, model):
+    # post_delete's origin is the instance or queryset whose delete() reached this row
+    return isinstance(origin, model) or (isinstance(origin, QuerySet) and origin.model is model)
+
+
+@receiver([post_save, post_delete], sender=Review)
+def touch_reviewed_product(sender, instance, origin=None, **kwargs):
+    # The rating is part of the product's representation, so delta sync must resend it.
+    # A product being deleted is not touched once per review.
+    if not _cascaded_from(origin, Product):
+        Product.objects.filter(pk=instance.product_id).update(updated_at=timezone.now())
+
+
+@receiver([post_save, post_delete], sender=OrderDocument)
+def touch_document_order(sender, instance, origin=None, **kwargs):
+    if not _cascaded_from(origin, Order):
+        Order.objects.filter(pk=instance.order_id).update(updated_at=timezone.now())
@@ -0,0 +1,138 @@
+"""
+Typed, indexed product specifications for faceted filtering.
+
+Besides the free-form name/value a seller entered, every ProductSpecification
+row stores its SpecAttribute (one per distinct case-folded name), the
+case-folded value and, when the value starts with a number ("20", "20 kg",
+"1,500"), that number. A filter such as
+`?spec.Material=Steel&spec.Weight__lte=20` becomes one `id IN (...)` semi-join
+per attribute against the covering (attribute, value, product) indexes, so the
+database intersects small product id sets instead of joining the
+specification table once per filter.
+"""
+import re
+from decimal import Decimal, InvalidOperation
+
+from django.core.cache import cache
+
+from .models import ProductSpecification, SpecAttribute
+
+ATTRIBUTES_CACHE_KEY = 'spec_attributes'
+PARAM_PREFIX = 'spec.'
+NUMERIC_LOOKUPS = ('lt', 'lte', 'gt', 'gte')
+NUMBER = re.compile(r'^\s*([-+]?\d[\d,]*(?:\.\d+)?)')
+# Longer normalized values are indexed, and looked up, by their first characters
+VALUE_KEY_LENGTH = ProductSpecification._meta.get_field('value_key').max_length
+# value_number holds 20 digits, 6 of them decimals
+MAX_NUMBER = Decimal(10) ** 14
+REINDEX_BATCH_SIZE = 2000
+
+
+class InvalidFilter(ValueError):
+    pass
+
+
+def normalize(text):
+    return ' '.join(str(text).casefold().split())
+
+
+def value_key(value):
+    return normalize(value)[:VALUE_KEY_LENGTH]
+
+
+def parse_number(value):
+    """Return the number a value starts with, or None."""
+    match = NUMBER.match(value)
+    if match is None:
+        return None
+    try:
+        number = Decimal(match.group(1).replace(',', ''))
+    except InvalidOperation:
+        return None
+    return number if abs(number) < MAX_NUMBER else None
+
+
+def attribute_ids():
+    """Return {key: attribute id}, loaded once and cached until an attribute is added."""
+    ids = cache.get(ATTRIBUTES_CACHE_KEY)
+    if ids is None:
+        ids = dict(SpecAttribute.objects.values_list('key', 'id'))
+        cache.set(ATTRIBUTES_CACHE_KEY, ids, None)
+    return ids
+
+
+def find_attribute_id(name):
+    key = normalize(name)
+    attribute_id = attribute_ids().get(key)
+    if attribute_id is None:
+        # Possibly added since the map was cached
+        attribute_id = SpecAttribute.objects.filter(key=key).values_list('id', flat=True).first()
+    return attribute_id
+
+
+def get_attribute_id(name):
+    attribute_id = find_attribute_id(name)
+    if attribute_id is None:
+        attribute, _ = SpecAttribute.objects.get_or_create(
+            key=normalize(name), defaults={'name': name.strip()}
+        )
+        attribute_id = attribute.pk
+        cache.delete(ATTRIBUTES_CACHE_KEY)
+    return attribute_id
+
+
+def index_specification(spec):
+    """Fill the normalized columns of a specification from its name and value."""
+    spec.attribute_id = get_attribute_id(spec.name)
+    spec.value_key = value_key(spec.value)
+    spec.value_number = parse_number(spec.value)
+
+
+def reindex(queryset=None):
+    """Index specifications that were written without save(), e.g. by bulk_create. Returns the count."""
+    if queryset is None:
+        queryset = ProductSpecification.objects.all()
+    updated = 0
+    batch = []
+    for spec in queryset.iterator(chunk_size=REINDEX_BATCH_SIZE):
+        index_specification(spec)
+        batch.append(spec)
+        if len(batch) == REINDEX_BATCH_SIZE:
+            updated += ProductSpecification.objects.bulk_update(batch, ['attribute', 'value_key', 'value_number'])
+            batch = []
+    if batch:
+        updated += ProductSpecification.objects.bulk_update(batch, ['attribute', 'value_key', 'value_number'])
+    return updated
+
+
+def parse_filters(params):
+    """Return [(attribute name, lookup, value)] for the `spec.` parameters of a QueryDict."""
+    filters = []
+    for param, values in params.lists():
+        if not param.startswith(PARAM_PREFIX):
+            continue
+        name, _, lookup = param[len(PARAM_PREFIX):].partition('__')
+        if lookup not in ('', 'exact', 'in') + NUMERIC_LOOKUPS:
+            raise InvalidFilter(f'Unsupported specification lookup "{lookup}".')
+        for value in values:
+            if lookup in NUMERIC_LOOKUPS and parse_number(value) is None:
+                raise InvalidFilter(f'{param} must be a number.')
+            filters.append((name, lookup, value))
+    return filters
+
+
+def filter_products(queryset, params):
+    """Restrict a product queryset by every `spec.<name>[__lookup]=<value>` parameter."""
+    for name, lookup, value in parse_filters(params):
+        attribute_id = find_attribute_id(name)
+        if attribute_id is None:
+            return queryset.none()
+        specs = ProductSpecification.objects.filter(attribute_id=attribute_id)
+        if lookup == 'in':
+            specs = specs.filter(value_key__in=[value_key(item) for item in value.split(',')])
+        elif lookup in NUMERIC_LOOKUPS:
+            specs = specs.filter(**{f'value_number__{lookup}': parse_number(value)})
+        else:
+            specs = specs.filter(value_key=value_key(value))
+        queryset = queryset.filter(pk__in=specs.values('product_id'))
+    return queryset
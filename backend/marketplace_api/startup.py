@@ -0,0 +1,128 @@
+"""
+Startup profiling.
+
+`python -m marketplace_api.startup` boots the project in a fresh interpreter
+the way a WSGI worker does and prints a JSON report: the time spent in each
+phase up to the first resolved URL, the cost of building each serializer's
+fields and of compiling the fast serializers (paid on first use, after boot),
+and which of the modules kept off the startup path were imported anyway.
+
+profile() runs that script in a subprocess, optionally under
+`python -X importtime`, so measurements never include modules the calling
+process has already imported. `manage.py profile_startup` prints its report.
+The tests check that no lazy module is imported at boot, and hold the boot
+time to settings.STARTUP_TIME_BUDGET_MS when CHECK_STARTUP_BUDGET is set
+(wall-clock time is only meaningful on a quiet machine).
+"""
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+# Modules that only some requests or commands need and that must not be imported at boot
+LAZY_MODULES = ('requests', 'django.contrib.auth.admin', 'marketplace_api.admin', 'marketplace_project.admin_urls')
+
+FIRST_URL = '/api/products/'
+
+IMPORT_TIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$')
+
+
+def boot():
+    """Boot the project in this (fresh) interpreter and return the timings report."""
+    phases = {}
+    started = last = time.perf_counter()
+
+    def lap(name):
+        nonlocal last
+        now = time.perf_counter()
+        phases[name] = round((now - last) * 1000, 2)
+        last = now
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'marketplace_project.settings')
+    import django
+    from django.conf import settings
+    settings.INSTALLED_APPS
+    lap('settings')
+    django.setup(set_prefix=False)
+    lap('apps')
+    # What marketplace_project.wsgi does, minus hooking up the suggestion index build
+    from django.core.wsgi import get_wsgi_application
+    get_wsgi_application()
+    lap('wsgi_application')
+    from django.urls import get_resolver
+    resolver = get_resolver()
+    resolver.url_patterns
+    lap('urlconf')
+    resolver.resolve(FIRST_URL)
+    lap('first_resolve')
+    boot_ms = round((last - started) * 1000, 2)
+    eager = [name for name in LAZY_MODULES if name in sys.modules]
+
+    from rest_framework.serializers import ModelSerializer
+    from . import fast_serializers, serializers
+    fields = {}
+    for name, cls in vars(serializers).items():
+        if isinstance(cls, type) and issubclass(cls, ModelSerializer) and cls.__module__ == serializers.__name__:
+            start = time.perf_counter()
+            cls().fields
+            fields[name] = round((time.perf_counter() - start) * 1000, 2)
+    compiled = {}
+    for name in ('product_serializer', 'order_serializer', 'category_serializer'):
+        start = time.perf_counter()
+        getattr(fast_serializers, name)()
+        compiled[name] = round((time.perf_counter() - start) * 1000, 2)
+
+    return {
+        'boot_ms': boot_ms,
+        'phases': phases,
+        'eager_modules': eager,
+        'serializer_fields': fields,
+        'fast_serializers': compiled,
+    }
+
+
+def parse_import_times(output):
+    """Return [(module, self ms, cumulative ms)] from `python -X importtime` output."""
+    modules = []
+    for line in output.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            modules.append((match.group(4), int(match.group(1)) / 1000, int(match.group(2)) / 1000))
+    return modules
+
+
+def package_of(module):
+    """Group modules by top-level package, keeping Django's contrib apps apart."""
+    parts = module.split('.')
+    if parts[:2] == ['django', 'contrib'] and len(parts) > 2:
+        return '.'.join(parts[:3])
+    return parts[0]
+
+
+def profile(import_times=False):
+    """Run boot() in a fresh interpreter and return its report.
+
+    With `import_times`, the report also has an 'imports' list of
+    (module, self ms, cumulative ms); boot times are then inflated by the
+    import tracing.
+    """
+    command = [sys.executable]
+    if import_times:
+        command += ['-X', 'importtime']
+    command += ['-m', 'marketplace_api.startup']
+    env = {**os.environ}
+    env.setdefault('DJANGO_SETTINGS_MODULE', 'marketplace_project.settings')
+    result = subprocess.run(command, cwd=BASE_DIR, env=env, capture_output=True, text=True, check=True)
+    report = json.loads(result.stdout)
+    if import_times:
+        report['imports'] = parse_import_times(result.stderr)
+    return report
+
+
+if __name__ == '__main__':
+    json.dump(boot(), sys.stdout)
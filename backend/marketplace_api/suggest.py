@@ -0,0 +1,223 @@
+"""
+In-memory prefix index for search-as-you-type suggestions.
+
+Product names, category names and seller company names are kept as a sorted
+list of normalized keys, one per word, so "steel" also finds "Stainless Steel
+Pipes". A lookup is a bisect to the first key with the prefix and a short
+scan, with no database access.
+
+Each process builds its index on first use (wsgi.py and asgi.py start
+building it in a background thread when the process serves its first
+request, so neither booting nor that request waits on the database) and
+applies writes from model signals once their transaction commits. To pick up writes made by other
+processes, an index older than settings.SUGGEST_INDEX_MAX_AGE seconds is
+rebuilt in a background thread while requests keep using it; signal writes
+made during the rebuild are replayed onto the new index before it replaces
+the old one.
+"""
+import bisect
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connection, transaction
+
+from .models import Category, Product, UserProfile
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 25
+SELLER_TYPES = ('exporter', 'both')
+
+
+def _normalize(text):
+    return ' '.join(text.casefold().split())
+
+
+def _keys(label):
+    words = _normalize(label).split(' ')
+    return {' '.join(words[i:]) for i in range(len(words)) if words[i]}
+
+
+class PrefixIndex:
+    def __init__(self, entries=()):
+        self.labels = {}
+        keys = []
+        for kind, pk, label in entries:
+            self.labels[(kind, pk)] = label
+            keys.extend((key, kind, pk) for key in _keys(label))
+        # Sorted (key, kind, id) tuples
+        self.keys = sorted(keys)
+        self.lock = threading.Lock()
+        self.built_at = time.monotonic()
+
+    def add(self, kind, pk, label):
+        with self.lock:
+            self._remove(kind, pk)
+            self.labels[(kind, pk)] = label
+            for key in _keys(label):
+                bisect.insort(self.keys, (key, kind, pk))
+
+    def remove(self, kind, pk):
+        with self.lock:
+            self._remove(kind, pk)
+
+    def _remove(self, kind, pk):
+        label = self.labels.pop((kind, pk), None)
+        if label is None:
+            return
+        for key in _keys(label):
+            entry = (key, kind, pk)
+            i = bisect.bisect_left(self.keys, entry)
+            if i < len(self.keys) and self.keys[i] == entry:
+                del self.keys[i]
+
+    def search(self, prefix, limit=DEFAULT_LIMIT):
+        prefix = _normalize(prefix)
+        if not prefix:
+            return []
+        results = []
+        seen = set()
+        with self.lock:
+            i = bisect.bisect_left(self.keys, (prefix,))
+            while i < len(self.keys) and len(results) < limit:
+                key, kind, pk = self.keys[i]
+                if not key.startswith(prefix):
+                    break
+                if (kind, pk) not in seen:
+                    seen.add((kind, pk))
+                    results.append({'type': kind, 'id': pk, 'text': self.labels[(kind, pk)]})
+                i += 1
+        return results
+
+
+def _entries():
+    for pk, name in Product.objects.filter(is_active=True).values_list('pk', 'name').iterator():
+        yield 'product', pk, name
+    for pk, name in Category.objects.values_list('pk', 'name').iterator():
+        yield 'category', pk, name
+    sellers = UserProfile.objects.filter(user_type__in=SELLER_TYPES).exclude(company_name__isnull=True).exclude(company_name='')
+    for user_id, company_name in sellers.values_list('user_id', 'company_name').iterator():
+        yield 'seller', user_id, company_name
+
+
+_index = None
+# Held by whichever thread is building an index
+_build_lock = threading.Lock()
+# Guards swapping in a new index against concurrent signal writes
+_hooks_lock = threading.Lock()
+# Signal writes made while a rebuild reads the database, or None when not rebuilding
+_replay = None
+
+
+def _is_stale(index):
+    return time.monotonic() - index.built_at > settings.SUGGEST_INDEX_MAX_AGE
+
+
+def _rebuild():
+    """Build an index from the database and swap it in; the caller holds _build_lock."""
+    global _index, _replay
+    with _hooks_lock:
+        _replay = []
+    try:
+        index = PrefixIndex(_entries())
+        with _hooks_lock:
+            # The rows may have been read before these writes
+            for method, args in _replay:
+                getattr(index, method)(*args)
+            _index = index
+    finally:
+        with _hooks_lock:
+            _replay = None
+
+
+def _rebuild_in_background():
+    # _build_lock was acquired by the thread that started this one
+    try:
+        _rebuild()
+    finally:
+        _build_lock.release()
+        connection.close()
+
+
+def _build_in_background():
+    try:
+        get_index()
+    finally:
+        connection.close()
+
+
+def get_index():
+    index = _index
+    if index is None:
+        # Nothing to serve yet, so the first requests wait for one build
+        with _build_lock:
+            if _index is None:
+                _rebuild()
+        return _index
+    if _is_stale(index) and _build_lock.acquire(blocking=False):
+        threading.Thread(target=_rebuild_in_background, name='suggest-rebuild', daemon=True).start()
+    return index
+
+
+def warm(background=False):
+    if background:
+        threading.Thread(target=_build_in_background, name='suggest-warm', daemon=True).start()
+    else:
+        get_index()
+
+
+def _warm_once(sender, **kwargs):
+    request_started.disconnect(dispatch_uid='suggest-warm')
+    warm(background=True)
+
+
+def warm_on_first_request():
+    """Start a background build when this process starts serving requests.
+
+    A build started at import would run in the master of a preloading server
+    (gunicorn --preload), and a worker forked during it would inherit the held
+    _build_lock and the master's database connection.
+    """
+    request_started.connect(_warm_once, dispatch_uid='suggest-warm')
+
+
+def suggest(prefix, limit=DEFAULT_LIMIT):
+    return get_index().search(prefix, limit)
+
+
+# Signal hooks; a process that has not built its index yet has nothing to update
+
+def _apply_now(method, *args):
+    with _hooks_lock:
+        if _index is not None:
+            getattr(_index, method)(*args)
+        if _replay is not None:
+            _replay.append((method, args))
+
+
+def _apply(method, *args):
+    # A rolled back write must not reach the index
+    transaction.on_commit(lambda: _apply_now(method, *args))
+
+
+def update_product(product):
+    if product.is_active:
+        _apply('add', 'product', product.pk, product.name)
+    else:
+        _apply('remove', 'product', product.pk)
+
+
+def update_category(category):
+    _apply('add', 'category', category.pk, category.name)
+
+
+def update_seller(profile):
+    if profile.user_type in SELLER_TYPES and profile.company_name:
+        _apply('add', 'seller', profile.user_id, profile.company_name)
+    else:
+        _apply('remove', 'seller', profile.user_id)
+
+
+def remove(kind, pk):
+    _apply('remove', kind, pk)
@@ -0,0 +1,154 @@
+"""
+Delta sync for offline-capable clients.
+
+A sync token is a signed position per object type: the (updated_at, id) of
+the last product, category and order row the client has received, and the
+(deleted_at, id) of the last tombstone. A sync request returns the rows
+changed after those positions, read in (updated_at, id) order from the
+matching indexes, plus the ids deleted since then. Rows moved to the archive
+are listed under `archived` rather than `deleted`: they left the live tables
+but can still be read, so clients may keep them as history.
+
+Rows can commit with an updated_at slightly older than rows already sent, so
+a position never moves past `now - SYNC_OVERLAP_SECONDS`; rows changed inside
+that window are sent again next time and clients apply changes as upserts.
+Tokens older than SYNC_TOKEN_MAX_AGE_DAYS (the tombstone retention) are not
+accepted and the client starts over with a full sync.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core import signing
+from django.db.models import Q
+from django.utils import timezone
+
+from . import fast_serializers
+from .models import Category, Order, Product, Tombstone
+
+TOKEN_SALT = 'marketplace_api.sync'
+TYPES = ('products', 'categories', 'orders')
+OBJECT_TYPES = {'products': 'product', 'categories': 'category', 'orders': 'order'}
+
+# Set while archive.py deletes rows it has copied to the archive
+_archiving = ContextVar('sync_archiving', default=False)
+
+
+class InvalidToken(ValueError):
+    pass
+
+
+def make_token(user_id, positions):
+    return signing.dumps({
+        'u': user_id,
+        'p': {key: [ts.isoformat(), pk] for key, (ts, pk) in positions.items()},
+    }, salt=TOKEN_SALT, compress=True)
+
+
+def read_token(token, user_id):
+    """Return the positions in a token, or None when the client must sync from scratch."""
+    try:
+        data = signing.loads(token, salt=TOKEN_SALT, max_age=timedelta(days=settings.SYNC_TOKEN_MAX_AGE_DAYS))
+    except signing.SignatureExpired:
+        return None
+    except signing.BadSignature:
+        raise InvalidToken('Invalid sync token.')
+    if data['u'] != user_id:
+        return None
+    return {key: (datetime.fromisoformat(ts), pk) for key, (ts, pk) in data['p'].items()}
+
+
+def _page(queryset, field, position, limit, horizon, *columns):
+    """Return (rows, more, next position) for rows after `position` in (field, id) order."""
+    if position is not None:
+        ts, pk = position
+        queryset = queryset.filter(Q(**{f'{field}__gt': ts}) | Q(**{field: ts, 'pk__gt': pk}))
+    rows = list(queryset.order_by(field, 'pk').values_list('pk', field, *columns)[:limit + 1])
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if more and rows[-1][1] < horizon:
+        return rows, True, (rows[-1][1], rows[-1][0])
+    return rows, more, (horizon, 0)
+
+
+def _tombstones(key, queryset, position, limit, horizon):
+    if position is None:
+        # A full sync has nothing to delete on the client
+        return [], [], False, (horizon, 0)
+    rows, more, position = _page(
+        queryset.filter(object_type=OBJECT_TYPES[key]), 'deleted_at', position, limit, horizon,
+        'object_id', 'archived',
+    )
+    deleted = [row[2] for row in rows if not row[3]]
+    archived = [row[2] for row in rows if row[3]]
+    return deleted, archived, more, position
+
+
+def changes(user, token=None, request=None, limit=None):
+    """Return the sync response for `user` (may be anonymous) given their last token."""
+    limit = limit or settings.SYNC_PAGE_SIZE
+    user_id = user.pk if user.is_authenticated else None
+    positions = read_token(token, user_id) if token else None
+    full = positions is None
+    positions = positions or {}
+    horizon = timezone.now() - timedelta(seconds=settings.SYNC_OVERLAP_SECONDS)
+    tombstones = Tombstone.objects.all()
+
+    sources = {
+        'products': (Product.objects.all(), fast_serializers.product_serializer()),
+        'categories': (Category.objects.all(), fast_serializers.category_serializer()),
+    }
+    if user_id is not None:
+        sources['orders'] = (Order.objects.filter(user_id=user_id), fast_serializers.order_serializer())
+        tombstones_by_type = {'orders': tombstones.filter(user_id=user_id)}
+    else:
+        tombstones_by_type = {}
+
+    response = {'full': full}
+    next_positions = {}
+    has_more = False
+    for key, (queryset, compiled) in sources.items():
+        rows, more, next_positions[key] = _page(
+            queryset, 'updated_at', positions.get(key), limit, horizon,
+            *(('is_active',) if key == 'products' else ()),
+        )
+        # Deactivated products leave the catalog, so clients drop them too
+        updated = [row[0] for row in rows if key != 'products' or row[2]]
+        deleted = [row[0] for row in rows if key == 'products' and not row[2]]
+        removed, archived, more_deleted, next_positions[f'{key}.deleted'] = _tombstones(
+            key, tombstones_by_type.get(key, tombstones), positions.get(f'{key}.deleted'), limit, horizon
+        )
+        response[key] = {
+            'updated': compiled.serialize_page(updated, request),
+            'deleted': deleted + removed,
+            'archived': archived,
+        }
+        has_more = has_more or more or more_deleted
+    response['has_more'] = has_more
+    response['token'] = make_token(user_id, next_positions)
+    return response
+
+
+@contextmanager
+def archiving():
+    """Record the deletions made inside the block as moves to the archive."""
+    reset = _archiving.set(True)
+    try:
+        yield
+    finally:
+        _archiving.reset(reset)
+
+
+def record_deletion(instance, user_id=None):
+    Tombstone.objects.create(
+        object_type=instance._meta.model_name, object_id=instance.pk, user_id=user_id,
+        archived=_archiving.get(),
+    )
+
+
+def prune(now=None):
+    """Delete tombstones no valid token can still need. Returns the number deleted."""
+    cutoff = (now or timezone.now()) - timedelta(days=settings.SYNC_TOKEN_MAX_AGE_DAYS)
+    deleted, _ = Tombstone.objects.filter(deleted_at__lt=cutoff).delete()
+    return deleted
@@ -1,3 +1,2032 @@
-from django.test import TestCase
+import hashlib
+import importlib
+import inspect
+import io
+import itertools
+import json
+import os
+import re
+import tempfile
+import threading
+import uuid
+from unittest import mock, skipUnless
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from types import SimpleNamespace
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.apps import apps as django_apps
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.signals import request_started
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import connection, transaction
+from django.conf import settings
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, get_resolver, resolve, reverse
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework import serializers as drf_serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIRequestFactory, APITestCase
+from rest_framework.throttling import SimpleRateThrottle
+
+from . import (
+    archive, categories, currency, fast_serializers, inventory, loadtest, notifications, outbox, recommendations,
+    serializers, session, shipping, specifications, startup, suggest, uploads, views
+)
+from .renderers import FastJSONRenderer
+from .throttling import TokenBucketThrottle
+from .models import (
+    Category, Product, ProductSpecification, Review,
+    Order, OrderItem, OrderDocument, DocumentUpload, ExchangeRate, Notification, NotificationCounter,
+    OutboxEvent, ProductRecommendation, Tombstone, UserProfile, USER_EMAIL_UNIQUE
+)
+
+
+class MarketplaceFixture:
+    """Test data that can be grown to a given number of rows per table.
+
+    Every product gets two specifications and two reviews, and every order
+    belongs to the buyer and has two items and a document, so per-row
+    relations grow with the fixture size.
+    """
+
+    def __init__(self):
+        # Cached ids (e.g. specification attributes) may refer to rows of a rolled back test
+        cache.clear()
+        self.seller = User.objects.create_user('seller', 'seller@example.com', 'password')
+        self.buyer = User.objects.create_user('buyer', 'buyer@example.com', 'password')
+        self.staff = User.objects.create_user('staff', 'staff@example.com', 'password', is_staff=True)
+        self.reviewers = [
+            User.objects.create_user(f'reviewer{i}', f'reviewer{i}@example.com', 'password')
+            for i in range(2)
+        ]
+        for user in [self.seller, self.buyer, self.staff] + self.reviewers:
+            UserProfile.objects.create(user=user, company_name=f'{user.username} Ltd')
+        self.categories = []
+        self.products = []
+        self.orders = []
+        # Split the stock of products added from now on into shards (see inventory.py)
+        self.shard_stock = False
+
+    def grow(self, size):
+        while len(self.categories) < size:
+            self.categories.append(Category.objects.create(name=f'Category {len(self.categories)}'))
+
+        new_products = [
+            Product(
+                seller=self.seller, category=self.categories[i % len(self.categories)],
+                name=f'Product {i}', description='Steel pipes', price='10.50',
+                minimum_order_quantity=1, available_quantity=1000, unit='Tons',
+                country_of_origin='India', image=f'products/product-{i}.jpg',
+            )
+            for i in range(len(self.products), size)
+        ]
+        for product in new_products:
+            product.save()
+            if self.shard_stock:
+                inventory.ensure_shards(product)
+        ProductSpecification.objects.bulk_create(
+            ProductSpecification(product=product, name=name, value=value)
+            for product in new_products
+            for name, value in [('Material', 'Steel'), ('Weight', '20')]
+        )
+        specifications.reindex(ProductSpecification.objects.filter(product__in=new_products))
+        Review.objects.bulk_create(
+            Review(product=product, user=reviewer, rating=4, comment='Good')
+            for product in new_products
+            for reviewer in self.reviewers
+        )
+        self.products.extend(new_products)
+
+        while len(self.orders) < size:
+            order = Order.objects.create(
+                user=self.buyer, total_amount='21.00', shipping_address='Harbour Road 1',
+                destination_country='Germany', status='inquiry',
+            )
+            OrderItem.objects.bulk_create(
+                OrderItem(order=order, product=product, quantity=1, price='10.50')
+                for product in self.products[:2]
+            )
+            OrderDocument.objects.create(
+                order=order, document_type='invoice', document='order_documents/invoice.pdf'
+            )
+            self.orders.append(order)
+
+
+# Fast hashing keeps fixture set-up cheap; it does not change query counts
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class MarketplaceTestCase(APITestCase):
+    """Gives every test a MarketplaceFixture grown to `fixture_size` rows."""
+    fixture_size = 1
+
+    def setUp(self):
+        self.fixture = MarketplaceFixture()
+        self.fixture.grow(self.fixture_size)
+
+
+class QueryBudgetTestCase(MarketplaceTestCase):
+    """Asserts that an action runs an exact number of queries at every fixture size.
+
+    The same budget is required at 1 and at 100 rows, so an N+1 query in any
+    action or serializer shows up as a failure rather than a slow endpoint.
+    """
+    # Each assertion grows the fixture itself
+    fixture_size = 0
+    sizes = (1, 100)
+
+    def setUp(self):
+        super().setUp()
+        self.counter = itertools.count()
+
+    def assertQueryBudget(self, budget, run):
+        counts = []
+        for size in self.sizes:
+            self.fixture.grow(size)
+            # Cached state (session context, throttle buckets) must not hide queries
+            cache.clear()
+            with CaptureQueriesContext(connection) as ctx:
+                run()
+            counts.append(len(ctx))
+            if len(ctx) != budget:
+                queries = '\n'.join(query['sql'] for query in ctx.captured_queries)
+                self.fail(f'Expected {budget} queries at {size} rows, got {len(ctx)}:\n{queries}')
+        self.assertEqual(counts, [budget] * len(self.sizes))
+
+    def request(self, user, method, path, data=None, expected_status=200, **extra):
+        # A fresh client per request; logging out an existing one would add session queries
+        client = self.client_class()
+        if user is not None:
+            client.force_authenticate(user)
+        if 'content_type' not in extra:
+            extra['format'] = 'json'
+        response = getattr(client, method)(path, data, **extra)
+        self.assertEqual(response.status_code, expected_status, getattr(response, 'data', None))
+        return response
+
+
+class AuthQueryBudgetTests(QueryBudgetTestCase):
+    def test_register(self):
+        def run():
+            n = next(self.counter)
+            self.request(None, 'post', '/api/register/', {
+                'username': f'new{n}', 'email': f'new{n}@example.com', 'password': 'password',
+            }, expected_status=201)
+        # Savepoint, user insert, profile insert, release
+        self.assertQueryBudget(4, run)
+
+    def test_login(self):
+        Token.objects.create(user=self.fixture.buyer)
+        self.assertQueryBudget(2, lambda: self.request(None, 'post', '/api/login/', {
+            'username': 'buyer', 'password': 'password',
+        }))
+
+    def test_batch(self):
+        # Both me endpoints share one session context load
+        self.assertQueryBudget(3, lambda: self.request(self.fixture.buyer, 'post', '/api/batch/', {
+            'requests': [
+                {'id': 'user', 'path': 'users/me/'},
+                {'id': 'profile', 'path': 'profiles/me/'},
+                {'id': 'categories', 'path': 'categories/'},
+            ],
+        }))
+
+    def test_logout(self):
+        for user in self.fixture.reviewers:
+            Token.objects.create(user=user)
+        # Fresh instances, without the token cached by create()
+        users = iter([User.objects.get(pk=user.pk) for user in self.fixture.reviewers])
+        # Token lookup and delete
+        self.assertQueryBudget(2, lambda: self.request(next(users), 'post', '/api/logout/'))
+
+
+class MediaQueryBudgetTests(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=temp_dir.name))
+        # Every fixture order's document points at this file
+        os.makedirs(os.path.join(temp_dir.name, 'order_documents'))
+        with open(os.path.join(temp_dir.name, 'order_documents', 'invoice.pdf'), 'wb') as fh:
+            fh.write(b'%PDF')
+
+    def get(self, user, path):
+        self.request(user, 'get', path).close()
+
+    def test_order_document(self):
+        self.assertQueryBudget(1, lambda: self.get(self.fixture.buyer, '/media/order_documents/invoice.pdf'))
+
+    def test_order_document_as_staff(self):
+        self.assertQueryBudget(0, lambda: self.get(self.fixture.staff, '/media/order_documents/invoice.pdf'))
+
+
+class UserQueryBudgetTests(QueryBudgetTestCase):
+    def test_list(self):
+        self.assertQueryBudget(2, lambda: self.request(self.fixture.staff, 'get', '/api/users/'))
+
+    def test_retrieve(self):
+        self.assertQueryBudget(1, lambda: self.request(
+            self.fixture.staff, 'get', f'/api/users/{self.fixture.buyer.pk}/'
+        ))
+
+    def test_me(self):
+        self.assertQueryBudget(1, lambda: self.request(self.fixture.buyer, 'get', '/api/users/me/'))
+
+    def test_create(self):
+        def run():
+            n = next(self.counter)
+            self.request(self.fixture.staff, 'post', '/api/users/', {
+                'username': f'new{n}', 'email': f'new{n}@example.com',
+            }, expected_status=201)
+        self.assertQueryBudget(2, run)
+
+    def test_update(self):
+        self.assertQueryBudget(2, lambda: self.request(
+            self.fixture.staff, 'patch', f'/api/users/{self.fixture.buyer.pk}/',
+            {'first_name': f'Buyer {next(self.counter)}'}
+        ))
+
+    def test_destroy(self):
+        users = iter([User.objects.create_user(f'leaving{i}') for i in range(len(self.sizes))])
+        # The cascade checks every table that refers to users, independent of their rows
+        self.assertQueryBudget(15, lambda: self.request(
+            self.fixture.staff, 'delete', f'/api/users/{next(users).pk}/', expected_status=204
+        ))
+
+
+class UserProfileQueryBudgetTests(QueryBudgetTestCase):
+    def test_list(self):
+        self.assertQueryBudget(2, lambda: self.request(self.fixture.staff, 'get', '/api/profiles/'))
+
+    def test_me(self):
+        self.assertQueryBudget(1, lambda: self.request(self.fixture.buyer, 'get', '/api/profiles/me/'))
+
+    def test_me_update(self):
+        self.assertQueryBudget(3, lambda: self.request(
+            self.fixture.buyer, 'patch', '/api/profiles/me/', {'company_name': f'Buyer {next(self.counter)}'}
+        ))
+
+    def test_retrieve(self):
+        self.assertQueryBudget(1, lambda: self.request(
+            self.fixture.buyer, 'get', f'/api/profiles/{self.fixture.buyer.profile.pk}/'
+        ))
+
+    def test_create(self):
+        users = iter([User.objects.create_user(f'new{i}') for i in range(len(self.sizes))])
+        self.assertQueryBudget(2, lambda: self.request(
+            next(users), 'post', '/api/profiles/', {'company_name': 'New Ltd'}, expected_status=201
+        ))
+
+    def test_update(self):
+        self.assertQueryBudget(2, lambda: self.request(
+            self.fixture.buyer, 'put', f'/api/profiles/{self.fixture.buyer.profile.pk}/',
+            {'company_name': f'Buyer {next(self.counter)}', 'user_type': 'buyer'}
+        ))
+
+    def test_destroy(self):
+        profiles = iter([self.fixture.seller.profile, self.fixture.buyer.profile])
+        self.assertQueryBudget(2, lambda: self.request(
+            self.fixture.staff, 'delete', f'/api/profiles/{next(profiles).pk}/', expected_status=204
+        ))
+
+
+class CategoryQueryBudgetTests(QueryBudgetTestCase):
+    def test_list(self):
+        self.assertQueryBudget(2, lambda: self.request(None, 'get', '/api/categories/'))
+
+    def test_retrieve(self):
+        self.assertQueryBudget(1, lambda: self.request(
+            None, 'get', f'/api/categories/{self.fixture.categories[0].pk}/'
+        ))
+
+    def test_tree(self):
+        self.assertQueryBudget(1, lambda: self.request(None, 'get', '/api/categories/tree/'))
+
+    def test_create(self):
+        def run():
+            self.request(self.fixture.staff, 'post', '/api/categories/', {
+                'name': f'Metals {next(self.counter)}', 'parent': self.fixture.categories[0].pk,
+            }, expected_status=201)
+        self.assertQueryBudget(5, run)
+
+    def test_update(self):
+        self.assertQueryBudget(4, lambda: self.request(
+            self.fixture.staff, 'patch', f'/api/categories/{self.fixture.categories[0].pk}/',
+            {'description': f'Revision {next(self.counter)}'}
+        ))
+
+    def test_destroy(self):
+        empty = iter([Category.objects.create(name=f'Empty {i}') for i in range(len(self.sizes))])
+        self.assertQueryBudget(5, lambda: self.request(
+            self.fixture.staff, 'delete', f'/api/categories/{next(empty).pk}/', expected_status=204
+        ))
+
+
+class NotificationQueryBudgetTests(QueryBudgetTestCase):
+    def test_fan_out_and_list(self):
+        # Creates the consumer cursor; every fixture order is then a new inquiry for the seller
+        notifications.fan_out()
+        def run():
+            notifications.fan_out()
+            self.request(self.fixture.seller, 'get', '/api/notifications/')
+        # Fan-out (savepoint pair, cursor, events, recipients, inserts, counters, cursor
+        # update) and the page with its count, independent of the batch size
+        self.assertQueryBudget(12, run)
+
+    def test_poll(self):
+        notifications.fan_out()
+        def run():
+            notifications.fan_out()
+            self.request(self.fixture.seller, 'get', '/api/notifications/poll/?after=0')
+        # The fan-out's queries, then the new notifications and the unread count
+        self.assertQueryBudget(13, run)
+
+    def test_unread_count(self):
+        self.assertQueryBudget(1, lambda: self.request(self.fixture.seller, 'get', '/api/notifications/unread-count/'))
+
+    def test_read(self):
+        unread = iter(Notification.objects.bulk_create(
+            Notification(user=self.fixture.seller, kind='inquiry', event_id=i, title=f'New inquiry {i}')
+            for i in range(len(self.sizes))
+        ))
+        NotificationCounter.objects.create(user=self.fixture.seller, unread=len(self.sizes))
+        # The notification, the savepoint pair around both UPDATEs, and the new unread count
+        self.assertQueryBudget(6, lambda: self.request(
+            self.fixture.seller, 'post', f'/api/notifications/{next(unread).pk}/read/'
+        ))
+
+    def test_read_all(self):
+        notifications.fan_out()
+        def run():
+            notifications.fan_out()
+            self.request(self.fixture.seller, 'post', '/api/notifications/read-all/')
+        # One UPDATE marks every unread notification, however many there are
+        self.assertQueryBudget(14, run)
+
+
+class SyncQueryBudgetTests(QueryBudgetTestCase):
+    def test_full_sync(self):
+        # One query for the changed ids of each type, then the fast serializers' own queries
+        self.assertQueryBudget(20, lambda: self.request(self.fixture.buyer, 'get', '/api/sync/'))
+
+    def test_delta_sync(self):
+        self.fixture.grow(1)
+        token = self.request(self.fixture.buyer, 'get', '/api/sync/').data['token']
+        # Plus one tombstone query per type
+        self.assertQueryBudget(23, lambda: self.request(self.fixture.buyer, 'get', f'/api/sync/?token={token}'))
+
+    def test_change_feed(self):
+        # Every fixture row published an event; one page is read whatever the backlog
+        self.assertQueryBudget(1, lambda: self.request(self.fixture.staff, 'get', '/api/changes/'))
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class RegistrationTests(APITestCase):
+    def register(self, username, email):
+        return self.client.post('/api/register/', {
+            'username': username, 'email': email, 'password': 'password',
+        }, format='json')
+
+    def test_duplicate_username(self):
+        self.register('ada', 'ada@example.com')
+        response = self.register('ada', 'other@example.com')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {'error': 'Username already exists'})
+
+    def test_duplicate_email_ignores_case(self):
+        self.register('ada', 'ada@example.com')
+        response = self.register('lovelace', 'ADA@example.com')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {'error': 'Email already exists'})
+        self.assertFalse(User.objects.filter(username='lovelace').exists())
+
+    def test_blank_emails_may_repeat(self):
+        User.objects.create_user('first')
+        User.objects.create_user('second')
+
+    def test_migration_refuses_duplicate_emails(self):
+        migration = importlib.import_module('marketplace_api.migrations.0005_auth_user_email_unique')
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP INDEX {USER_EMAIL_UNIQUE.name}')
+        User.objects.create_user('first', email='dup@example.com')
+        User.objects.create_user('second', email='Dup@example.com')
+        # The check only reads through the editor's connection
+        schema_editor = SimpleNamespace(connection=connection)
+        with self.assertRaisesMessage(RuntimeError, 'dup@example.com'):
+            migration.check_duplicate_emails(django_apps, schema_editor)
+
+
+class ThrottleTests(MarketplaceTestCase):
+    def setUp(self):
+        super().setUp()
+        # DRF reads the rates once, when the throttle classes are defined
+        self.enterContext(mock.patch.dict(
+            SimpleRateThrottle.THROTTLE_RATES, {'anon': '3/min', 'user': '5/min', 'auth': '2/min'}
+        ))
+        self.clock = self.enterContext(mock.patch.object(TokenBucketThrottle, 'timer', mock.Mock(return_value=1000.0)))
+
+    def get(self, user=None):
+        client = self.client_class()
+        if user is not None:
+            client.force_authenticate(user)
+        return client.get('/api/categories/')
+
+    def test_burst_then_throttled(self):
+        self.assertEqual([self.get().status_code for _ in range(4)], [200, 200, 200, 429])
+
+    def test_retry_after_and_refill(self):
+        for _ in range(3):
+            self.get()
+        # One token comes back every 60 / 3 seconds
+        self.assertEqual(self.get()['Retry-After'], '20')
+        self.clock.return_value += 5
+        self.assertEqual(self.get()['Retry-After'], '15')
+        self.clock.return_value += 15
+        self.assertEqual(self.get().status_code, 200)
+        self.assertEqual(self.get().status_code, 429)
+        # The bucket never holds more than the burst size
+        self.clock.return_value += 3600
+        self.assertEqual([self.get().status_code for _ in range(4)], [200, 200, 200, 429])
+
+    def test_anon_and_user_buckets_are_separate(self):
+        for _ in range(3):
+            self.get()
+        self.assertEqual(self.get().status_code, 429)
+        self.assertEqual([self.get(self.fixture.buyer).status_code for _ in range(6)], [200] * 5 + [429])
+        self.assertEqual(self.get(self.fixture.seller).status_code, 200)
+
+    def test_auth_scope_rejects_before_checking_passwords(self):
+        credentials = {'username': 'buyer', 'password': 'wrong'}
+        with mock.patch('marketplace_api.views.authenticate', return_value=None) as authenticate:
+            statuses = [self.client.post('/api/login/', credentials, format='json').status_code for _ in range(3)]
+        self.assertEqual(statuses, [401, 401, 429])
+        self.assertEqual(authenticate.call_count, 2)
+        response = self.client.post('/api/register/', {
+            'username': 'ada', 'email': 'ada@example.com', 'password': 'password',
+        }, format='json')
+        self.assertEqual(response.status_code, 429)
+        self.assertFalse(User.objects.filter(username='ada').exists())
+
+
+@override_settings(ALLOWED_HOSTS=['shop.example.com', 'api.example.com', 'testserver'])
+class SessionContextTests(MarketplaceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.buyer = self.fixture.buyer
+        self.client.force_authenticate(self.buyer)
+
+    def cached(self):
+        return cache.get(session.cache_key(self.buyer.pk))
+
+    def test_links_are_built_for_each_request(self):
+        UserProfile.objects.filter(user=self.buyer).update(profile_picture='profile_pics/buyer.jpg')
+        first = self.client.get('/api/profiles/me/', HTTP_HOST='shop.example.com')
+        second = self.client.get('/api/profiles/me/', HTTP_HOST='api.example.com', secure=True)
+        self.assertEqual(first.data['profile_picture'], 'http://shop.example.com/media/profile_pics/buyer.jpg')
+        self.assertEqual(second.data['profile_picture'], 'https://api.example.com/media/profile_pics/buyer.jpg')
+        self.assertEqual(self.cached()['profile']['profile_picture'], '/media/profile_pics/buyer.jpg')
+
+    def test_writes_invalidate_the_cached_context(self):
+        profile = UserProfile.objects.get(user=self.buyer)
+        order = self.fixture.orders[0]
+
+        def rename_profile():
+            profile.company_name = 'Renamed Ltd'
+            profile.save()
+
+        def rename_user():
+            self.buyer.first_name = 'Bea'
+            self.buyer.save()
+
+        def place_order():
+            Order.objects.create(user=self.buyer, total_amount='5.00', shipping_address='Harbour Road 1')
+
+        writes = {
+            'profile': rename_profile,
+            'user': rename_user,
+            'new order': place_order,
+            'deleted order': order.delete,
+        }
+        for name, write in writes.items():
+            with self.subTest(write=name):
+                self.client.get('/api/users/me/')
+                self.assertIsNotNone(self.cached())
+                write()
+                self.assertIsNone(self.cached())
+        me = self.client.get('/api/users/me/').data
+        self.assertEqual((me['first_name'], me['order_count']), ('Bea', 1))
+
+
+class DirtyFieldsTests(MarketplaceTestCase):
+    def test_loading_a_deferred_field_keeps_pending_changes(self):
+        order = Order.objects.only('id', 'status').get(pk=self.fixture.orders[0].pk)
+        order.status = 'cancelled'
+        order.notes
+        self.assertEqual(order.get_dirty_fields(), ['status'])
+        order.save()
+        self.assertEqual(Order.objects.get(pk=order.pk).status, 'cancelled')
+
+    def test_refresh_discards_changes(self):
+        order = Order.objects.get(pk=self.fixture.orders[0].pk)
+        order.status = 'cancelled'
+        order.refresh_from_db(fields=['status'])
+        self.assertEqual(order.get_dirty_fields(), [])
+
+    def updated_columns(self, table, write):
+        """Run `write` and return the columns each UPDATE of `table` set."""
+        with CaptureQueriesContext(connection) as queries:
+            write()
+        prefix = f'UPDATE "{table}" SET '
+        return [
+            sorted(re.findall(r'"(\w+)" = ', query['sql'][len(prefix):query['sql'].index(' WHERE ')]))
+            for query in queries.captured_queries if query['sql'].startswith(prefix)
+        ]
+
+    def test_unchanged_save_writes_nothing(self):
+        order = Order.objects.get(pk=self.fixture.orders[0].pk)
+        with self.assertNumQueries(0):
+            order.save()
+
+    def test_endpoints_write_only_changed_columns(self):
+        product, order = self.fixture.products[0], self.fixture.orders[0]
+        profile = self.fixture.buyer.profile
+
+        def patch(user, path, data):
+            self.client.force_authenticate(user)
+            self.assertEqual(self.client.patch(path, data, format='json').status_code, 200)
+
+        self.assertEqual(self.updated_columns('marketplace_api_product', lambda: patch(
+            self.fixture.seller, f'/api/products/{product.pk}/', {'name': 'Copper Wire'}
+        )), [['name', 'updated_at']])
+        self.assertEqual(self.updated_columns('marketplace_api_order', lambda: patch(
+            self.fixture.buyer, f'/api/orders/{order.pk}/', {'notes': 'Deliver by May'}
+        )), [['notes', 'updated_at']])
+        self.assertEqual(self.updated_columns('marketplace_api_userprofile', lambda: patch(
+            self.fixture.buyer, f'/api/profiles/{profile.pk}/', {'phone_number': '555-0100'}
+        )), [['phone_number']])
+
+
+class CurrencyTests(MarketplaceTestCase):
+    fixture_size = 2
+
+    def setUp(self):
+        super().setUp()
+        ExchangeRate.objects.create(currency='EUR', rate='0.5')
+        self.euro_product = self.fixture.products[1]
+        self.euro_product.currency = 'EUR'
+        self.euro_product.save()
+
+    def test_rate_change_reprices_products(self):
+        self.euro_product.refresh_from_db()
+        self.assertEqual(str(self.euro_product.price_base), '21.0000')
+        ExchangeRate.objects.filter(currency='EUR').get().delete()
+        ExchangeRate.objects.create(currency='EUR', rate='2')
+        self.euro_product.refresh_from_db()
+        self.assertEqual(str(self.euro_product.price_base), '5.2500')
+
+    def test_display_currency_and_price_filter(self):
+        # 10.50 USD is 5.25 EUR; 10.50 EUR is 21.00 USD, i.e. 10.50 in EUR terms
+        response = self.client.get('/api/products/?currency=eur&max_price=6')
+        self.assertEqual(
+            [(item['id'], item['display_price'], item['display_currency']) for item in response.data['results']],
+            [(self.fixture.products[0].pk, '5.25', 'EUR')],
+        )
+
+    def test_unknown_currency(self):
+        self.assertEqual(self.client.get('/api/products/?currency=XYZ').status_code, 400)
+
+    def test_product_without_a_rate_is_a_validation_error(self):
+        product = self.fixture.products[0]
+        product.currency = 'XYZ'
+        with self.assertRaisesMessage(DjangoValidationError, 'No exchange rate is known'):
+            product.full_clean()
+
+    def test_deleted_rate_leaves_display_price_empty(self):
+        ExchangeRate.objects.filter(currency='EUR').delete()
+        response = self.client.get('/api/products/?currency=usd')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            {item['id']: item['display_price'] for item in response.data['results']},
+            {self.fixture.products[0].pk: '10.50', self.euro_product.pk: None},
+        )
+
+    def test_rate_added_by_another_process(self):
+        currency.get_rates()
+        # Saved elsewhere: this process's cached rates do not have it
+        ExchangeRate.objects.bulk_create([ExchangeRate(currency='GBP', rate='0.8')])
+        self.assertEqual(self.client.get('/api/products/?currency=GBP').status_code, 200)
+
+
+@override_settings(INVENTORY_SHARDS=4)
+class InventoryTests(MarketplaceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = self.fixture.products[0]
+        self.product.available_quantity = 10
+        self.product.save()
+
+    def express_interest(self, quantity):
+        self.client.force_authenticate(self.fixture.buyer)
+        return self.client.post(
+            f'/api/products/{self.product.pk}/express_interest/', {'quantity': quantity}, format='json'
+        )
+
+    def available(self):
+        return self.client.get(f'/api/products/{self.product.pk}/availability/').data['available_quantity']
+
+    def test_reservations_never_oversell(self):
+        self.assertEqual(self.express_interest(4).status_code, 201)
+        self.assertEqual(self.express_interest(6).status_code, 201)
+        self.assertEqual(self.express_interest(1).status_code, 400)
+        self.assertEqual(self.available(), 0)
+
+    def test_cancel_releases_and_roll_up_deducts(self):
+        cancelled = self.express_interest(3).data
+        confirmed = self.express_interest(5).data
+        self.client.post(f'/api/orders/{cancelled["id"]}/cancel/')
+        self.assertEqual(self.available(), 5)
+
+        order = Order.objects.get(pk=confirmed['id'])
+        order.status = 'confirmed'
+        order.save()
+        inventory.roll_up()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.available_quantity, 5)
+        self.assertEqual(self.available(), 5)
+
+    def test_roll_up_stops_at_zero_stock(self):
+        order = Order.objects.get(pk=self.express_interest(8).data['id'])
+        order.status = 'confirmed'
+        order.save()
+        # The seller lowers the stock below what is committed
+        Product.objects.filter(pk=self.product.pk).update(available_quantity=3)
+        self.assertEqual(inventory.roll_up(), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.available_quantity, 0)
+        event = OutboxEvent.objects.filter(object_type='product', object_id=self.product.pk).last()
+        self.assertEqual(event.payload['changes']['available_quantity'], [3, 0])
+
+    def test_rebalance_reads_the_current_stock(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        self.express_interest(4)
+        Product.objects.filter(pk=self.product.pk).update(available_quantity=20)
+        inventory.rebalance(stale)
+        self.assertEqual(self.available(), 16)
+
+
+@override_settings(INVENTORY_SHARDS=2)
+class BulkEditTests(MarketplaceTestCase):
+    fixture_size = 2
+
+    def setUp(self):
+        ExchangeRate.objects.create(currency='EUR', rate='0.5')
+        super().setUp()
+        self.euro_product, self.product = self.fixture.products
+        self.euro_product.currency = 'EUR'
+        self.euro_product.save()
+        inventory.ensure_shards(self.product)
+
+    def bulk_edit(self, user, changes):
+        self.client.force_authenticate(user)
+        return self.client.patch('/api/products/bulk/', changes, format='json')
+
+    def test_changes_keep_derived_state(self):
+        response = self.bulk_edit(self.fixture.seller, [
+            {'id': self.euro_product.pk, 'price': '4.00'},
+            {'id': self.product.pk, 'available_quantity': 7, 'is_active': False},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.euro_product.refresh_from_db()
+        self.assertEqual(str(self.euro_product.price_base), '8.0000')
+        self.assertEqual(inventory.available_quantities([self.product.pk])[self.product.pk], 7)
+        self.assertFalse(Product.objects.get(pk=self.product.pk).is_active)
+
+    def test_rejects_other_sellers_and_unknown_products(self):
+        self.assertEqual(self.bulk_edit(self.fixture.buyer, [{'id': self.product.pk, 'is_active': False}]).status_code, 403)
+        self.assertEqual(self.bulk_edit(self.fixture.seller, [{'id': 0, 'is_active': False}]).status_code, 404)
+        self.assertEqual(self.bulk_edit(self.fixture.seller, [{'id': self.product.pk}]).status_code, 400)
+        self.assertTrue(Product.objects.get(pk=self.product.pk).is_active)
+
+
+class DocumentUploadTests(MarketplaceTestCase):
+    def setUp(self):
+        super().setUp()
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.enterContext(override_settings(
+            MEDIA_ROOT=temp_dir.name, DOCUMENT_UPLOAD_TEMP_DIR=os.path.join(temp_dir.name, 'upload_sessions')
+        ))
+        self.client.force_authenticate(self.fixture.buyer)
+        # Larger than uploads.READ_SIZE, so a chunk is read in several parts
+        self.content = os.urandom(200 * 1024)
+        response = self.client.post('/api/document-uploads/', {
+            'order': self.fixture.orders[0].pk, 'document_type': 'invoice',
+            'filename': 'invoice.pdf', 'total_size': len(self.content),
+        }, format='json')
+        self.url = f'/api/document-uploads/{response.data["id"]}/'
+        self.half = len(self.content) // 2
+
+    def put_chunk(self, data, offset):
+        # Hashers are cached on commit, which TestCase would otherwise never reach
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.generic(
+                'PUT', f'{self.url}chunk/', data, content_type='application/octet-stream', HTTP_UPLOAD_OFFSET=str(offset)
+            )
+
+    def test_chunks_resume_and_commit(self):
+        self.assertEqual(self.put_chunk(self.content[:self.half], 0)['Upload-Offset'], str(self.half))
+        # A retried chunk at a stale offset is told where to resume
+        response = self.put_chunk(self.content[:self.half], 0)
+        self.assertEqual((response.status_code, response.data['offset']), (409, self.half))
+        self.assertEqual(self.client.get(self.url).data['received_size'], self.half)
+        self.assertEqual(self.client.post(f'{self.url}commit/').status_code, 409)
+
+        self.put_chunk(self.content[self.half:], self.half)
+        response = self.client.post(f'{self.url}commit/')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['sha256'], hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_empty_chunk_reports_the_offset(self):
+        self.put_chunk(self.content[:self.half], 0)
+        response = self.put_chunk(b'', self.half)
+        self.assertEqual((response.status_code, response['Upload-Offset']), (200, str(self.half)))
+        self.put_chunk(self.content[self.half:], self.half)
+        response = self.client.post(f'{self.url}commit/')
+        self.assertEqual(response.data['sha256'], hashlib.sha256(self.content).hexdigest())
+
+    def test_rejected_chunk_does_not_reach_the_digest(self):
+        self.put_chunk(self.content[:self.half], 0)
+        # Rejected only after its first part has been read and hashed
+        self.assertEqual(self.put_chunk(self.content[self.half:] + b'extra', self.half).status_code, 409)
+        self.put_chunk(self.content[self.half:], self.half)
+        response = self.client.post(f'{self.url}commit/')
+        self.assertEqual(response.data['sha256'], hashlib.sha256(self.content).hexdigest())
+
+    def test_stale_sessions_expire(self):
+        self.put_chunk(self.content[:self.half], 0)
+        upload = DocumentUpload.objects.get()
+        path = uploads.partial_path(upload)
+        self.assertEqual(uploads.expire_stale(), 0)
+        self.assertEqual(uploads.expire_stale(now=timezone.now() + timedelta(days=2)), 1)
+        self.assertFalse(DocumentUpload.objects.exists())
+        self.assertFalse(os.path.exists(path))
+
+
+class MediaTests(MarketplaceTestCase):
+    def setUp(self):
+        super().setUp()
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=temp_dir.name))
+        for name in ('order_documents/abc.pdf', 'products/pipe.jpg'):
+            os.makedirs(os.path.join(temp_dir.name, os.path.dirname(name)), exist_ok=True)
+            with open(os.path.join(temp_dir.name, name), 'wb') as fh:
+                fh.write(b'content')
+        OrderDocument.objects.create(
+            order=self.fixture.orders[0], document_type='invoice', document='order_documents/abc.pdf'
+        )
+
+    def get(self, path, user=None):
+        client = self.client_class()
+        if user is not None:
+            client.force_authenticate(user)
+        return client.get(path).status_code
+
+    def get_range(self, header):
+        response = self.client_class().get('/media/products/pipe.jpg', HTTP_RANGE=header)
+        content = b''.join(response.streaming_content) if response.streaming else response.content
+        return response.status_code, content, response.get('Content-Range')
+
+    def test_ranges(self):
+        # The file holds b'content'
+        self.assertEqual(self.get_range('bytes=0-2'), (206, b'con', 'bytes 0-2/7'))
+        self.assertEqual(self.get_range('bytes=4-'), (206, b'ent', 'bytes 4-6/7'))
+        self.assertEqual(self.get_range('bytes=-3'), (206, b'ent', 'bytes 4-6/7'))
+        self.assertEqual(self.get_range('bytes=5-100'), (206, b'nt', 'bytes 5-6/7'))
+        self.assertEqual(self.get_range('bytes=7-')[::2], (416, 'bytes */7'))
+        self.assertEqual(self.get_range('bytes=-0')[::2], (416, 'bytes */7'))
+
+    def test_unusable_ranges_are_ignored(self):
+        for header in ('bytes=5-2', 'bytes=0-1,3-4', 'bytes=x-1', 'items=0-1', 'bytes=-'):
+            with self.subTest(header=header):
+                self.assertEqual(self.get_range(header), (200, b'content', None))
+
+    def test_order_documents_are_only_served_to_their_owner(self):
+        path = '/media/order_documents/abc.pdf'
+        self.assertEqual(self.get(path), 401)
+        self.assertEqual(self.get(path, self.fixture.buyer), 200)
+        self.assertEqual(self.get(path, self.fixture.seller), 404)
+        self.assertEqual(self.get(path, self.fixture.staff), 200)
+        self.assertEqual(self.get('/media/products/pipe.jpg'), 200)
+
+    def test_archived_order_documents_are_still_served_to_their_owner(self):
+        order = self.fixture.orders[0]
+        Order.objects.filter(pk=order.pk).update(status='delivered', updated_at=timezone.now() - timedelta(days=365))
+        self.assertEqual(archive.archive_orders(), 1)
+        self.assertFalse(OrderDocument.objects.filter(document='order_documents/abc.pdf').exists())
+        path = '/media/order_documents/abc.pdf'
+        self.assertEqual(self.get(path, self.fixture.buyer), 200)
+        self.assertEqual(self.get(path, self.fixture.seller), 404)
+
+    def test_dot_segments_do_not_bypass_authorization(self):
+        for path in (
+            '/media/./order_documents/abc.pdf', '/media/x/../order_documents/abc.pdf',
+            '/media/%2E/order_documents/abc.pdf', '/media/order_documents//abc.pdf',
+        ):
+            with self.subTest(path=path):
+                self.assertEqual(self.get(path), 401)
+                self.assertEqual(self.get(path, self.fixture.seller), 404)
+                self.assertEqual(self.get(path, self.fixture.buyer), 200)
+        self.assertEqual(self.get('/media/../settings.py'), 404)
+
+
+class BatchTests(MarketplaceTestCase):
+    def batch(self, body, token=None):
+        client = self.client_class()
+        if token is not None:
+            client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        return client.post('/api/batch/', body, format='json')
+
+    def test_sub_requests_run_as_the_batch_user(self):
+        token = Token.objects.create(user=self.fixture.buyer)
+        response = self.batch({'requests': [
+            {'id': 'me', 'path': 'users/me/'}, {'id': 'missing', 'path': 'no-such-endpoint/'},
+        ]}, token)
+        self.assertEqual(response.status_code, 200)
+        me, missing = response.data['responses']
+        self.assertEqual((me['status'], me['body']['username']), (200, 'buyer'))
+        self.assertEqual(missing['status'], 404)
+
+        anonymous = self.batch({'requests': [{'path': 'users/me/'}]}).data['responses'][0]
+        self.assertEqual(anonymous['status'], 401)
+
+    def test_invalid_batches_are_rejected(self):
+        for body in (
+            [{'path': 'users/me/'}],
+            {'requests': []},
+            {'requests': [{'path': 'batch/'}]},
+            {'requests': [{'path': 'products/', 'method': 'POST'}]},
+            {'requests': [{'path': 'notifications/stream/'}]},
+        ):
+            with self.subTest(body=body):
+                self.assertEqual(self.batch(body).status_code, 400)
+
+
+class ArchiveTests(MarketplaceTestCase):
+    fixture_size = 3
+
+    def setUp(self):
+        super().setUp()
+        old = timezone.now() - timedelta(days=365)
+        self.order = self.fixture.orders[0]
+        Order.objects.filter(pk=self.order.pk).update(status='delivered', updated_at=old)
+        # Fixture orders only contain the first two products
+        self.product = self.fixture.products[2]
+        Product.objects.filter(pk=self.product.pk).update(is_active=False, updated_at=old)
+        self.client.force_authenticate(self.fixture.buyer)
+
+    def test_archived_rows_read_back(self):
+        before = self.client.get(f'/api/orders/{self.order.pk}/').data
+        self.assertEqual(archive.archive_orders(), 1)
+        self.assertEqual(archive.archive_products(), 1)
+        self.assertFalse(Order.objects.filter(pk=self.order.pk).exists())
+        self.assertFalse(Product.objects.filter(pk=self.product.pk).exists())
+
+        after = self.client.get(f'/api/orders/{self.order.pk}/').data
+        self.assertEqual(after['status'], 'delivered')
+        self.assertEqual(after['items'], json.loads(JSONRenderer().render(before['items'])))
+        self.assertEqual(self.client.get(f'/api/products/{self.product.pk}/').data['id'], self.product.pk)
+
+        history = self.client.get('/api/orders/my-orders/?include_archived=true').data
+        self.assertEqual(history['count'], 3)
+        self.assertEqual([item['id'] for item in history['results']], [order.pk for order in reversed(self.fixture.orders)])
+        self.assertEqual(self.client.get('/api/orders/my-orders/').data['count'], 2)
+
+    def test_other_users_cannot_read_archived_orders(self):
+        archive.archive_orders()
+        self.client.force_authenticate(self.fixture.seller)
+        self.assertEqual(self.client.get(f'/api/orders/{self.order.pk}/').status_code, 404)
+
+
+class SpecificationFilterTests(MarketplaceTestCase):
+    fixture_size = 3
+
+    def setUp(self):
+        # Every fixture product has Material=Steel and Weight=20
+        super().setUp()
+        heavy, copper = self.fixture.products[1:]
+        ProductSpecification.objects.filter(product=heavy, name='Weight').get().delete()
+        ProductSpecification.objects.create(product=heavy, name=' weight ', value='1,250.5 kg')
+        spec = ProductSpecification.objects.get(product=copper, name='Material')
+        spec.value = 'Copper'
+        spec.save()
+
+    def filtered(self, query):
+        response = self.client.get(f'/api/products/?{query}')
+        self.assertEqual(response.status_code, 200, response.data)
+        return sorted(self.fixture.products.index(Product.objects.get(pk=item['id'])) for item in response.data['results'])
+
+    def test_filters(self):
+        self.assertEqual(self.filtered('spec.material=STEEL'), [0, 1])
+        self.assertEqual(self.filtered('spec.Weight__gt=100'), [1])
+        self.assertEqual(self.filtered('spec.Material=Steel&spec.Weight__lte=20'), [0])
+        self.assertEqual(self.filtered('spec.Material__in=copper,Brass'), [2])
+        self.assertEqual(self.filtered('spec.Color=Red'), [])
+
+    def test_update_fields_keep_the_index(self):
+        spec = ProductSpecification.objects.get(product=self.fixture.products[0], name='Material')
+        spec.value = 'Brass'
+        spec.save(update_fields=['value'])
+        self.assertEqual(self.filtered('spec.Material=brass'), [0])
+
+    def test_values_longer_than_the_key(self):
+        # Case folding turns each character into two, past the key's 255
+        spec = ProductSpecification.objects.get(product=self.fixture.products[0], name='Material')
+        spec.value = 'ß' * 200
+        spec.save()
+        self.assertEqual(self.filtered(f'spec.Material={spec.value}'), [0])
+        self.assertEqual(self.filtered(f'spec.Material__in={spec.value},Brass'), [0])
+
+    def test_invalid_filters(self):
+        self.assertEqual(self.client.get('/api/products/?spec.Weight__lte=heavy').status_code, 400)
+        self.assertEqual(self.client.get('/api/products/?spec.Weight__regex=1').status_code, 400)
+
+
+class RecommendationTests(MarketplaceTestCase):
+    fixture_size = 4
+
+    def setUp(self):
+        super().setUp()
+        # Every fixture order holds products 0 and 1; the reviewers also
+        # ordered product 2 and one of them product 3
+        products = self.fixture.products
+        for reviewer, bought in zip(self.fixture.reviewers, [products[2:4], products[2:3]]):
+            order = Order.objects.create(user=reviewer, total_amount='1.00', shipping_address='-')
+            OrderItem.objects.bulk_create(
+                OrderItem(order=order, product=product, quantity=1, price='1.00') for product in bought
+            )
+
+    def recommended(self, product):
+        response = self.client.get(f'/api/products/{product.pk}/recommendations/')
+        return [item['id'] for item in response.data]
+
+    def test_recommendations(self):
+        self.assertEqual(recommendations.build(), 4)
+        products = [product.pk for product in self.fixture.products]
+        self.assertEqual(self.recommended(self.fixture.products[0]), [products[1], products[2], products[3]])
+        self.assertEqual(self.recommended(self.fixture.products[3]), [products[2], products[0], products[1]])
+
+    def test_python_ranking(self):
+        # Buyer 1 ordered products 1 and 2, buyer 2 products 1 and 3 (weight 3), buyer 3 product 3.
+        # cos(1, 2) = 1 / (sqrt(2) * 1) and cos(1, 3) = 3 / (sqrt(2) * sqrt(10)); 2 and 3 share no buyer
+        interactions = {(1, 1): 1.0, (1, 2): 1.0, (2, 1): 1.0, (2, 3): 3.0, (3, 3): 1.0}
+        self.assertEqual(recommendations._top_k_python(interactions, [1, 2, 3, 4], 10), {
+            1: ([2, 3], [0.7071, 0.6708]),
+            2: ([1], [0.7071]),
+            3: ([1], [0.6708]),
+        })
+        self.assertEqual(recommendations._top_k_python(interactions, [1], 1), {1: ([2], [0.7071])})
+
+    def test_non_numeric_ids_are_not_found(self):
+        self.client.force_authenticate(self.fixture.buyer)
+        for path in ('/api/products/abc/', '/api/products/abc/recommendations/', '/api/orders/abc/'):
+            with self.subTest(path=path):
+                self.assertEqual(self.client.get(path).status_code, 404)
+
+    def test_sparse_and_python_builds_agree(self):
+        if recommendations.sparse is None:
+            self.skipTest('NumPy and SciPy are not installed')
+        interactions = recommendations._interactions()
+        targets = sorted({product_id for _, product_id in interactions})
+        self.assertEqual(
+            recommendations._top_k_sparse(interactions, targets, 10),
+            recommendations._top_k_python(interactions, targets, 10),
+        )
+
+    def stored(self):
+        return list(ProductRecommendation.objects.order_by('pk').values_list('pk', 'product_ids', 'scores'))
+
+    def test_incremental_build(self):
+        # Only the buyer is left weighting products 0 and 1, who never ordered 2 or 3
+        Review.objects.filter(product__in=self.fixture.products[:2]).delete()
+        recommendations.build()
+        # Product 3's norm changes, and with it its score in product 2's list
+        order = Order.objects.create(user=self.fixture.staff, total_amount='1.00', shipping_address='-')
+        OrderItem.objects.create(order=order, product=self.fixture.products[3], quantity=1, price='1.00')
+        self.assertEqual(recommendations.build(), 2)
+        incremental = self.stored()
+        recommendations.build(full=True)
+        self.assertEqual(self.stored(), incremental)
+
+    def test_full_build_drops_products_without_interactions(self):
+        recommendations.build()
+        Product.objects.filter(pk=self.fixture.products[3].pk).update(is_active=False)
+        self.assertEqual(recommendations.build(full=True), 3)
+        self.assertFalse(ProductRecommendation.objects.filter(pk=self.fixture.products[3].pk).exists())
+
+
+class SuggestTests(MarketplaceTestCase):
+    fixture_size = 3
+
+    def setUp(self):
+        # The index is per process and would otherwise outlive the test's rows
+        suggest._index = None
+        super().setUp()
+        self.product = self.fixture.products[0]
+        self.product.name = 'Stainless Steel Pipes'
+        self.product.save()
+        UserProfile.objects.filter(user=self.fixture.seller).update(user_type='exporter')
+
+    def suggest(self, q, **params):
+        response = self.client.get('/api/suggest/', {'q': q, **params})
+        return [(item['type'], item['text']) for item in response.data]
+
+    def test_prefix_matches_any_word(self):
+        self.assertEqual(self.suggest('steel'), [('product', 'Stainless Steel Pipes')])
+        self.assertEqual(self.suggest('SELL'), [('seller', 'seller Ltd')])
+        self.assertEqual(self.suggest('category', limit=2), [('category', 'Category 0'), ('category', 'Category 1')])
+        self.assertEqual(self.suggest(''), [])
+
+    def test_writes_update_the_index(self):
+        self.suggest('steel')
+        with self.assertNumQueries(0):
+            suggest.suggest('steel')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = 'Copper Wire'
+            self.product.save()
+            self.fixture.products[1].delete()
+        self.assertEqual(self.suggest('steel'), [])
+        self.assertEqual(self.suggest('copper'), [('product', 'Copper Wire')])
+        self.assertEqual(self.suggest('product'), [('product', 'Product 2')])
+
+    def test_rolled_back_writes_are_not_indexed(self):
+        self.suggest('steel')
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(DjangoValidationError), transaction.atomic():
+                self.product.name = 'Copper Wire'
+                self.product.save()
+                self.fixture.products[1].delete()
+                raise DjangoValidationError('rolled back')
+        self.assertEqual(self.suggest('steel'), [('product', 'Stainless Steel Pipes')])
+        self.assertEqual(self.suggest('copper'), [])
+        self.assertEqual(self.suggest('product'), [('product', 'Product 1'), ('product', 'Product 2')])
+
+    def test_writes_during_a_rebuild_are_kept(self):
+        entries = suggest._entries
+        self.addCleanup(setattr, suggest, '_entries', entries)
+
+        def entries_read_before_a_write():
+            rows = list(entries())
+            with self.captureOnCommitCallbacks(execute=True):
+                self.product.name = 'Brass Fittings'
+                self.product.save()
+            yield from rows
+
+        suggest._entries = entries_read_before_a_write
+        with suggest._build_lock:
+            suggest._rebuild()
+        self.assertEqual(self.suggest('brass'), [('product', 'Brass Fittings')])
+        self.assertEqual(self.suggest('steel'), [])
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class SuggestRebuildTests(TransactionTestCase):
+    """The rebuild runs in its own thread and connection, so the rows it reads must be committed."""
+
+    def setUp(self):
+        suggest._index = None
+        self.addCleanup(setattr, suggest, '_index', None)
+        self.fixture = MarketplaceFixture()
+        self.fixture.grow(2)
+
+    def wait_for_rebuild(self):
+        for thread in threading.enumerate():
+            if thread.name == 'suggest-rebuild':
+                thread.join()
+
+    def test_stale_index_is_served_while_rebuilt(self):
+        old = suggest.get_index()
+        old.built_at -= settings.SUGGEST_INDEX_MAX_AGE + 1
+        # Written by another process, so no signal reaches this one
+        Product.objects.filter(pk=self.fixture.products[0].pk).update(name='Copper Wire')
+        with self.assertNumQueries(0):
+            self.assertIs(suggest.get_index(), old)
+        self.wait_for_rebuild()
+        self.assertIsNot(suggest.get_index(), old)
+        self.assertEqual([item['text'] for item in suggest.suggest('copper')], ['Copper Wire'])
+
+    def test_warm_up_waits_for_the_first_request(self):
+        self.addCleanup(request_started.disconnect, dispatch_uid='suggest-warm')
+        suggest.warm_on_first_request()
+        self.assertNotIn('suggest-warm', [thread.name for thread in threading.enumerate()])
+        self.client.get('/api/categories/')
+        for thread in threading.enumerate():
+            if thread.name == 'suggest-warm':
+                thread.join()
+        self.assertIsNotNone(suggest._index)
+        # Later requests do not start another build
+        self.assertFalse(request_started.disconnect(dispatch_uid='suggest-warm'))
+
+
+class StartupTests(SimpleTestCase):
+    def test_boot_leaves_lazy_modules_unimported(self):
+        self.assertEqual(startup.profile()['eager_modules'], [])
+
+    # Wall-clock time depends on the machine, so this only runs when asked for
+    @skipUnless(os.environ.get('CHECK_STARTUP_BUDGET'), 'set CHECK_STARTUP_BUDGET=1 to time the boot')
+    def test_boot_stays_within_budget(self):
+        # Boot a few fresh interpreters and keep the fastest to smooth out a busy machine
+        best = min(startup.profile()['boot_ms'] for _ in range(3))
+        self.assertLessEqual(best, settings.STARTUP_TIME_BUDGET_MS)
+
+    def test_admin_is_loaded_on_first_use(self):
+        self.assertEqual(reverse('admin:index'), '/admin/')
+        self.assertEqual(resolve('/admin/login/').url_name, 'login')
+
+
+class ShippingEstimateTests(MarketplaceTestCase):
+    fixture_size = 2
+
+    def setUp(self):
+        shipping.reload()
+        super().setUp()
+        Product.objects.filter(pk=self.fixture.products[0].pk).update(lead_time='2 weeks')
+
+    def test_port_lane_overrides_country_lane(self):
+        sea, = [lane for lane in shipping.find_lanes('India', 'Germany', 'Hamburg') if lane.mode == 'sea']
+        air, = [lane for lane in shipping.find_lanes('India', 'germany', 'Hamburg') if lane.mode == 'air']
+        self.assertLess(air.transit_days_max, sea.transit_days_min)
+        self.assertEqual(shipping.find_lanes('India', 'Nowhere'), ())
+
+    def test_product_estimate(self):
+        product = self.fixture.products[0]
+        response = self.client.get(
+            f'/api/products/{product.pk}/shipping-estimate/?country=Germany&port=Hamburg&quantity=150'
+        )
+        self.assertEqual(response.status_code, 200)
+        sea = next(option for option in response.data['options'] if option['mode'] == 'sea')
+        # 150 units fall in the 101-1000 band at 9.50 per unit
+        self.assertEqual(sea['freight'], Decimal('1425.00'))
+        self.assertEqual(sea['delivery_days'][0], 14 + sea['transit_days'][0])
+        self.assertEqual(self.client.get(f'/api/products/{product.pk}/shipping-estimate/').status_code, 400)
+
+    def test_cart_consolidates_items_by_origin(self):
+        response = self.client.post('/api/shipping-estimates/', {
+            'destination_country': 'Germany',
+            'items': [{'product_id': product.pk, 'quantity': 60} for product in self.fixture.products],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        shipment, = response.data['shipments']
+        self.assertEqual(shipment['quantity'], 120)
+        self.assertEqual(response.data['total_freight'], shipment['options'][0]['freight'])
+
+        response = self.client.post('/api/shipping-estimates/', {
+            'destination_country': 'Germany', 'items': [{'product_id': 0, 'quantity': 1}],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_express_interest_sets_estimated_delivery(self):
+        self.client.force_authenticate(self.fixture.buyer)
+        response = self.client.post(f'/api/products/{self.fixture.products[0].pk}/express_interest/', {
+            'quantity': 1, 'destination_country': 'Germany', 'destination_port': 'Hamburg',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        order = Order.objects.get(pk=response.data['id'])
+        fastest = shipping.estimate('India', 'Germany', 'Hamburg', 1, '2 weeks')[0]
+        self.assertEqual(order.estimated_delivery_date, fastest['latest_delivery'])
+
+
+class OutboxTests(MarketplaceTestCase):
+    fixture_size = 2
+
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create_user('ops', 'ops@example.com', 'x', is_staff=True)
+        self.cursor = OutboxEvent.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+    def feed(self, **params):
+        self.client.force_authenticate(self.admin)
+        return self.client.get('/api/changes/', {'since': self.cursor, **params}).data
+
+    def test_changes_are_published_with_old_and_new_values(self):
+        product = Product.objects.get(pk=self.fixture.products[0].pk)
+        product.price = Decimal('12.50')
+        product.save()
+        product.description = 'Not published'
+        product.save()
+        order = Order.objects.get(pk=self.fixture.orders[0].pk)
+        order.status = 'confirmed'
+        order.save()
+
+        data = self.feed()
+        self.assertEqual([event['topic'] for event in data['events']], [
+            'product.changed', 'order.status_changed',
+        ])
+        self.assertEqual(data['events'][1]['payload'], {'changes': {'status': ['inquiry', 'confirmed']}})
+        self.assertEqual(data['cursor'], data['events'][-1]['id'])
+        self.assertEqual(self.feed(topic='order.status_changed')['events'], data['events'][1:])
+
+    def test_bulk_edit_publishes_changes(self):
+        self.client.force_authenticate(self.fixture.seller)
+        self.client.patch('/api/products/bulk/', [
+            {'id': product.pk, 'available_quantity': 7} for product in self.fixture.products
+        ], format='json')
+        events = self.feed()['events']
+        self.assertEqual({event['object_id'] for event in events}, {product.pk for product in self.fixture.products})
+        self.assertEqual(events[0]['payload']['changes']['available_quantity'][1], 7)
+
+    def test_dispatch_is_at_least_once(self):
+        class FlakySink:
+            def __init__(self):
+                self.sent = []
+                self.fail = True
+
+            def send(self, events):
+                if self.fail:
+                    self.fail = False
+                    raise ConnectionError('sink down')
+                self.sent.extend(event['id'] for event in events)
+
+        order = Order.objects.get(pk=self.fixture.orders[0].pk)
+        order.status = 'shipping'
+        order.save()
+        pending = list(OutboxEvent.objects.filter(dispatched_at__isnull=True).values_list('id', flat=True))
+        sink = FlakySink()
+        with self.assertRaises(ConnectionError):
+            outbox.dispatch(sink, batch_size=2)
+        while outbox.dispatch(sink, batch_size=2):
+            pass
+        self.assertEqual(sink.sent, pending)
+        self.assertFalse(OutboxEvent.objects.filter(dispatched_at__isnull=True).exists())
+
+    def test_feed_waits_at_an_unsettled_gap(self):
+        order = Order.objects.get(pk=self.fixture.orders[0].pk)
+        for status in ('confirmed', 'production'):
+            order.status = status
+            order.save()
+        first, second = OutboxEvent.objects.filter(id__gt=self.cursor).order_by('id')
+        first.delete()
+        self.assertEqual(outbox.read(self.cursor)[1], self.cursor)
+        later = timezone.now() + timedelta(seconds=60)
+        self.assertEqual(outbox.read(self.cursor, now=later)[1], second.id)
+
+    def test_gap_settles_from_its_first_sighting(self):
+        # The event after the gap being old says nothing about the gap's own transaction
+        order = Order.objects.get(pk=self.fixture.orders[0].pk)
+        for status in ('confirmed', 'production'):
+            order.status = status
+            order.save()
+        first, second = OutboxEvent.objects.filter(id__gt=self.cursor).order_by('id')
+        first.delete()
+        OutboxEvent.objects.filter(pk=second.pk).update(created_at=timezone.now() - timedelta(hours=1))
+        now = timezone.now()
+        self.assertEqual(outbox.read(self.cursor, now=now)[1], self.cursor)
+        self.assertEqual(outbox.read(self.cursor, now=now + timedelta(seconds=1))[1], self.cursor)
+        self.assertEqual(outbox.read(self.cursor, now=now + timedelta(seconds=60))[1], second.id)
+
+
+@override_settings(SYNC_OVERLAP_SECONDS=0)
+class SyncTests(MarketplaceTestCase):
+    fixture_size = 3
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.fixture.buyer)
+
+    def sync(self, token=None):
+        response = self.client.get('/api/sync/', {'token': token} if token else {})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_full_then_delta(self):
+        data = self.sync()
+        self.assertTrue(data['full'])
+        self.assertFalse(data['has_more'])
+        self.assertEqual(len(data['products']['updated']), 3)
+        self.assertEqual(len(data['orders']['updated']), 3)
+
+        delta = self.sync(data['token'])
+        self.assertFalse(delta['full'])
+        self.assertEqual(delta['products'], {'updated': [], 'deleted': [], 'archived': []})
+
+        product, deactivated, deleted = self.fixture.products
+        product.price = Decimal('99.00')
+        product.save()
+        deactivated.is_active = False
+        deactivated.save()
+        deleted_pk, order_pk = deleted.pk, self.fixture.orders[0].pk
+        deleted.delete()
+        self.fixture.orders[0].delete()
+        delta = self.sync(delta['token'])
+        self.assertEqual([item['id'] for item in delta['products']['updated']], [product.pk])
+        self.assertEqual(sorted(delta['products']['deleted']), sorted([deactivated.pk, deleted_pk]))
+        self.assertEqual(delta['orders']['deleted'], [order_pk])
+
+    @override_settings(SYNC_PAGE_SIZE=2)
+    def test_pages_until_caught_up(self):
+        token, seen = None, []
+        while True:
+            data = self.client.get('/api/sync/', {'token': token} if token else {}).data
+            seen.extend(item['id'] for item in data['products']['updated'])
+            token = data['token']
+            if not data['has_more']:
+                break
+        self.assertEqual(sorted(seen), sorted(product.pk for product in self.fixture.products))
+
+    def test_archived_orders_are_not_deleted(self):
+        token = self.sync()['token']
+        order = self.fixture.orders[0]
+        Order.objects.filter(pk=order.pk).update(status='delivered', updated_at=timezone.now() - timedelta(days=365))
+        self.assertEqual(archive.archive_orders(), 1)
+        delta = self.sync(token)
+        self.assertEqual(delta['orders']['deleted'], [])
+        self.assertEqual(delta['orders']['archived'], [order.pk])
+
+    def test_invalid_and_foreign_tokens(self):
+        self.assertEqual(self.client.get('/api/sync/', {'token': 'garbage'}).status_code, 400)
+        token = self.sync()['token']
+        self.client.force_authenticate(self.fixture.seller)
+        self.assertTrue(self.sync(token)['full'])
+
+
+class NotificationTests(MarketplaceTestCase):
+    def setUp(self):
+        super().setUp()
+        # Start after the fixture's own orders
+        while notifications.fan_out() is not None:
+            pass
+        Notification.objects.all().delete()
+        NotificationCounter.objects.all().delete()
+        cache.clear()
+
+    def get(self, user, path, **params):
+        self.client.force_authenticate(user)
+        return self.client.get(path, params).data
+
+    def test_inquiry_and_status_changes_fan_out(self):
+        self.client.force_authenticate(self.fixture.buyer)
+        order_id = self.client.post(
+            f'/api/products/{self.fixture.products[0].pk}/express_interest/', {'quantity': 1}, format='json'
+        ).data['id']
+        self.assertEqual(notifications.fan_out(), 1)
+        self.assertIsNone(notifications.fan_out())
+
+        order = Order.objects.get(pk=order_id)
+        self.assertEqual(order.status, 'inquiry')
+        order.status = 'confirmed'
+        order.save()
+        self.assertEqual(notifications.fan_out(), 2)
+
+        inbox = self.get(self.fixture.seller, '/api/notifications/')['results']
+        self.assertEqual([item['kind'] for item in inbox], ['order_status', 'inquiry'])
+        self.assertEqual(inbox[0]['data'], {'status': 'confirmed', 'previous_status': 'inquiry'})
+        self.assertEqual(self.get(self.fixture.seller, '/api/notifications/unread-count/'), {'unread': 2})
+
+        self.client.post(f'/api/notifications/{inbox[1]["id"]}/read/')
+        self.assertEqual(self.get(self.fixture.seller, '/api/notifications/unread-count/'), {'unread': 1})
+        self.client.post('/api/notifications/read-all/')
+        self.assertEqual(self.get(self.fixture.seller, '/api/notifications/unread-count/'), {'unread': 0})
+
+        poll = self.get(self.fixture.buyer, '/api/notifications/poll/', after=0)
+        self.assertEqual([item['title'] for item in poll['notifications']], [f'Order #{order_id} is now Confirmed'])
+        self.assertEqual(poll['unread'], 1)
+        latest = poll['notifications'][-1]['id']
+        self.assertEqual(self.get(self.fixture.buyer, '/api/notifications/poll/', after=latest)['notifications'], [])
+
+    @override_settings(NOTIFICATIONS_STREAM_MAX_SECONDS=0.05, NOTIFICATIONS_POLL_INTERVAL=0.01)
+    def test_stream_sends_new_notifications(self):
+        order = Order.objects.get(pk=self.fixture.orders[0].pk)
+        order.status = 'shipping'
+        order.save()
+        notifications.fan_out()
+
+        async def collect():
+            encode = lambda item: json.dumps(item, default=str)  # noqa: E731
+            return [chunk async for chunk in notifications.stream(self.fixture.buyer.pk, 0, encode)]
+        chunks = async_to_sync(collect)()
+        self.assertTrue(chunks[0].startswith('retry:'))
+        self.assertIn('event: notification', chunks[1])
+        self.assertEqual(chunks[2], 'event: unread\ndata: 1\n\n')
+
+    @override_settings(NOTIFICATIONS_STREAM_MAX_SECONDS=0.05, NOTIFICATIONS_POLL_INTERVAL=0.01)
+    def test_stream_is_only_served_under_asgi(self):
+        path = '/api/notifications/stream/'
+        self.assertEqual(async_to_sync(self.async_client.get)(path).status_code, 401)
+        self.async_client.force_login(self.fixture.buyer)
+        response = async_to_sync(self.async_client.get)(path)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        # A WSGI server would hold the whole stream back until it ends
+        self.client.force_login(self.fixture.buyer)
+        self.assertEqual(self.client.get(path).status_code, 501)
+
+
+class CategoryTreeTests(MarketplaceTestCase):
+    fixture_size = 3
+
+    def setUp(self):
+        super().setUp()
+        self.root, self.child, self.other = self.fixture.categories
+        self.child.parent = self.root
+        self.child.save()
+
+    def test_products_include_subcategories(self):
+        response = self.client.get(f'/api/products/?category={self.root.pk}')
+        self.assertEqual(
+            {item['category']['id'] for item in response.data['results']},
+            {self.root.pk, self.child.pk},
+        )
+
+    def test_deleting_a_category_keeps_its_subtree_and_products(self):
+        self.client.force_authenticate(self.fixture.staff)
+        # The root has a subcategory and a product, the child a product
+        for category in (self.root, self.child):
+            self.assertEqual(self.client.delete(f'/api/categories/{category.pk}/').status_code, 400)
+        self.assertEqual(Category.objects.count(), 3)
+        self.assertEqual(Product.objects.count(), 3)
+
+        Product.objects.filter(category__in=[self.root, self.child]).update(category=self.other)
+        self.assertEqual(self.client.delete(f'/api/categories/{self.child.pk}/').status_code, 204)
+        self.assertEqual(self.client.delete(f'/api/categories/{self.root.pk}/').status_code, 204)
+
+    def test_moving_a_category_moves_its_subtree(self):
+        grandchild = Category.objects.create(name='Grandchild', parent=self.child)
+        self.root.parent = self.other
+        self.root.save()
+        grandchild.refresh_from_db()
+        self.assertEqual(grandchild.depth, 3)
+        self.assertTrue(grandchild.path.startswith(self.other.path + f'{self.root.pk:08d}/'))
+        tree = self.client.get('/api/categories/tree/').data
+        self.assertEqual([node['id'] for node in tree], [self.other.pk])
+
+    def test_other_processes_catch_up(self):
+        stale = categories.category_tree()
+        added = Category.objects.create(name='Added', parent=self.root)
+        Product.objects.filter(pk=self.fixture.products[0].pk).update(category=added)
+        # Another worker still holds the tree from before the write
+        cache.set(categories.TREE_CACHE_KEY, stale)
+        response = self.client.get(f'/api/products/?category={added.pk}')
+        self.assertEqual([item['id'] for item in response.data['results']], [self.fixture.products[0].pk])
+        with override_settings(CATEGORY_TREE_CACHE_TIMEOUT=0):
+            cache.delete(categories.TREE_CACHE_KEY)
+            categories.category_tree()
+            self.assertIsNone(cache.get(categories.TREE_CACHE_KEY))
+
+
+class ProductQueryBudgetTests(QueryBudgetTestCase):
+    def test_list(self):
+        self.assertQueryBudget(8, lambda: self.request(None, 'get', '/api/products/'))
+
+    def test_list_by_specification(self):
+        self.assertQueryBudget(9, lambda: self.request(
+            None, 'get', '/api/products/?spec.Material=steel&spec.Weight__lte=20'
+        ))
+
+    def test_list_by_category(self):
+        # The category path comes from the navigation tree, which is one extra query when cold
+        self.assertQueryBudget(9, lambda: self.request(
+            None, 'get', f'/api/products/?category={self.fixture.categories[0].pk}'
+        ))
+
+    def test_retrieve(self):
+        self.assertQueryBudget(3, lambda: self.request(
+            None, 'get', f'/api/products/{self.fixture.products[0].pk}/'
+        ))
+
+    def test_availability(self):
+        # The product, then its shards or, without shards, its stock and open reservations
+        self.assertQueryBudget(4, lambda: self.request(
+            None, 'get', f'/api/products/{self.fixture.products[0].pk}/availability/'
+        ))
+
+    def test_shipping_estimate(self):
+        self.assertQueryBudget(1, lambda: self.request(
+            None, 'get', f'/api/products/{self.fixture.products[0].pk}/shipping-estimate/?country=Germany&quantity=20'
+        ))
+
+    def test_suggest(self):
+        self.addCleanup(setattr, suggest, '_index', None)
+        def run():
+            # Cold, so the index is built within the request
+            suggest._index = None
+            self.request(None, 'get', '/api/suggest/?q=prod')
+        # One query each for products, categories and sellers
+        self.assertQueryBudget(3, run)
+
+    def test_create(self):
+        def run():
+            self.request(self.fixture.seller, 'post', '/api/products/', {
+                'category_id': self.fixture.categories[0].pk, 'name': 'Copper wire',
+                'description': 'Wire', 'price': '3.20', 'unit': 'Tons',
+                'country_of_origin': 'Chile',
+            }, expected_status=201)
+        self.assertQueryBudget(5, run)
+
+    def test_partial_update(self):
+        # DRF drops the prefetch cache after saving, so relations load twice;
+        # one more query writes the price change to the outbox
+        self.assertQueryBudget(7, lambda: self.request(
+            self.fixture.seller, 'patch', f'/api/products/{self.fixture.products[0].pk}/',
+            {'price': f'{next(self.counter) + 11}.00'}
+        ))
+
+    def test_update(self):
+        def run():
+            self.request(self.fixture.seller, 'put', f'/api/products/{self.fixture.products[0].pk}/', {
+                'category_id': self.fixture.categories[0].pk, 'name': 'Steel pipes',
+                'description': 'Pipes', 'price': f'{next(self.counter) + 11}.00', 'unit': 'Tons',
+                'country_of_origin': 'India',
+            })
+        self.assertQueryBudget(8, run)
+
+    def test_destroy(self):
+        def run():
+            # Taken out of the fixture, which would otherwise order it again when growing
+            product = self.fixture.products.pop(0)
+            self.request(self.fixture.seller, 'delete', f'/api/products/{product.pk}/', expected_status=204)
+        # One delete per related table, whatever the number of reviews or order items
+        self.assertQueryBudget(10, run)
+
+    def test_add_review(self):
+        def run():
+            product = self.fixture.products[next(self.counter)]
+            self.request(self.fixture.buyer, 'post', f'/api/products/{product.pk}/add_review/', {
+                'rating': 5, 'comment': 'Great',
+            }, expected_status=201)
+        # Includes touching the product's updated_at for delta sync
+        self.assertQueryBudget(4, run)
+
+    # SQLite binds at most 999 parameters, so bulk_update() splits more than
+    # 333 shards across several UPDATEs
+    @override_settings(INVENTORY_SHARDS=2)
+    def test_bulk_edit(self):
+        # Stock changes rebalance every product's shards
+        self.fixture.shard_stock = True
+
+        def run():
+            price = next(self.counter) + 11
+            self.request(self.fixture.seller, 'patch', '/api/products/bulk/', [
+                {'id': product.pk, 'price': f'{price}.00', 'available_quantity': 50}
+                for product in self.fixture.products
+            ])
+        # Loading, one UPDATE, the outbox INSERT and four queries to rebalance all shards
+        self.assertQueryBudget(9, run)
+    
+    def test_bulk_edit_same_change(self):
+        self.assertQueryBudget(4, lambda: self.request(self.fixture.seller, 'patch', '/api/products/bulk/', [
+            {'id': product.pk, 'lead_time': '2 weeks'} for product in self.fixture.products
+        ]))
+    
+    def test_recommendations(self):
+        # Reviewers rated every product, so each list holds the full top K
+        self.fixture.grow(max(self.sizes))
+        recommendations.build()
+        self.assertQueryBudget(7, lambda: self.request(
+            None, 'get', f'/api/products/{self.fixture.products[0].pk}/recommendations/'
+        ))
+    
+    def test_express_interest(self):
+        # Budget for a product whose stock shards already exist
+        self.fixture.grow(1)
+        inventory.ensure_shards(self.fixture.products[0])
+        self.assertQueryBudget(15, lambda: self.request(
+            self.fixture.buyer, 'post', f'/api/products/{self.fixture.products[0].pk}/express_interest/',
+            {'quantity': 2}, expected_status=201
+        ))
+    
+    def test_cart_shipping_estimate(self):
+        self.assertQueryBudget(1, lambda: self.request(None, 'post', '/api/shipping-estimates/', {
+            'destination_country': 'Germany',
+            'items': [{'product_id': product.pk, 'quantity': 10} for product in self.fixture.products],
+        }))
+
+
+class OrderQueryBudgetTests(QueryBudgetTestCase):
+    def test_list(self):
+        self.assertQueryBudget(12, lambda: self.request(self.fixture.buyer, 'get', '/api/orders/'))
+
+    def test_my_orders(self):
+        self.assertQueryBudget(12, lambda: self.request(self.fixture.buyer, 'get', '/api/orders/my-orders/'))
+
+    def test_my_orders_with_archive(self):
+        self.assertQueryBudget(13, lambda: self.request(
+            self.fixture.buyer, 'get', '/api/orders/my-orders/?include_archived=true'
+        ))
+
+    def test_retrieve(self):
+        self.assertQueryBudget(5, lambda: self.request(
+            self.fixture.buyer, 'get', f'/api/orders/{self.fixture.orders[0].pk}/'
+        ))
+
+    def test_create(self):
+        self.assertQueryBudget(4, lambda: self.request(self.fixture.buyer, 'post', '/api/orders/', {
+            'shipping_address': 'Harbour Road 1', 'destination_country': 'Germany',
+        }, expected_status=201))
+
+    def test_update(self):
+        # As for products, relations are read again once DRF drops the prefetch cache
+        self.assertQueryBudget(10, lambda: self.request(
+            self.fixture.buyer, 'patch', f'/api/orders/{self.fixture.orders[0].pk}/',
+            {'notes': f'Revision {next(self.counter)}'}
+        ))
+
+    def test_destroy(self):
+        def run():
+            order = self.fixture.orders[next(self.counter)]
+            self.request(self.fixture.buyer, 'delete', f'/api/orders/{order.pk}/', expected_status=204)
+        # Cascaded documents do not touch the order they are deleted with
+        self.assertQueryBudget(8, run)
+
+    def test_cancel(self):
+        def run():
+            order = self.fixture.orders[next(self.counter)]
+            self.request(self.fixture.buyer, 'post', f'/api/orders/{order.pk}/cancel/')
+        # Includes the order.status_changed outbox event
+        self.assertQueryBudget(10, run)
+
+    def test_documents(self):
+        self.assertQueryBudget(2, lambda: self.request(
+            self.fixture.buyer, 'get', f'/api/orders/{self.fixture.orders[0].pk}/documents/'
+        ))
+
+
+@override_settings(ADMIN_EXACT_COUNT_THRESHOLD=1)
+class AdminQueryBudgetTests(QueryBudgetTestCase):
+    """Change lists and change forms read related rows in constant queries."""
+
+    def setUp(self):
+        super().setUp()
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+
+    def admin_get(self, path):
+        # Content types are cached per process after the first lookup
+        ContentType.objects.clear_cache()
+        self.assertEqual(self.client.get(path).status_code, 200)
+
+    def test_changelists(self):
+        budgets = {'product': 4, 'order': 4, 'review': 5, 'userprofile': 4, 'category': 5}
+        for model, budget in budgets.items():
+            with self.subTest(model=model):
+                self.assertQueryBudget(budget, lambda: self.admin_get(f'/admin/marketplace_api/{model}/'))
+
+    def test_order_change_form(self):
+        self.assertQueryBudget(10, lambda: self.admin_get(
+            f'/admin/marketplace_api/order/{self.fixture.orders[0].pk}/change/'
+        ))
+
+
+class AdminSearchTests(MarketplaceTestCase):
+    fixture_size = 3
+
+    def setUp(self):
+        super().setUp()
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+
+    def changelist(self, model, term):
+        response = self.client.get(f'/admin/marketplace_api/{model}/', {'q': term})
+        self.assertEqual(response.status_code, 200)
+        return response.context['cl']
+
+    def found(self, model, term):
+        return sorted(obj.pk for obj in self.changelist(model, term).result_list)
+
+    def test_search_matches_any_field_ignoring_case(self):
+        products = [product.pk for product in self.fixture.products]
+        self.assertEqual(self.found('product', '"PRODUCT 1"'), products[1:2])
+        self.assertEqual(self.found('product', 'Seller'), products)
+        self.assertEqual(self.found('product', '"category 2"'), products[2:])
+        self.assertEqual(self.found('product', 'seller "product 1"'), products[1:2])
+        self.assertEqual(self.found('product', 'roduct'), [])
+        self.assertEqual(self.found('order', 'Buyer@Example.com'), sorted(o.pk for o in self.fixture.orders))
+        self.assertEqual(self.found('userprofile', '"buyer ltd"'), [self.fixture.buyer.profile.pk])
+        self.assertEqual(len(self.found('review', '"product 0"')), 2)
+
+    @skipUnless(connection.vendor == 'sqlite', 'checks the SQLite query plan')
+    def test_search_uses_indexes(self):
+        terms = {'product': 'seller', 'order': 'buyer', 'review': 'product', 'userprofile': 'buyer', 'category': 'cat'}
+        for model, term in terms.items():
+            with self.subTest(model=model):
+                plan = self.changelist(model, term).queryset.explain()
+                self.assertNotIn('SCAN', plan)
+
+
+class DocumentUploadQueryBudgetTests(QueryBudgetTestCase):
+    def test_create(self):
+        self.assertQueryBudget(2, lambda: self.request(self.fixture.buyer, 'post', '/api/document-uploads/', {
+            'order': self.fixture.orders[0].pk, 'document_type': 'invoice',
+            'filename': 'invoice.pdf', 'total_size': 1024,
+        }, expected_status=201))
+
+    def start_uploads(self, received):
+        """Open one session per fixture size, each with `received` of its 4 bytes uploaded."""
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.enterContext(override_settings(
+            MEDIA_ROOT=temp_dir.name, DOCUMENT_UPLOAD_TEMP_DIR=os.path.join(temp_dir.name, 'upload_sessions')
+        ))
+        self.fixture.grow(1)
+        urls = []
+        for _ in self.sizes:
+            upload = DocumentUpload.objects.create(
+                order=self.fixture.orders[0], user=self.fixture.buyer, document_type='invoice',
+                filename='invoice.pdf', total_size=4,
+            )
+            if received:
+                uploads.append_chunk(upload.pk, io.BytesIO(b'%PDF'[:received]), 0)
+            urls.append(f'/api/document-uploads/{upload.pk}/')
+        return iter(urls)
+
+    def test_chunk(self):
+        urls = self.start_uploads(received=0)
+        self.assertQueryBudget(5, lambda: self.request(
+            self.fixture.buyer, 'put', f'{next(urls)}chunk/', b'%PDF',
+            content_type='application/octet-stream', HTTP_UPLOAD_OFFSET='0',
+        ))
+
+    def test_commit(self):
+        urls = self.start_uploads(received=4)
+        self.assertQueryBudget(8, lambda: self.request(
+            self.fixture.buyer, 'post', f'{next(urls)}commit/', expected_status=201
+        ))
+
+    def test_retrieve(self):
+        urls = self.start_uploads(received=2)
+        self.assertQueryBudget(1, lambda: self.request(self.fixture.buyer, 'get', next(urls)))
+
+    def test_destroy(self):
+        urls = self.start_uploads(received=2)
+        self.assertQueryBudget(2, lambda: self.request(
+            self.fixture.buyer, 'delete', next(urls), expected_status=204
+        ))
+
+
+class SerializerQueryBudgetTests(QueryBudgetTestCase):
+    """Every serializer, given its own eager loading, reads a list in constant queries."""
+
+    querysets = {
+        serializers.UserSerializer: lambda: User.objects.all(),
+        serializers.UserProfileSerializer: lambda: UserProfile.objects.all(),
+        serializers.CategorySerializer: lambda: Category.objects.all(),
+        serializers.ProductSpecificationSerializer: lambda: ProductSpecification.objects.all(),
+        serializers.ReviewSerializer: lambda: Review.objects.all(),
+        serializers.ProductSerializer: lambda: Product.objects.all(),
+        serializers.ProductBulkUpdateSerializer: lambda: Product.objects.all(),
+        serializers.OrderItemSerializer: lambda: OrderItem.objects.all(),
+        serializers.OrderDocumentSerializer: lambda: OrderDocument.objects.all(),
+        serializers.DocumentUploadSerializer: lambda: DocumentUpload.objects.all(),
+        serializers.OrderSerializer: lambda: Order.objects.all(),
+        serializers.NotificationSerializer: lambda: Notification.objects.all(),
+    }
+
+    budgets = {
+        serializers.ProductSerializer: 3,
+        serializers.OrderItemSerializer: 3,
+        serializers.OrderSerializer: 5,
+    }
+
+    def test_every_serializer_is_covered(self):
+        declared = {
+            cls for name, cls in inspect.getmembers(serializers, inspect.isclass)
+            if issubclass(cls, drf_serializers.ModelSerializer) and cls.__module__ == serializers.__name__
+        }
+        self.assertEqual(declared, set(self.querysets))
+
+    def test_serializers(self):
+        request = Request(APIRequestFactory().get('/api/'))
+        for serializer_class, queryset in self.querysets.items():
+            with self.subTest(serializer=serializer_class.__name__):
+                def run():
+                    qs = queryset()
+                    if hasattr(serializer_class, 'setup_eager_loading'):
+                        qs = serializer_class.setup_eager_loading(qs)
+                    serializer_class(qs, many=True, context={'request': request}).data
+                self.assertQueryBudget(self.budgets.get(serializer_class, 1), run)
+
+
+class RouteQueryBudgetTests(SimpleTestCase):
+    """Every action routed to the API's views has a query budget test."""
+
+    # partial_update runs update(), so one budget covers both
+    budgets = {
+        'RegisterView.post': AuthQueryBudgetTests.test_register,
+        'LoginView.post': AuthQueryBudgetTests.test_login,
+        'LogoutView.post': AuthQueryBudgetTests.test_logout,
+        'BatchView.post': AuthQueryBudgetTests.test_batch,
+        'SuggestView.get': ProductQueryBudgetTests.test_suggest,
+        'SyncView.get': SyncQueryBudgetTests.test_full_sync,
+        'ChangeFeedView.get': SyncQueryBudgetTests.test_change_feed,
+        'ShippingEstimateView.post': ProductQueryBudgetTests.test_cart_shipping_estimate,
+        'MediaView.get': MediaQueryBudgetTests.test_order_document,
+        'UserViewSet.list': UserQueryBudgetTests.test_list,
+        'UserViewSet.create': UserQueryBudgetTests.test_create,
+        'UserViewSet.retrieve': UserQueryBudgetTests.test_retrieve,
+        'UserViewSet.update': UserQueryBudgetTests.test_update,
+        'UserViewSet.destroy': UserQueryBudgetTests.test_destroy,
+        'UserViewSet.me': UserQueryBudgetTests.test_me,
+        'UserProfileViewSet.list': UserProfileQueryBudgetTests.test_list,
+        'UserProfileViewSet.create': UserProfileQueryBudgetTests.test_create,
+        'UserProfileViewSet.retrieve': UserProfileQueryBudgetTests.test_retrieve,
+        'UserProfileViewSet.update': UserProfileQueryBudgetTests.test_update,
+        'UserProfileViewSet.destroy': UserProfileQueryBudgetTests.test_destroy,
+        'UserProfileViewSet.me': UserProfileQueryBudgetTests.test_me_update,
+        'CategoryViewSet.list': CategoryQueryBudgetTests.test_list,
+        'CategoryViewSet.create': CategoryQueryBudgetTests.test_create,
+        'CategoryViewSet.retrieve': CategoryQueryBudgetTests.test_retrieve,
+        'CategoryViewSet.update': CategoryQueryBudgetTests.test_update,
+        'CategoryViewSet.destroy': CategoryQueryBudgetTests.test_destroy,
+        'CategoryViewSet.tree': CategoryQueryBudgetTests.test_tree,
+        'ProductViewSet.list': ProductQueryBudgetTests.test_list,
+        'ProductViewSet.create': ProductQueryBudgetTests.test_create,
+        'ProductViewSet.retrieve': ProductQueryBudgetTests.test_retrieve,
+        'ProductViewSet.update': ProductQueryBudgetTests.test_update,
+        'ProductViewSet.destroy': ProductQueryBudgetTests.test_destroy,
+        'ProductViewSet.bulk_edit': ProductQueryBudgetTests.test_bulk_edit,
+        'ProductViewSet.add_review': ProductQueryBudgetTests.test_add_review,
+        'ProductViewSet.availability': ProductQueryBudgetTests.test_availability,
+        'ProductViewSet.express_interest': ProductQueryBudgetTests.test_express_interest,
+        'ProductViewSet.recommendations': ProductQueryBudgetTests.test_recommendations,
+        'ProductViewSet.shipping_estimate': ProductQueryBudgetTests.test_shipping_estimate,
+        'OrderViewSet.list': OrderQueryBudgetTests.test_list,
+        'OrderViewSet.create': OrderQueryBudgetTests.test_create,
+        'OrderViewSet.retrieve': OrderQueryBudgetTests.test_retrieve,
+        'OrderViewSet.update': OrderQueryBudgetTests.test_update,
+        'OrderViewSet.destroy': OrderQueryBudgetTests.test_destroy,
+        'OrderViewSet.my_orders': OrderQueryBudgetTests.test_my_orders,
+        'OrderViewSet.cancel': OrderQueryBudgetTests.test_cancel,
+        'OrderViewSet.documents': OrderQueryBudgetTests.test_documents,
+        'DocumentUploadViewSet.create': DocumentUploadQueryBudgetTests.test_create,
+        'DocumentUploadViewSet.retrieve': DocumentUploadQueryBudgetTests.test_retrieve,
+        'DocumentUploadViewSet.destroy': DocumentUploadQueryBudgetTests.test_destroy,
+        'DocumentUploadViewSet.chunk': DocumentUploadQueryBudgetTests.test_chunk,
+        'DocumentUploadViewSet.commit': DocumentUploadQueryBudgetTests.test_commit,
+        'NotificationViewSet.list': NotificationQueryBudgetTests.test_fan_out_and_list,
+        'NotificationViewSet.poll': NotificationQueryBudgetTests.test_poll,
+        'NotificationViewSet.unread_count': NotificationQueryBudgetTests.test_unread_count,
+        'NotificationViewSet.read': NotificationQueryBudgetTests.test_read,
+        'NotificationViewSet.read_all': NotificationQueryBudgetTests.test_read_all,
+    }
+
+    # Its queries repeat for as long as the stream stays open; test_poll covers the same reads
+    unbudgeted = {'notification_stream'}
+
+    def routed_actions(self, patterns):
+        for pattern in patterns:
+            if isinstance(pattern, URLResolver):
+                yield from self.routed_actions(pattern.url_patterns)
+                continue
+            callback = pattern.callback
+            view = getattr(callback, 'cls', None) or getattr(callback, 'view_class', None)
+            if (view or callback).__module__ != views.__name__:
+                continue
+            if view is None:
+                yield callback.__name__
+            elif hasattr(callback, 'actions'):
+                for action in callback.actions.values():
+                    yield f'{view.__name__}.{"update" if action == "partial_update" else action}'
+            else:
+                for method in view.http_method_names:
+                    if method != 'options' and hasattr(view, method):
+                        yield f'{view.__name__}.{method}'
+
+    def test_every_routed_action_has_a_budget(self):
+        routed = set(self.routed_actions(get_resolver().url_patterns))
+        self.assertEqual(routed - self.unbudgeted, set(self.budgets))
+
+
+class FastSerializerParityTests(MarketplaceTestCase):
+    """The compiled fast path must render byte-identical JSON to the DRF serializers."""
+
+    fixture_size = 20
+
+    def setUp(self):
+        super().setUp()
+        self.request = Request(APIRequestFactory().get('/api/'))
+
+    def assertSameJSON(self, serializer_class, compiled, queryset):
+        renderer = JSONRenderer()
+        expected = renderer.render(serializer_class(queryset, many=True, context={'request': self.request}).data)
+        actual = renderer.render(compiled.serialize(queryset, self.request))
+        self.assertEqual(actual, expected)
+
+    def test_products(self):
+        Product.objects.filter(pk=self.fixture.products[0].pk).update(image='', lead_time='4 weeks')
+        Review.objects.filter(product=self.fixture.products[1]).delete()
+        self.assertSameJSON(serializers.ProductSerializer, fast_serializers.product_serializer(), Product.objects.all())
+
+    def test_orders(self):
+        Order.objects.filter(pk=self.fixture.orders[0].pk).update(
+            estimated_delivery_date='2025-03-01', payment_terms='open_account'
+        )
+        self.assertSameJSON(serializers.OrderSerializer, fast_serializers.order_serializer(), Order.objects.all())
+
+    def test_categories(self):
+        self.assertSameJSON(
+            serializers.CategorySerializer, fast_serializers.category_serializer(), Category.objects.all()
+        )
+
+    def test_rows_without_relations(self):
+        product = self.fixture.products[0]
+        ProductSpecification.objects.filter(product=product).delete()
+        Review.objects.filter(product=product).delete()
+        Product.objects.filter(pk=product.pk).update(certifications=None, lead_time=None, currency='EUR')
+        order = self.fixture.orders[0]
+        OrderItem.objects.filter(order=order).delete()
+        OrderDocument.objects.filter(order=order).delete()
+        Category.objects.filter(pk=self.fixture.categories[0].pk).update(description=None)
+        self.assertSameJSON(serializers.ProductSerializer, fast_serializers.product_serializer(), Product.objects.all())
+        self.assertSameJSON(serializers.OrderSerializer, fast_serializers.order_serializer(), Order.objects.all())
+        self.assertSameJSON(
+            serializers.CategorySerializer, fast_serializers.category_serializer(), Category.objects.all()
+        )
+
+    def test_without_a_request(self):
+        # Archived snapshots are serialized outside a request, with site-relative media URLs
+        self.request = None
+        self.assertSameJSON(serializers.ProductSerializer, fast_serializers.product_serializer(), Product.objects.all())
+        self.assertSameJSON(serializers.OrderSerializer, fast_serializers.order_serializer(), Order.objects.all())
+
+    def test_page_keeps_order(self):
+        pks = [product.pk for product in reversed(self.fixture.products[:5])]
+        results = fast_serializers.product_serializer().serialize_page(pks, self.request)
+        self.assertEqual([item['id'] for item in results], pks)
+
+
+class RendererParityTests(SimpleTestCase):
+    """FastJSONRenderer must produce the same bytes as DRF's JSONRenderer."""
+
+    def assertSameJSON(self, data):
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_dates_and_times(self):
+        moment = datetime(2025, 3, 1, 12, 30, 15, 123456, tzinfo=dt_timezone.utc)
+        self.assertSameJSON({
+            'utc': moment,
+            'offset': moment.astimezone(dt_timezone(timedelta(hours=2))),
+            'naive': moment.replace(tzinfo=None),
+            'whole_seconds': moment.replace(microsecond=0),
+            'date': moment.date(),
+            'time': moment.time(),
+            'duration': timedelta(days=1, seconds=5),
+        })
+
+    def test_other_types(self):
+        self.assertSameJSON({
+            'decimal': Decimal('12.50'),
+            'uuid': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+            'lazy': gettext_lazy('This field is required.'),
+            'nested': [{'float': 0.1, 'bool': True, 'none': None}],
+        })
+
+    def test_non_string_keys(self):
+        self.assertSameJSON({0: {'name': ['This field is required.']}, 2: {}})
+
+    def test_unicode(self):
+        self.assertSameJSON({'text': 'caf\u00e9 \u2028line\u2029para \U0001f600'})
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS, ALLOWED_HOSTS=['127.0.0.1'])
+class LoadTestTests(TransactionTestCase):
+    """The harness drives a real local server, so its rows must be committed."""
+
+    def test_run_reports_every_endpoint(self):
+        cache.clear()
+        dataset = loadtest.ensure_dataset(products=20, sellers=2, buyers=3, orders_per_buyer=1)
+        self.assertEqual(loadtest.ensure_dataset(products=20, sellers=2, buyers=3, orders_per_buyer=1), dataset)
+        mark = loadtest.last_order_id()
+        with loadtest.serve('wsgi') as base_url:
+            report = loadtest.run(base_url, dataset, concurrency=1, duration=1, warmup=0)
+        self.assertGreater(report['total']['requests'], 0)
+        self.assertEqual(report['total']['errors'], 0, report['endpoints'])
+        for name, stats in report['endpoints'].items():
+            with self.subTest(endpoint=name):
+                if stats['requests']:
+                    self.assertEqual(sum(stats['histogram'].values()), stats['requests'])
+                    self.assertGreater(stats['queries']['mean'], 0)
+        self.assertEqual(loadtest.remove_orders_since(mark), report['endpoints']['express_interest']['requests'])
+        self.assertFalse(OutboxEvent.objects.exists())
+        self.assertFalse(Tombstone.objects.exists())
+        loadtest.delete_dataset()
+        self.assertFalse(Tombstone.objects.exists())
+
+        rows = loadtest.compare(report, report)
+        self.assertTrue(rows)
+        self.assertEqual({change for *_, change in rows}, {0.0})
+
+    def test_parse_mix(self):
+        self.assertEqual(loadtest.parse_mix('browse=3, detail'), {'browse': 3.0, 'detail': 1.0})
+        for mix in ('browse=x', 'checkout=1', 'browse=0'):
+            with self.subTest(mix=mix), self.assertRaises(loadtest.LoadTestError):
+                loadtest.parse_mix(mix)
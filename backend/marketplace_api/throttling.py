@@ -0,0 +1,58 @@
+from rest_framework.throttling import (
+    SimpleRateThrottle, AnonRateThrottle, UserRateThrottle, ScopedRateThrottle
+)
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    """Token bucket variant of DRF's SimpleRateThrottle.
+
+    A rate of `N/period` gives a bucket of N tokens that refills continuously
+    at N per period, so clients may burst up to N requests and are then held
+    to the steady rate. The bucket is stored as a single (tokens, timestamp)
+    entry in the throttle cache rather than a list of request timestamps.
+    """
+
+    def parse_rate(self, rate):
+        num_requests, duration = super().parse_rate(rate)
+        if num_requests is not None:
+            self.refill_rate = num_requests / duration
+        return num_requests, duration
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        self.now = self.timer()
+        tokens, last = self.cache.get(self.key, (self.num_requests, self.now))
+        self.tokens = min(self.num_requests, tokens + (self.now - last) * self.refill_rate)
+        if self.tokens < 1:
+            self.cache.set(self.key, (self.tokens, self.now), self.duration)
+            return self.throttle_failure()
+
+        self.tokens -= 1
+        self.cache.set(self.key, (self.tokens, self.now), self.duration)
+        return self.throttle_success()
+
+    def throttle_success(self):
+        return True
+
+    def wait(self):
+        if self.tokens >= 1:
+            return None
+        return (1 - self.tokens) / self.refill_rate
+
+
+class AnonTokenBucketThrottle(AnonRateThrottle, TokenBucketThrottle):
+    pass
+
+
+class UserTokenBucketThrottle(UserRateThrottle, TokenBucketThrottle):
+    pass
+
+
+class ScopedTokenBucketThrottle(ScopedRateThrottle, TokenBucketThrottle):
+    pass
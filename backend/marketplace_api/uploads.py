@@ -0,0 +1,159 @@
+import hashlib
+import os
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from .models import DocumentUpload, OrderDocument
+
+READ_SIZE = 64 * 1024
+
+# Running SHA-256 state per upload session, keyed by session id. A worker that
+# did not receive the earlier chunks rebuilds the state from the partial file.
+# Entries are only replaced once a chunk has committed, so a rejected chunk
+# never reaches the stored state.
+_hashers = {}
+
+
+class UploadError(Exception):
+    def __init__(self, message, offset=None):
+        super().__init__(message)
+        self.offset = offset
+
+
+def partial_path(upload):
+    return os.path.join(settings.DOCUMENT_UPLOAD_TEMP_DIR, f'{upload.pk}.part')
+
+
+def _hasher_for(upload):
+    offset, hasher = _hashers.get(upload.pk, (None, None))
+    if offset == upload.received_size:
+        return hasher.copy()
+    hasher = hashlib.sha256()
+    if upload.received_size:
+        with open(partial_path(upload), 'rb') as fh:
+            remaining = upload.received_size
+            while remaining:
+                data = fh.read(min(READ_SIZE, remaining))
+                if not data:
+                    break
+                hasher.update(data)
+                remaining -= len(data)
+    return hasher
+
+
+def append_chunk(upload_id, stream, offset):
+    """Stream one chunk from `stream` onto the end of the session's partial file.
+
+    The chunk must start at the session's current offset; anything else is
+    rejected with the offset the client should resume from.
+    """
+    with transaction.atomic():
+        upload = DocumentUpload.objects.select_for_update().get(pk=upload_id)
+        if offset != upload.received_size:
+            raise UploadError('Chunk offset does not match the upload offset.', upload.received_size)
+
+        os.makedirs(settings.DOCUMENT_UPLOAD_TEMP_DIR, exist_ok=True)
+        path = partial_path(upload)
+        hasher = _hasher_for(upload)
+        limit = min(upload.total_size - offset, settings.DOCUMENT_UPLOAD_MAX_CHUNK_SIZE)
+        written = 0
+
+        # Drop any bytes left behind by an interrupted write before appending
+        with open(path, 'ab') as fh:
+            fh.truncate(offset)
+            while True:
+                data = stream.read(READ_SIZE)
+                if not data:
+                    break
+                written += len(data)
+                if written > limit:
+                    fh.truncate(offset)
+                    raise UploadError('Chunk exceeds the allowed size.', offset)
+                fh.write(data)
+                hasher.update(data)
+
+        received = upload.received_size = offset + written
+        DocumentUpload.objects.filter(pk=upload.pk).update(received_size=received, updated_at=timezone.now())
+        transaction.on_commit(lambda: _hashers.__setitem__(upload.pk, (received, hasher)))
+    return upload
+
+
+def store_document(order, fileobj, digest, document_type, description=None, filename=''):
+    """Create an OrderDocument, reusing the stored file when the content already exists."""
+    existing = OrderDocument.objects.filter(sha256=digest).only('document').first()
+    if existing is not None:
+        name = existing.document.name
+    else:
+        ext = os.path.splitext(filename)[1].lower()
+        name = default_storage.save(f'order_documents/{digest}{ext}', File(fileobj))
+    return OrderDocument.objects.create(
+        order=order,
+        document_type=document_type,
+        document=name,
+        description=description,
+        sha256=digest,
+    )
+
+
+def commit_upload(upload):
+    if upload.received_size != upload.total_size:
+        raise UploadError('Upload is incomplete.', upload.received_size)
+
+    upload_id = upload.pk
+    digest = _hasher_for(upload).hexdigest()
+    path = partial_path(upload)
+    with transaction.atomic():
+        with open(path, 'rb') as fh:
+            document = store_document(
+                upload.order, fh, digest, upload.document_type,
+                upload.description, upload.filename,
+            )
+        upload.delete()
+    _hashers.pop(upload_id, None)
+    if os.path.exists(path):
+        os.remove(path)
+    return document
+
+
+def discard_upload(upload):
+    _hashers.pop(upload.pk, None)
+    path = partial_path(upload)
+    upload.delete()
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def expire_stale(now=None):
+    """Delete sessions idle for DOCUMENT_UPLOAD_SESSION_MAX_AGE_HOURS and orphaned partial files.
+
+    Returns the number of sessions deleted.
+    """
+    cutoff = (now or timezone.now()) - timedelta(hours=settings.DOCUMENT_UPLOAD_SESSION_MAX_AGE_HOURS)
+    expired = 0
+    for upload in DocumentUpload.objects.filter(updated_at__lt=cutoff).iterator():
+        discard_upload(upload)
+        expired += 1
+    # Files whose session is gone, e.g. after a crash between the delete and the unlink
+    directory = settings.DOCUMENT_UPLOAD_TEMP_DIR
+    if os.path.isdir(directory):
+        live = {f'{pk}.part' for pk in DocumentUpload.objects.values_list('pk', flat=True)}
+        oldest = time.time() - settings.DOCUMENT_UPLOAD_SESSION_MAX_AGE_HOURS * 3600
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.endswith('.part') and name not in live and os.path.getmtime(path) < oldest:
+                os.remove(path)
+    return expired
+
+
+def hash_uploaded_file(uploaded_file):
+    hasher = hashlib.sha256()
+    for chunk in uploaded_file.chunks(READ_SIZE):
+        hasher.update(chunk)
+    uploaded_file.seek(0)
+    return hasher.hexdigest()
@@ -8,11 +8,20 @@ router.register(r'profiles', views.UserProfileViewSet, basename='profile')
 router.register(r'categories', views.CategoryViewSet)
 router.register(r'products', views.ProductViewSet)
 router.register(r'orders', views.OrderViewSet, basename='order')
+router.register(r'document-uploads', views.DocumentUploadViewSet, basename='document-upload')
+router.register(r'notifications', views.NotificationViewSet, basename='notification')
 
 urlpatterns = [
+    # Before the router, whose notification detail route would match "stream"
+    path('notifications/stream/', views.notification_stream, name='notification-stream'),
     path('', include(router.urls)),
     path('register/', views.RegisterView.as_view(), name='register'),
     path('login/', views.LoginView.as_view(), name='login'),
     path('logout/', views.LogoutView.as_view(), name='logout'),
+    path('batch/', views.BatchView.as_view(), name='batch'),
+    path('suggest/', views.SuggestView.as_view(), name='suggest'),
+    path('sync/', views.SyncView.as_view(), name='sync'),
+    path('changes/', views.ChangeFeedView.as_view(), name='changes'),
+    path('shipping-estimates/', views.ShippingEstimateView.as_view(), name='shipping-estimates'),
     path('api-auth/', include('rest_framework.urls')),
 ]
\ No newline at end of file
@@ -1,24 +1,42 @@
-from rest_framework import viewsets, permissions, status, filters
+import io
+import json
+from decimal import InvalidOperation
+
+from asgiref.sync import sync_to_async
+from rest_framework import viewsets, mixins, permissions, status, filters
 from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.authtoken.models import Token
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
-from django.db.models import Q
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.db.models import ProtectedError, Q
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from .models import (
     Category, Product, Review, 
-    Order, OrderItem, UserProfile
+    Order, OrderItem, OrderDocument, ArchivedOrderDocument, DocumentUpload, Notification, UserProfile, USER_EMAIL_UNIQUE
 )
 from .serializers import (
     UserSerializer, UserProfileSerializer, CategorySerializer,
-    ProductSerializer, ReviewSerializer,
-    OrderSerializer
+    ProductSerializer, ProductBulkUpdateSerializer, ReviewSerializer,
+    OrderSerializer, OrderDocumentSerializer, DocumentUploadSerializer, NotificationSerializer
+)
+from . import (
+    archive, batch, bulk_edit, categories, currency, fast_serializers, inventory, media, notifications,
+    outbox, recommendations, session, shipping, specifications, suggest, sync, uploads
 )
 
 
 class RegisterView(APIView):
     permission_classes = [permissions.AllowAny]
+    throttle_scope = 'auth'
     
     def post(self, request):
         username = request.data.get('username')
@@ -33,44 +51,45 @@ class RegisterView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        if User.objects.filter(username=username).exists():
-            return Response(
-                {'error': 'Username already exists'}, 
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        if User.objects.filter(email=email).exists():
+        # Uniqueness of username and email is enforced by the database, so the
+        # user and profile are inserted in one transaction without pre-checks
+        try:
+            with transaction.atomic():
+                user = User.objects.create_user(
+                    username=username,
+                    email=email,
+                    password=password,
+                    first_name=first_name,
+                    last_name=last_name
+                )
+                UserProfile.objects.create(user=user)
+        except IntegrityError:
+            # Only a failed insert pays for finding out which constraint it hit
+            if User.objects.filter(username=username).exists():
+                error = 'Username already exists'
+            else:
+                try:
+                    USER_EMAIL_UNIQUE.validate(User, User(email=email))
+                except DjangoValidationError:
+                    error = 'Email already exists'
+                else:
+                    raise
             return Response(
-                {'error': 'Email already exists'}, 
+                {'error': error}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        try:
-            user = User.objects.create_user(
-                username=username,
-                email=email,
-                password=password,
-                first_name=first_name,
-                last_name=last_name
-            )
-            
-            # Create user profile
-            UserProfile.objects.create(user=user)
-            
-            serializer = UserSerializer(user)
-            return Response(
-                {'message': 'User created successfully', 'user': serializer.data}, 
-                status=status.HTTP_201_CREATED
-            )
-        except Exception as e:
-            return Response(
-                {'error': str(e)}, 
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
+        serializer = UserSerializer(user)
+        return Response(
+            {'message': 'User created successfully', 'user': serializer.data}, 
+            status=status.HTTP_201_CREATED
+        )
 
 
 class LoginView(APIView):
     permission_classes = [permissions.AllowAny]
+    # Throttles run before the view, so rejected attempts never reach password hashing
+    throttle_scope = 'auth'
     
     def post(self, request):
         username = request.data.get('username')
@@ -120,6 +139,208 @@ class LogoutView(APIView):
             )
 
 
+class SuggestView(APIView):
+    """Typeahead suggestions for product, category and seller names.
+    
+    `?q=ste&limit=5` returns up to `limit` matches for the prefix, served from
+    an in-memory index rather than the product search.
+    """
+    permission_classes = [permissions.AllowAny]
+    
+    def get(self, request):
+        try:
+            limit = int(request.query_params.get('limit', suggest.DEFAULT_LIMIT))
+        except ValueError:
+            return Response(
+                {'error': 'limit must be an integer'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        limit = max(1, min(limit, suggest.MAX_LIMIT))
+        return Response(suggest.suggest(request.query_params.get('q', ''), limit))
+
+
+class ShippingEstimateView(APIView):
+    """Freight and delivery estimate for a cart at checkout.
+    
+    Expects `{"destination_country": "Germany", "destination_port": "Hamburg",
+    "items": [{"product_id": 1, "quantity": 20}, ...]}`; `?currency=` converts
+    the freight. Items from the same origin are estimated as one shipment.
+    """
+    permission_classes = [permissions.AllowAny]
+    
+    def post(self, request):
+        country = request.data.get('destination_country')
+        items = request.data.get('items')
+        if not country or not isinstance(items, list) or not items:
+            return Response(
+                {'error': 'destination_country and a non-empty items list are required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(items) > settings.SHIPPING_ESTIMATE_MAX_ITEMS:
+            return Response(
+                {'error': f'At most {settings.SHIPPING_ESTIMATE_MAX_ITEMS} items can be estimated at once'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        quantities = {}
+        try:
+            for item in items:
+                product_id, quantity = int(item['product_id']), int(item.get('quantity', 1))
+                if quantity <= 0:
+                    raise ValueError
+                quantities[product_id] = quantities.get(product_id, 0) + quantity
+        except (KeyError, TypeError, ValueError):
+            return Response(
+                {'error': 'Each item needs a product_id and a positive quantity'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        display_currency = request.query_params.get('currency')
+        if display_currency:
+            try:
+                currency.get_rate(display_currency)
+            except currency.UnknownCurrency:
+                return Response({'error': 'Unsupported currency'}, status=status.HTTP_400_BAD_REQUEST)
+            display_currency = display_currency.upper()
+        
+        products = list(Product.objects.filter(pk__in=quantities, is_active=True).values(
+            'id', 'country_of_origin', 'lead_time'
+        ))
+        missing = sorted(set(quantities) - {product['id'] for product in products})
+        if missing:
+            return Response(
+                {'error': 'Unknown or inactive products', 'product_ids': missing},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(shipping.estimate_cart(
+            products, quantities, country, request.data.get('destination_port', ''), display_currency
+        ))
+
+
+class SyncView(APIView):
+    """Delta sync of products, categories and the user's orders.
+    
+    `?token=<token from the last response>` returns the rows created or
+    updated since then, the ids deleted since then and the ids moved to the
+    archive since then. Archived rows leave the live data set but can still be
+    read through order detail, `my-orders/?include_archived=true` and product
+    detail, so clients may keep them as history. Without a token (or
+    with an expired one) the response is a full sync (`"full": true`) and the
+    client replaces its local data. While `has_more` is true the client
+    repeats the request with the new token.
+    """
+    permission_classes = [permissions.AllowAny]
+    
+    def get(self, request):
+        try:
+            return Response(sync.changes(request.user, request.query_params.get('token'), request))
+        except sync.InvalidToken as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class ChangeFeedView(APIView):
+    """Order status, product price and stock changes for downstream systems.
+    
+    `?since=<cursor>` returns the events after the cursor and the cursor to
+    send next; `wait=<seconds>` holds the request open until an event arrives.
+    `topic` takes a comma-separated list such as `order.status_changed`.
+    """
+    permission_classes = [permissions.IsAdminUser]
+    
+    def get(self, request):
+        try:
+            since = int(request.query_params.get('since', 0))
+            wait = float(request.query_params.get('wait', 0))
+            limit = int(request.query_params.get('limit', settings.OUTBOX_FEED_PAGE_SIZE))
+        except ValueError:
+            return Response(
+                {'error': 'since, wait and limit must be numbers'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        topics = [topic for topic in request.query_params.get('topic', '').split(',') if topic]
+        events, cursor = outbox.wait(
+            max(since, 0),
+            timeout=max(0, min(wait, settings.OUTBOX_FEED_MAX_WAIT)),
+            limit=max(1, min(limit, settings.OUTBOX_FEED_PAGE_SIZE)),
+            topics=topics,
+        )
+        return Response({'events': events, 'cursor': cursor})
+
+
+class BatchView(APIView):
+    """Resolve several read-only API requests in a single round trip.
+    
+    Expects `{"requests": [{"id": "me", "path": "users/me/"}, ...]}` with paths
+    relative to the API root, and returns the sub-responses in the same order.
+    """
+    permission_classes = [permissions.AllowAny]
+    
+    def post(self, request):
+        sub_requests = request.data.get('requests') if isinstance(request.data, dict) else None
+        if not isinstance(sub_requests, list) or not sub_requests:
+            return Response(
+                {'error': 'A non-empty list of requests is required'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if len(sub_requests) > settings.BATCH_MAX_REQUESTS:
+            return Response(
+                {'error': f'At most {settings.BATCH_MAX_REQUESTS} requests can be batched'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        for item in sub_requests:
+            if not isinstance(item, dict) or not isinstance(item.get('path'), str):
+                return Response(
+                    {'error': 'Each request needs a path'}, 
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            if item.get('method', 'GET').upper() != 'GET':
+                return Response(
+                    {'error': 'Only GET requests can be batched'}, 
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            if item['path'].lstrip('/').startswith('batch/'):
+                return Response(
+                    {'error': 'Batch requests cannot be nested'}, 
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            if batch.is_async(item['path']):
+                return Response(
+                    {'error': 'Streaming endpoints cannot be batched'}, 
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        
+        return Response({'responses': batch.run(request, sub_requests)})
+
+
+class MediaView(APIView):
+    """Serve files under MEDIA_ROOT, restricting order documents to the order's owner"""
+    permission_classes = [permissions.AllowAny]
+    throttle_classes = []
+    
+    def get(self, request, path):
+        # Authorize the path that is actually served, not the one in the URL
+        path = media.normalize(path)
+        full_path = media.resolve(path) if path is not None else None
+        if full_path is None:
+            raise Http404
+        
+        if media.is_protected(path):
+            user = request.user
+            if not user.is_authenticated:
+                return Response(
+                    {"detail": "Authentication credentials were not provided."},
+                    status=status.HTTP_401_UNAUTHORIZED
+                )
+            if not user.is_staff and not OrderDocument.objects.filter(
+                document=path, order__user=user
+            ).exists() and not ArchivedOrderDocument.objects.filter(
+                document=path, order__user=user
+            ).exists():
+                raise Http404
+        
+        return media.serve(request, path, full_path)
+
+
 class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
@@ -127,8 +348,12 @@ class UserViewSet(viewsets.ModelViewSet):
     
     @action(detail=False, methods=['get'], permission_classes=[permissions.IsAuthenticated])
     def me(self, request):
-        serializer = self.get_serializer(request.user)
-        return Response(serializer.data)
+        context = session.get_session_context(request)
+        return Response({
+            **context['user'],
+            'order_count': context['order_count'],
+            'product_count': context['product_count'],
+        })
 
 
 class UserProfileViewSet(viewsets.ModelViewSet):
@@ -136,15 +361,31 @@ class UserProfileViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
     
     def get_queryset(self):
+        queryset = UserProfileSerializer.setup_eager_loading(UserProfile.objects.all())
         if self.request.user.is_staff:
-            return UserProfile.objects.all()
-        return UserProfile.objects.filter(user=self.request.user)
+            return queryset
+        return queryset.filter(user=self.request.user)
     
-    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAuthenticated])
+    def perform_create(self, serializer):
+        # Profiles are one per user and usually made at registration
+        if UserProfile.objects.filter(user=self.request.user).exists():
+            raise ValidationError({'detail': 'You already have a profile.'})
+        serializer.save(user=self.request.user)
+    
+    @action(detail=False, methods=['get', 'patch'], permission_classes=[permissions.IsAuthenticated])
     def me(self, request):
-        profile, created = UserProfile.objects.get_or_create(user=request.user)
-        serializer = self.get_serializer(profile)
-        return Response(serializer.data)
+        if request.method == 'PATCH':
+            profile, created = UserProfile.objects.get_or_create(user=request.user)
+            serializer = self.get_serializer(profile, data=request.data, partial=True)
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+        
+        context = session.get_session_context(request)
+        return Response({
+            **context['profile'],
+            'order_count': context['order_count'],
+            'product_count': context['product_count'],
+        })
 
 
 class CategoryViewSet(viewsets.ModelViewSet):
@@ -158,12 +399,29 @@ class CategoryViewSet(viewsets.ModelViewSet):
         if self.action in ['create', 'update', 'partial_update', 'destroy']:
             return [permissions.IsAdminUser()]
         return [permissions.IsAuthenticatedOrReadOnly()]
+    
+    def destroy(self, request, *args, **kwargs):
+        try:
+            return super().destroy(request, *args, **kwargs)
+        except ProtectedError:
+            return Response(
+                {"detail": "Move or delete this category's subcategories and products first."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+    
+    @action(detail=False, methods=['get'])
+    def tree(self, request):
+        """The full category hierarchy for navigation, served from cache"""
+        return Response(categories.category_tree()['roots'])
 
 
 class ProductViewSet(viewsets.ModelViewSet):
     queryset = Product.objects.filter(is_active=True)
     serializer_class = ProductSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    # Actions that look up by pk outside get_object() (the archive, recommendations)
+    # would fail on a non-numeric one; such URLs are 404s
+    lookup_value_regex = '[0-9]+'
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['name', 'description', 'category__name']
     ordering_fields = ['price', 'created_at', 'name']
@@ -171,26 +429,86 @@ class ProductViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         queryset = Product.objects.filter(is_active=True).order_by('-created_at')
         
-        # Filter by category
+        # Filter by category, including all of its subcategories
         category_id = self.request.query_params.get('category')
         if category_id:
-            queryset = queryset.filter(category_id=category_id)
+            path = categories.subtree_path(category_id)
+            if path is None:
+                return queryset.none()
+            queryset = queryset.filter(category__path__startswith=path)
         
-        # Filter by price range
+        # Filter by price range, given in the display currency and compared
+        # against the indexed base-currency price
         min_price = self.request.query_params.get('min_price')
         max_price = self.request.query_params.get('max_price')
-        if min_price:
-            queryset = queryset.filter(price__gte=min_price)
-        if max_price:
-            queryset = queryset.filter(price__lte=max_price)
+        display_currency = self.get_display_currency() or settings.BASE_CURRENCY
+        try:
+            if min_price:
+                queryset = queryset.filter(price_base__gte=currency.to_base(min_price, display_currency))
+            if max_price:
+                queryset = queryset.filter(price_base__lte=currency.to_base(max_price, display_currency))
+        except InvalidOperation:
+            raise ValidationError({'detail': 'min_price and max_price must be numbers.'})
         
         # Filter by seller
         seller_id = self.request.query_params.get('seller')
         if seller_id:
             queryset = queryset.filter(seller_id=seller_id)
         
+        # Filter by specifications, e.g. ?spec.Material=Steel&spec.Weight__lte=20
+        try:
+            queryset = specifications.filter_products(queryset, self.request.query_params)
+        except specifications.InvalidFilter as e:
+            raise ValidationError({'detail': str(e)})
+        
+        # Lists go through the values() fast path; single objects are
+        # serialized by ProductSerializer and need its relations loaded
+        if self.action in ['retrieve', 'update', 'partial_update']:
+            queryset = ProductSerializer.setup_eager_loading(queryset)
+        
         return queryset
     
+    def get_display_currency(self):
+        display_currency = self.request.query_params.get('currency')
+        if not display_currency:
+            return None
+        try:
+            currency.get_rate(display_currency)
+        except currency.UnknownCurrency:
+            raise ValidationError({'currency': 'Unsupported currency.'})
+        return display_currency.upper()
+    
+    def list(self, request, *args, **kwargs):
+        # Paginate over primary keys only and serialize the page through the
+        # compiled fast path instead of ProductSerializer
+        queryset = self.filter_queryset(self.get_queryset())
+        compiled = fast_serializers.product_serializer()
+        display_currency = self.get_display_currency()
+        page = self.paginate_queryset(queryset.values_list('pk', flat=True))
+        if page is not None:
+            results = compiled.serialize_page(list(page), request)
+        else:
+            results = compiled.serialize(queryset, request)
+        if display_currency:
+            currency.convert_page(results, display_currency)
+        if page is not None:
+            return self.get_paginated_response(results)
+        return Response(results)
+    
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            response = super().retrieve(request, *args, **kwargs)
+        except Http404:
+            # Long-inactive products are moved to the archive
+            data = archive.archived_product(kwargs['pk'], request)
+            if data is None:
+                raise
+            response = Response(data)
+        display_currency = self.get_display_currency()
+        if display_currency:
+            currency.convert_page([response.data], display_currency)
+        return response
+    
     def get_permissions(self):
         if self.action in ['update', 'partial_update', 'destroy']:
             return [permissions.IsAuthenticated()]
@@ -200,13 +518,47 @@ class ProductViewSet(viewsets.ModelViewSet):
         serializer.save(seller=self.request.user)
     
     def perform_update(self, serializer):
-        product = self.get_object()
-        if product.seller != self.request.user and not self.request.user.is_staff:
+        # The instance was already loaded by get_object() in update()
+        product = serializer.instance
+        if product.seller_id != self.request.user.id and not self.request.user.is_staff:
+            raise PermissionDenied("You do not have permission to edit this product.")
+        serializer.save()
+    
+    @action(detail=False, methods=['patch'], url_path='bulk', permission_classes=[permissions.IsAuthenticated])
+    def bulk_edit(self, request):
+        """Change price, stock, status or lead time of many of the seller's own products.
+        
+        Expects a list like `[{"id": 1, "price": "9.50"}, {"id": 2, "is_active": false}]`;
+        either every change is applied or none is.
+        """
+        serializer = ProductBulkUpdateSerializer(data=request.data, many=True, allow_empty=False)
+        serializer.is_valid(raise_exception=True)
+        changes = {}
+        for item in serializer.validated_data:
+            changes[item.pop('id')] = item
+        if len(changes) != len(serializer.validated_data):
             return Response(
-                {"detail": "You do not have permission to edit this product."},
-                status=status.HTTP_403_FORBIDDEN
+                {"detail": "Each product may only appear once."},
+                status=status.HTTP_400_BAD_REQUEST
             )
-        serializer.save()
+        if len(changes) > settings.PRODUCT_BULK_EDIT_MAX:
+            return Response(
+                {"detail": f"At most {settings.PRODUCT_BULK_EDIT_MAX} products can be edited at once."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            products = bulk_edit.load_products(request.user, list(changes))
+        except bulk_edit.NotFound as e:
+            return Response(
+                {"detail": f"Products not found: {e.ids}"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        except bulk_edit.NotOwner:
+            raise PermissionDenied("You do not have permission to edit these products.")
+        
+        bulk_edit.apply_changes(products, changes)
+        return Response(ProductBulkUpdateSerializer(products, many=True).data)
     
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
     def add_review(self, request, pk=None):
@@ -227,6 +579,52 @@ class ProductViewSet(viewsets.ModelViewSet):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
+    @action(detail=True, methods=['get'])
+    def availability(self, request, pk=None):
+        """Stock that can still be reserved, net of held and committed reservations"""
+        product = self.get_object()
+        available = inventory.available_quantities([product.pk])[product.pk]
+        return Response({'id': product.pk, 'available_quantity': available})
+    
+    @action(detail=True, methods=['get'])
+    def recommendations(self, request, pk=None):
+        """Products that buyers of this product also ordered, best match first"""
+        ids = recommendations.recommended_ids(pk)
+        results = [
+            item for item in fast_serializers.product_serializer().serialize_page(ids, request)
+            if item['is_active']
+        ]
+        display_currency = self.get_display_currency()
+        if display_currency:
+            currency.convert_page(results, display_currency)
+        return Response(results)
+    
+    @action(detail=True, methods=['get'], url_path='shipping-estimate')
+    def shipping_estimate(self, request, pk=None):
+        """Freight and delivery options to `?country=` (and optionally `port=`) for `quantity` units"""
+        country = request.query_params.get('country')
+        if not country:
+            raise ValidationError({'country': 'This parameter is required.'})
+        try:
+            quantity = int(request.query_params.get('quantity', 1))
+        except ValueError:
+            raise ValidationError({'quantity': 'Must be an integer.'})
+        if quantity <= 0:
+            raise ValidationError({'quantity': 'Must be greater than 0.'})
+        display_currency = self.get_display_currency()
+        product = self.get_object()
+        return Response({
+            'id': product.pk,
+            'origin_country': product.country_of_origin,
+            'destination_country': country,
+            'quantity': quantity,
+            'freight_paid_by': shipping.freight_payer(product.shipping_terms),
+            'options': shipping.estimate(
+                product.country_of_origin, country, request.query_params.get('port', ''),
+                quantity, product.lead_time, display_currency,
+            ),
+        })
+    
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
     def express_interest(self, request, pk=None):
         product = self.get_object()
@@ -234,6 +632,8 @@ class ProductViewSet(viewsets.ModelViewSet):
         quantity = int(request.data.get('quantity', 1))
         shipping_details = request.data.get('shipping_details', '')
         notes = request.data.get('notes', '')
+        destination_country = request.data.get('destination_country', '')
+        destination_port = request.data.get('destination_port') or None
         
         if quantity <= 0:
             return Response(
@@ -241,22 +641,42 @@ class ProductViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Create order directly
-        order = Order.objects.create(
-            user=user,
-            total_amount=product.price * quantity,
-            shipping_address=shipping_details,
-            status='pending',
-            notes=notes
-        )
+        # Expected delivery over the fastest lane, when the destination is known
+        estimated_delivery_date = None
+        if destination_country:
+            options = shipping.estimate(
+                product.country_of_origin, destination_country, destination_port,
+                quantity, product.lead_time,
+            )
+            if options:
+                estimated_delivery_date = options[0]['latest_delivery']
         
-        # Create order item
-        OrderItem.objects.create(
-            order=order,
-            product=product,
-            quantity=quantity,
-            price=product.price
-        )
+        # Create the order, its item and the stock hold in one transaction
+        try:
+            with transaction.atomic():
+                order = Order.objects.create(
+                    user=user,
+                    total_amount=product.price * quantity,
+                    currency=product.currency,
+                    shipping_address=shipping_details,
+                    destination_country=destination_country,
+                    destination_port=destination_port,
+                    estimated_delivery_date=estimated_delivery_date,
+                    status='inquiry',
+                    notes=notes
+                )
+                OrderItem.objects.create(
+                    order=order,
+                    product=product,
+                    quantity=quantity,
+                    price=product.price
+                )
+                inventory.reserve(product, quantity, order=order)
+        except inventory.InsufficientStock:
+            return Response(
+                {"detail": "Not enough stock available."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
         serializer = OrderSerializer(order)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -265,19 +685,45 @@ class ProductViewSet(viewsets.ModelViewSet):
 class OrderViewSet(viewsets.ModelViewSet):
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
+    lookup_value_regex = '[0-9]+'
     
     def get_queryset(self):
         user = self.request.user
+        queryset = Order.objects.all()
+        if self.action in ['retrieve', 'update', 'partial_update', 'cancel']:
+            queryset = OrderSerializer.setup_eager_loading(queryset)
         if user.is_staff:
-            return Order.objects.all()
-        return Order.objects.filter(user=user)
+            return queryset
+        return queryset.filter(user=user)
     
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        # Orders posted here start without items; express_interest creates priced orders
+        serializer.save(user=self.request.user, total_amount=0)
+    
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        compiled = fast_serializers.order_serializer()
+        page = self.paginate_queryset(queryset.values_list('pk', flat=True))
+        if page is not None:
+            return self.get_paginated_response(compiled.serialize_page(list(page), request))
+        return Response(compiled.serialize(queryset, request))
+    
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            # Finished orders are moved to the archive after a while
+            data = archive.archived_order(kwargs['pk'], request)
+            if data is None:
+                raise
+            return Response(data)
     
     @action(detail=False, methods=['get'], url_path='my-orders')
     def my_orders(self, request):
-        """Get orders for the current user with pagination"""
+        """Get orders for the current user with pagination
+        
+        `?include_archived=true` also returns archived orders, merged by date.
+        """
         user = request.user
         queryset = Order.objects.filter(user=user).order_by('-created_at')
         
@@ -289,40 +735,217 @@ class OrderViewSet(viewsets.ModelViewSet):
         start = (page - 1) * page_size
         end = start + page_size
         
-        # Get paginated data
-        orders = queryset[start:end]
-        total_count = queryset.count()
-        
-        # Serialize the data
-        serializer = self.get_serializer(orders, many=True)
+        if request.query_params.get('include_archived') in ('1', 'true'):
+            entries, total_count = archive.order_history(user, start, end)
+            results = archive.history_page(entries, request)
+        else:
+            # Get paginated data
+            order_ids = list(queryset.values_list('pk', flat=True)[start:end])
+            total_count = queryset.count()
+            
+            # Serialize the data through the compiled fast path
+            results = fast_serializers.order_serializer().serialize_page(order_ids, request)
         
         # Return paginated response
         return Response({
             'count': total_count,
             'next': f'?page={page + 1}&page_size={page_size}' if end < total_count else None,
             'previous': f'?page={page - 1}&page_size={page_size}' if page > 1 else None,
-            'results': serializer.data
+            'results': results
         })
     
     @action(detail=True, methods=['post'])
     def cancel(self, request, pk=None):
         order = self.get_object()
         
-        if order.user != request.user and not request.user.is_staff:
+        if order.user_id != request.user.id and not request.user.is_staff:
             return Response(
                 {"detail": "You do not have permission to cancel this order."},
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        if order.status not in ['pending', 'processing']:
+        if order.status not in ['inquiry', 'negotiation']:
             return Response(
                 {"detail": "This order cannot be cancelled."},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Update order status
+        # Update order status; only the changed columns are written
         order.status = 'cancelled'
         order.save()
         
         serializer = self.get_serializer(order)
         return Response(serializer.data)
+    
+    @action(detail=True, methods=['get', 'post'], parser_classes=[MultiPartParser, FormParser])
+    def documents(self, request, pk=None):
+        """List an order's documents, or upload a small document in a single request"""
+        order = self.get_object()
+        
+        if request.method == 'GET':
+            serializer = OrderDocumentSerializer(order.documents.all(), many=True, context={'request': request})
+            return Response(serializer.data)
+        
+        uploaded_file = request.FILES.get('document')
+        document_type = request.data.get('document_type')
+        if uploaded_file is None or document_type not in dict(OrderDocument.DOCUMENT_TYPES):
+            return Response(
+                {"detail": "A document file and a valid document_type are required."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        digest = uploads.hash_uploaded_file(uploaded_file)
+        document = uploads.store_document(
+            order, uploaded_file, digest, document_type,
+            request.data.get('description'), uploaded_file.name,
+        )
+        serializer = OrderDocumentSerializer(document, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class DocumentUploadViewSet(mixins.CreateModelMixin,
+                            mixins.RetrieveModelMixin,
+                            mixins.DestroyModelMixin,
+                            viewsets.GenericViewSet):
+    """Resumable chunked uploads for large order documents.
+    
+    Create a session with the file's name and size, PUT the raw bytes to
+    `chunk/` with an `Upload-Offset` header, then POST `commit/` to turn the
+    session into an OrderDocument. GET on the session returns the offset to
+    resume from after a dropped connection.
+    """
+    serializer_class = DocumentUploadSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get_queryset(self):
+        return DocumentUpload.objects.filter(user=self.request.user)
+    
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+    
+    def perform_destroy(self, instance):
+        uploads.discard_upload(instance)
+    
+    @action(detail=True, methods=['put'])
+    def chunk(self, request, pk=None):
+        upload = self.get_object()
+        try:
+            offset = int(request.headers.get('Upload-Offset', request.query_params.get('offset', '')))
+        except ValueError:
+            return Response(
+                {"detail": "Upload-Offset header is required."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # DRF has no stream for an empty body; that chunk just reports the offset
+        stream = request.stream if request.stream is not None else io.BytesIO()
+        try:
+            upload = uploads.append_chunk(upload.pk, stream, offset)
+        except uploads.UploadError as e:
+            return Response(
+                {"detail": str(e), "offset": e.offset},
+                status=status.HTTP_409_CONFLICT
+            )
+        
+        response = Response(self.get_serializer(upload).data)
+        response['Upload-Offset'] = str(upload.received_size)
+        return response
+    
+    @action(detail=True, methods=['post'])
+    def commit(self, request, pk=None):
+        upload = self.get_object()
+        try:
+            document = uploads.commit_upload(upload)
+        except uploads.UploadError as e:
+            return Response(
+                {"detail": str(e), "offset": e.offset},
+                status=status.HTTP_409_CONFLICT
+            )
+        
+        serializer = OrderDocumentSerializer(document, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class NotificationViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+    """The user's notification inbox, newest first.
+    
+    Instead of polling the list, clients wait for new notifications with
+    `poll/?after=<id>&wait=<seconds>` or the Server-Sent Events stream at
+    `notifications/stream/` (served under ASGI only).
+    """
+    serializer_class = NotificationSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get_queryset(self):
+        return Notification.objects.filter(user=self.request.user)
+    
+    @action(detail=False, methods=['get'], url_path='unread-count')
+    def unread_count(self, request):
+        return Response({'unread': notifications.unread_count(request.user.pk)})
+    
+    @action(detail=False, methods=['get'])
+    def poll(self, request):
+        try:
+            after = int(request.query_params.get('after', 0))
+            wait = float(request.query_params.get('wait', 0))
+        except ValueError:
+            return Response(
+                {"detail": "after and wait must be numbers."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        items, unread = notifications.wait(
+            request.user.pk, after, max(0, min(wait, settings.NOTIFICATIONS_MAX_WAIT))
+        )
+        return Response({'notifications': items, 'unread': unread})
+    
+    @action(detail=True, methods=['post'])
+    def read(self, request, pk=None):
+        notification = self.get_object()
+        notifications.mark_read(request.user.pk, [notification.pk])
+        return Response({'unread': notifications.unread_count(request.user.pk)})
+    
+    @action(detail=False, methods=['post'], url_path='read-all')
+    def read_all(self, request):
+        notifications.mark_read(request.user.pk)
+        return Response({'unread': 0})
+
+
+def _authenticated_user_id(request):
+    user = request.user
+    return user.pk if user.is_authenticated else None
+
+
+async def notification_stream(request):
+    """Server-Sent Events stream of the user's new notifications.
+    
+    Serve under ASGI, where an open stream costs no worker thread. The stream
+    ends after NOTIFICATIONS_STREAM_MAX_SECONDS and the client reconnects with
+    Last-Event-ID (or `?after=`) to resume.
+    
+    Under WSGI the response would be buffered until the stream ends, so the
+    view answers 501 there and clients fall back to `notifications/poll/`.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse(
+            {'detail': 'The notification stream is only served under ASGI; use notifications/poll/.'},
+            status=501,
+        )
+    user_id = await sync_to_async(_authenticated_user_id)(request)
+    if user_id is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+    after = request.headers.get('Last-Event-ID') or request.GET.get('after')
+    try:
+        after = None if after is None else int(after)
+    except ValueError:
+        return JsonResponse({'detail': 'Last-Event-ID must be a notification id.'}, status=400)
+    
+    def encode(item):
+        return json.dumps(item, cls=DjangoJSONEncoder)
+    
+    response = StreamingHttpResponse(
+        notifications.stream(user_id, after, encode), content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,13 @@
+"""
+Admin URLs, imported on the first request under /admin/.
+
+INSTALLED_APPS uses SimpleAdminConfig, so the ModelAdmin modules are
+discovered here rather than during django.setup(); API workers that never
+serve the admin do not import it.
+"""
+from django.contrib import admin
+
+admin.autodiscover()
+
+app_name = 'admin'
+urlpatterns = admin.site.get_urls()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+from importlib.util import find_spec
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -31,7 +32,8 @@ ALLOWED_HOSTS = []
 # Application definition
 
 INSTALLED_APPS = [
-    'django.contrib.admin',
+    # The admin is discovered when its URLs are first resolved (see admin_urls.py), not at startup
+    'django.contrib.admin.apps.SimpleAdminConfig',
     'django.contrib.auth',
     'django.contrib.contenttypes',
     'django.contrib.sessions',
@@ -49,6 +51,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'marketplace_api.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',  # CORS middleware
     'django.middleware.common.CommonMiddleware',
@@ -77,6 +80,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'marketplace_project.wsgi.application'
+ASGI_APPLICATION = 'marketplace_project.asgi.application'
 
 
 # Database
@@ -90,6 +94,19 @@ DATABASES = {
 }
 
 
+# Cache
+# Throttle buckets and the latest notification per user live here; point this
+# at Redis or Memcached so that all workers and manage.py send_notifications
+# share them. The local-memory cache is per process.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'marketplace',
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -138,6 +155,104 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# How MediaView transfers files: None streams from Django (with Range support),
+# 'nginx' uses X-Accel-Redirect and 'xsendfile' uses X-Sendfile (Apache/lighttpd)
+MEDIA_SENDFILE_BACKEND = None
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+MEDIA_CACHE_MAX_AGE = 60 * 60
+
+# Currency that Product.price_base and ExchangeRate rates are expressed in
+BASE_CURRENCY = 'USD'
+
+# Stock reservations: rows each product's free stock is split over, and how
+# long an inquiry holds stock before it is released
+INVENTORY_SHARDS = 8
+INVENTORY_HOLD_HOURS = 72
+
+# Archival (manage.py archive_cold_data): days after which delivered or
+# cancelled orders and inactive products leave the hot tables
+ORDER_ARCHIVE_AFTER_DAYS = 180
+PRODUCT_ARCHIVE_AFTER_DAYS = 90
+ARCHIVE_BATCH_SIZE = 500
+
+# Maximum number of products changed by one bulk edit request
+PRODUCT_BULK_EDIT_MAX = 500
+
+# Products kept per "buyers also ordered" list, and seconds a list is cached
+RECOMMENDATIONS_TOP_K = 10
+RECOMMENDATIONS_CACHE_TIMEOUT = 60 * 60
+
+# Seconds before a process rebuilds its suggestion index to pick up writes
+# made by other processes
+SUGGEST_INDEX_MAX_AGE = 300
+
+# Trade lanes (transit days and per-unit freight bands) used for shipping estimates,
+# and the most items accepted by one cart estimate
+SHIPPING_LANES_FILE = BASE_DIR / 'marketplace_api' / 'data' / 'shipping_lanes.csv'
+SHIPPING_ESTIMATE_MAX_ITEMS = 100
+
+# Change feed and outbox dispatcher (manage.py dispatch_outbox). The feed holds
+# back events behind an id gap until the gap has been missing for
+# OUTBOX_FEED_SETTLE_SECONDS, in case the transaction that owns it is still
+# committing; keep it above the longest transaction that writes events
+OUTBOX_FEED_PAGE_SIZE = 500
+OUTBOX_FEED_MAX_WAIT = 30
+OUTBOX_FEED_POLL_INTERVAL = 1
+OUTBOX_FEED_SETTLE_SECONDS = 5
+OUTBOX_DISPATCH_BATCH_SIZE = 200
+OUTBOX_RETENTION_DAYS = 7
+OUTBOX_SINK = 'marketplace_api.outbox.JSONLinesSink'
+OUTBOX_SINK_PATH = BASE_DIR / 'outbox' / 'events.jsonl'
+
+# Delta sync: rows per object type in one response, seconds of changes sent
+# again in case of late commits, and lifetime of sync tokens and tombstones
+SYNC_PAGE_SIZE = 200
+SYNC_OVERLAP_SECONDS = 5
+SYNC_TOKEN_MAX_AGE_DAYS = 30
+
+# Notifications: events fanned out per batch (manage.py send_notifications),
+# seconds between checks for new notifications while a client waits, and
+# limits for long-poll requests and Server-Sent Events streams
+NOTIFICATIONS_FAN_OUT_BATCH_SIZE = 500
+NOTIFICATIONS_POLL_INTERVAL = 1
+NOTIFICATIONS_LATEST_CACHE_TIMEOUT = 10
+NOTIFICATIONS_MAX_WAIT = 30
+NOTIFICATIONS_STREAM_MAX_SECONDS = 300
+NOTIFICATIONS_STREAM_HEARTBEAT = 15
+NOTIFICATIONS_STREAM_RETRY_MS = 3000
+
+# Milliseconds a fresh interpreter may take to import the project, load the WSGI
+# application and resolve its first URL; `manage.py profile_startup` measures
+# about 400 ms on a development machine. Checked by the tests when the
+# CHECK_STARTUP_BUDGET environment variable is set
+STARTUP_TIME_BUDGET_MS = 1000
+
+# Seconds a user's cached session context (user, profile, counts) is kept
+SESSION_CONTEXT_CACHE_TIMEOUT = 300
+
+# Seconds the category tree is cached. Writes invalidate it right away in the
+# process that made them; other processes see the change after this long
+# unless CACHES points at a shared backend
+CATEGORY_TREE_CACHE_TIMEOUT = 60
+
+# Seconds exchange rates are cached; as for the category tree, other processes
+# pick up a changed rate after this long
+EXCHANGE_RATES_CACHE_TIMEOUT = 60
+
+# Maximum number of sub-requests accepted by the batch endpoint
+BATCH_MAX_REQUESTS = 10
+
+# Chunked order document uploads
+DOCUMENT_UPLOAD_TEMP_DIR = BASE_DIR / 'upload_sessions'
+DOCUMENT_UPLOAD_MAX_CHUNK_SIZE = 8 * 1024 * 1024
+DOCUMENT_UPLOAD_MAX_SIZE = 1024 * 1024 * 1024
+# Sessions without a chunk for this long are deleted by `manage.py expire_uploads`
+DOCUMENT_UPLOAD_SESSION_MAX_AGE_HOURS = 24
+
+# Admin change lists show an estimated total above this many rows instead of
+# running COUNT(*) over the whole table
+ADMIN_EXACT_COUNT_THRESHOLD = 100000
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -152,10 +267,41 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.TokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication',
+        # Batch sub-requests carry no credentials of their own
+        'marketplace_api.authentication.BatchSubRequestAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
+    'DEFAULT_RENDERER_CLASSES': [
+        'marketplace_api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'marketplace_api.throttling.AnonTokenBucketThrottle',
+        'marketplace_api.throttling.UserTokenBucketThrottle',
+        'marketplace_api.throttling.ScopedTokenBucketThrottle',
+    ],
+    # Bucket size / refill period; 'auth' covers login and registration
+    'DEFAULT_THROTTLE_RATES': {
+        'anon': '120/min',
+        'user': '600/min',
+        'auth': '10/min',
+    },
+    'DEFAULT_PARSER_CLASSES': [
+        'rest_framework.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
+
+# MessagePack is negotiated (Accept: application/msgpack) only when msgpack is installed
+if find_spec('msgpack') is not None:
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'].insert(1, 'marketplace_api.renderers.MessagePackRenderer')
+    REST_FRAMEWORK['DEFAULT_PARSER_CLASSES'].append('marketplace_api.renderers.MessagePackParser')
+
+# Responses below this size are not compressed by CompressionMiddleware
+RESPONSE_COMPRESSION_MIN_SIZE = 1024
+RESPONSE_BROTLI_QUALITY = 5
@@ -14,16 +14,15 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf import settings
-from django.conf.urls.static import static
+from marketplace_api.views import MediaView
 
 urlpatterns = [
-    path('admin/', admin.site.urls),
+    # A module path instead of include() defers importing the admin to its first request
+    path('admin/', ('marketplace_project.admin_urls', 'admin', 'admin')),
     path('api/', include('marketplace_api.urls')),
+    # Media is served in every environment so order documents can be authorized;
+    # set MEDIA_SENDFILE_BACKEND to hand the transfer off to the web server
+    re_path(r'^%s(?P<path>.+)$' % settings.MEDIA_URL.lstrip('/'), MediaView.as_view(), name='media'),
 ]
-
-# Serve media files in development
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
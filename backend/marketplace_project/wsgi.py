@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'marketplace_project.settings')
 
 application = get_wsgi_application()
+
+# Build the in-memory suggestion index in the background once this process
+# serves its first request; not here, as a preloading server forks workers
+# after importing this module
+from marketplace_api import suggest  # noqa: E402
+
+suggest.warm_on_first_request()
@@ -7,7 +7,14 @@ This script can be run with the Django environment activated.
 import os
 import sys
 import random
-import requests
+
+# This script is run by hand and never imported by the server, so requests
+# stays an optional download-only dependency
+try:
+    import requests
+except ImportError:
+    sys.exit('populate_fake_data.py needs the requests package to download images')
+
 from django.core.files.base import ContentFile
 
 # Add the project directory to Python path
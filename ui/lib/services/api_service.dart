@@ -254,6 +254,33 @@ class ApiService extends ChangeNotifier {
     }
   }
 
+  // Batch endpoint: resolves several GET requests in one round trip.
+  // Returns the response bodies keyed by request id.
+  Future<Map<String, dynamic>> batch(Map<String, String> paths) async {
+    final response = await post('batch/', data: {
+      'requests': paths.entries
+          .map((entry) => {'id': entry.key, 'path': entry.value})
+          .toList(),
+    });
+
+    final Map<String, dynamic> results = {};
+    for (final item in response['responses'] as List<dynamic>) {
+      results[item['id']] = item['body'];
+    }
+    return results;
+  }
+
+  // Everything the app loads at start-up, in a single request
+  Future<Map<String, dynamic>> getStartupData() async {
+    return await batch({
+      'user': 'users/me/',
+      'profile': 'profiles/me/',
+      'categories': 'categories/',
+      'products': 'products/?page=1',
+      'orders': 'orders/my-orders/?page=1',
+    });
+  }
+
   // User profile endpoints
   Future<Map<String, dynamic>> getUserProfile() async {
     return await get('profiles/me/');
@@ -293,10 +320,58 @@ class ApiService extends ChangeNotifier {
     return await get(endpoint);
   }
 
+  // Typeahead suggestions for product, category and seller names
+  Future<List<dynamic>> suggest(String query, {int limit = 10}) async {
+    final response = await get('suggest/?q=${Uri.encodeQueryComponent(query)}&limit=$limit');
+    return response as List<dynamic>;
+  }
+
   Future<Map<String, dynamic>> getProductDetail(int id) async {
     return await get('products/$id/');
   }
 
+  // Notifications: poll() waits server-side up to `wait` seconds for notifications newer than `after`
+  Future<Map<String, dynamic>> getNotifications({int page = 1}) async {
+    return await get('notifications/?page=$page');
+  }
+
+  Future<Map<String, dynamic>> pollNotifications({int after = 0, int wait = 25}) async {
+    return await get('notifications/poll/?after=$after&wait=$wait');
+  }
+
+  Future<Map<String, dynamic>> markNotificationRead(int id) async {
+    return await post('notifications/$id/read/');
+  }
+
+  Future<Map<String, dynamic>> markAllNotificationsRead() async {
+    return await post('notifications/read-all/');
+  }
+
+  // Delta sync: pass the token of the previous response; repeat while has_more is true.
+  // A response with full == true replaces the local products, categories and orders.
+  Future<Map<String, dynamic>> sync({String? token}) async {
+    final query = token == null ? '' : '?token=${Uri.encodeQueryComponent(token)}';
+    return await get('sync/$query');
+  }
+
+  Future<Map<String, dynamic>> getShippingEstimate(int id, String country,
+      {String? port, int quantity = 1}) async {
+    var endpoint = 'products/$id/shipping-estimate/?country=${Uri.encodeQueryComponent(country)}&quantity=$quantity';
+    if (port != null && port.isNotEmpty) {
+      endpoint += '&port=${Uri.encodeQueryComponent(port)}';
+    }
+    return await get(endpoint);
+  }
+
+  Future<Map<String, dynamic>> estimateCartShipping(
+      String country, List<Map<String, dynamic>> items, {String? port}) async {
+    return await post('shipping-estimates/', data: {
+      'destination_country': country,
+      if (port != null && port.isNotEmpty) 'destination_port': port,
+      'items': items,
+    });
+  }
+
   Future<Map<String, dynamic>> createProduct(Map<String, dynamic> data) async {
     return await post('products/', data: data);
   }